@@ -0,0 +1,93 @@
+"""
+Planning time and plan quality of the heuristic and knapsack barrel planners
+on synthetic wholesale catalogs. No database is needed; each catalog repeats
+the four barrel sizes of every color with random prices and stock, and the
+shop starts each case with the same random gold and ml.
+
+    python -m benchmarks.barrels_planner
+    python -m benchmarks.barrels_planner --sizes 16 1000 --json
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from collections import namedtuple
+
+from src import wholesale
+
+Barrel = namedtuple("Barrel", "sku ml_per_barrel potion_type price quantity")
+Balance = namedtuple("Balance", "gold red_ml green_ml blue_ml dark_ml")
+
+BARREL_SIZES = {"MINI": 200, "SMALL": 500, "MEDIUM": 2500, "LARGE": 10000}
+COLOR_TYPES = {"RED": [1, 0, 0, 0], "GREEN": [0, 1, 0, 0], "BLUE": [0, 0, 1, 0], "DARK": [0, 0, 0, 1]}
+
+
+def synthetic_catalog(count, rng):
+    catalog = []
+    while len(catalog) < count:
+        for size, ml in BARREL_SIZES.items():
+            for color, potion_type in COLOR_TYPES.items():
+                # Around 0.1 to 0.4 gold per ml, bigger barrels a little cheaper
+                price = max(1, int(ml * rng.uniform(0.1, 0.4) * (0.8 if size == "LARGE" else 1)))
+                catalog.append(Barrel(f"{size}_{color}_BARREL_{len(catalog)}", ml, potion_type, price, rng.randint(0, 20)))
+    return catalog[:count]
+
+
+def time_call(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3)
+    }
+
+
+def plan_totals(catalog, plan):
+    by_sku = {barrel.sku: barrel for barrel in catalog}
+    return {
+        "gold_spent": sum(by_sku[entry["sku"]].price * entry["quantity"] for entry in plan),
+        "ml_bought": sum(by_sku[entry["sku"]].ml_per_barrel * entry["quantity"] for entry in plan),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[16, 100, 1_000, 10_000])
+    parser.add_argument("--gold", type=int, default=5_000)
+    parser.add_argument("--ml-capacity", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    balance = Balance(args.gold, *[rng.randint(0, 5_000) for _ in range(4)])
+
+    results = []
+    for size in args.sizes:
+        catalog = synthetic_catalog(size, rng)
+        for name, planner in wholesale.planners.items():
+            plan = planner(catalog, balance, args.ml_capacity)
+            results.append({
+                "barrels": size,
+                "planner": name,
+                **plan_totals(catalog, plan),
+                **time_call(lambda: planner(catalog, balance, args.ml_capacity), args.repeat)
+            })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'barrels':>8} {'planner':<10} {'gold spent':>11} {'ml bought':>10} {'median ms':>10} {'p95 ms':>10}")
+    for result in results:
+        print(f"{result['barrels']:>8} {result['planner']:<10} {result['gold_spent']:>11} {result['ml_bought']:>10} {result['median_ms']:>10} {result['p95_ms']:>10}")
+
+
+if __name__ == "__main__":
+    main()
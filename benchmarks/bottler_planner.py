@@ -0,0 +1,79 @@
+"""
+Planning time of the greedy and vectorized bottle planners on synthetic
+catalogs of 10 to 10,000 recipes. No database is needed; the potions are
+generated in memory with random recipes, prices and inventory.
+
+    python -m benchmarks.bottler_planner
+    python -m benchmarks.bottler_planner --sizes 100 10000 --json
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+from collections import namedtuple
+
+from src import bottling
+
+Potion = namedtuple("Potion", "sku inventory price num_red_ml num_green_ml num_blue_ml num_dark_ml")
+
+
+def synthetic_potions(count, rng):
+    potions = []
+    for i in range(count):
+        # Four parts of 100 ml in steps of 5 ml
+        cuts = sorted(rng.randint(0, 20) for _ in range(3))
+        parts = [cuts[0], cuts[1] - cuts[0], cuts[2] - cuts[1], 20 - cuts[2]]
+        potions.append(Potion(f"BENCH_{i}", rng.randint(0, 80), rng.randint(20, 80), *[part * 5 for part in parts]))
+    return potions
+
+
+def time_call(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1_000, 10_000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = []
+    for size in args.sizes:
+        potions = synthetic_potions(size, rng)
+        # Enough ml and capacity that most recipes get bottled, so neither
+        # planner can stop early
+        potion_capacity = size * 100
+        ml = (size * 2_000,) * 4
+        for name, planner in bottling.planners.items():
+            plan = planner(potions, ml, potion_capacity)
+            results.append({
+                "recipes": size,
+                "planner": name,
+                "bottles": sum(entry["quantity"] for entry in plan),
+                **time_call(lambda: planner(potions, ml, potion_capacity), args.repeat)
+            })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'recipes':>8} {'planner':<11} {'bottles':>9} {'median ms':>10} {'p95 ms':>10}")
+    for result in results:
+        print(f"{result['recipes']:>8} {result['planner']:<11} {result['bottles']:>9} {result['median_ms']:>10} {result['p95_ms']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Before/after benchmark of the JSON response path on GET /catalog/ and
+GET /carts/search/, the two endpoints customers hit the most.
+
+The app runs in process against BENCHMARK_POSTGRES_URI, which is reset and
+filled with a few hundred checkouts first (through httpx's ASGITransport),
+so point it at a throwaway database. Each endpoint is then called
+--requests times one after the other by handing the ASGI app a request
+directly, so the numbers are the server's side only, and the latency
+percentiles are reported. With --baseline REF the same measurement is also
+run against the app as of that git revision (checked out into a temporary
+worktree), and both are printed side by side:
+
+    BENCHMARK_POSTGRES_URI=postgresql+psycopg2://... python -m benchmarks.json_responses
+    BENCHMARK_POSTGRES_URI=... python -m benchmarks.json_responses --baseline HEAD~1 --requests 5000
+
+Needs httpx.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+import httpx
+from sqlalchemy.engine import make_url
+
+ENDPOINTS = {
+    "GET /catalog/": ("/catalog/", None),
+    "GET /carts/search/": ("/carts/search/", {"sort_col": "timestamp", "sort_order": "desc"}),
+}
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+async def fill_shop(client, customers):
+    """ Reset the shop, bottle potions and check out a cart per customer so search has rows to page. """
+    (await client.post("/admin/reset")).raise_for_status()
+    (await client.post("/barrels/deliver/1", json=[
+        {"sku": f"BENCH_{color}", "ml_per_barrel": 100000, "potion_type": potion_type, "price": 0, "quantity": 1}
+        for color, potion_type in [("RED", [1, 0, 0, 0]), ("GREEN", [0, 1, 0, 0]),
+                                   ("BLUE", [0, 0, 1, 0]), ("DARK", [0, 0, 0, 1])]
+    ])).raise_for_status()
+    # Enough of every potion the bottler would make that the checkouts can't sell one out
+    plan = (await client.post("/bottler/plan")).raise_for_status().json()
+    (await client.post("/bottler/deliver/1", json=[
+        {"potion_type": potion["potion_type"], "quantity": customers + 10} for potion in plan
+    ])).raise_for_status()
+
+    catalog = (await client.get("/catalog/")).raise_for_status().json()
+    visitors = [{"customer_name": f"bench customer {i}", "character_class": "Wizard", "level": 1}
+                for i in range(customers)]
+    (await client.post("/carts/visits/1", json=visitors)).raise_for_status()
+    for visitor in visitors:
+        cart_id = (await client.post("/carts/", json=visitor)).raise_for_status().json()["cart_id"]
+        for item in random.sample(catalog, min(len(catalog), 2)):
+            await client.post(f"/carts/{cart_id}/items/{item['sku']}", json={"quantity": 1})
+        await client.post(f"/carts/{cart_id}/checkout", json={"payment": "gold"})
+
+
+async def call(app, path, query_string, api_key):
+    """ One GET straight through the ASGI app. Returns the status and body. """
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": query_string, "root_path": "",
+        "headers": [(b"host", b"shop"), (b"access_token", api_key)],
+        "client": ("127.0.0.1", 0), "server": ("shop", 80),
+    }
+    response = {"status": None, "body": b""}
+    requested = False
+    done = asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Like a real server, only report the disconnect once the response is sent
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+            if not message.get("more_body", False):
+                done.set()
+
+    await app(scope, receive, send)
+    return response["status"], response["body"]
+
+
+async def measure(args):
+    from src.api.server import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://shop",
+                                 headers={"access_token": os.environ["API_KEY"]}) as client:
+        await fill_shop(client, args.customers)
+
+    api_key = os.environ["API_KEY"].encode()
+    results = {}
+    for name, (path, params) in ENDPOINTS.items():
+        query_string = urlencode(params or {}).encode()
+        for _ in range(args.warmup):
+            status, body = await call(app, path, query_string, api_key)
+            if status != 200:
+                sys.exit(f"{name} returned {status}: {body[:200]}")
+        timings = []
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            request_start = time.perf_counter()
+            status, body = await call(app, path, query_string, api_key)
+            timings.append((time.perf_counter() - request_start) * 1000)
+        elapsed = time.perf_counter() - start
+        timings.sort()
+        results[name] = {
+            "requests": args.requests,
+            "response_bytes": len(body),
+            "throughput_rps": round(args.requests / elapsed, 2),
+            "p50_ms": round(percentile(timings, 0.50), 4),
+            "p95_ms": round(percentile(timings, 0.95), 4),
+            "p99_ms": round(percentile(timings, 0.99), 4),
+        }
+    return results
+
+
+def measure_baseline(args):
+    """ Run this script against the app at args.baseline and return its results. """
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as directory:
+        worktree = os.path.join(directory, "baseline")
+        subprocess.run(["git", "-C", repo, "worktree", "add", "--detach", worktree, args.baseline],
+                       check=True, capture_output=True)
+        try:
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--json", "--requests", str(args.requests),
+                 "--warmup", str(args.warmup), "--customers", str(args.customers), "--seed", str(args.seed)],
+                check=True, capture_output=True, text=True, cwd=worktree,
+                env={**os.environ, "PYTHONPATH": worktree}
+            ).stdout
+        finally:
+            subprocess.run(["git", "-C", repo, "worktree", "remove", "--force", worktree], check=True)
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--customers", type=int, default=200, help="checkouts made before measuring")
+    parser.add_argument("--baseline", help="git revision to compare against, e.g. HEAD~1")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    url = os.environ.get("BENCHMARK_POSTGRES_URI")
+    if not url:
+        sys.exit("Set BENCHMARK_POSTGRES_URI to a scratch database; the benchmark resets the shop.")
+    os.environ["POSTGRES_URI"] = url
+    os.environ["ASYNC_POSTGRES_URI"] = make_url(url).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+    os.environ.setdefault("API_KEY", "json-responses")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    random.seed(args.seed)
+
+    before = measure_baseline(args) if args.baseline else None
+    after = asyncio.run(measure(args))
+
+    if args.json:
+        print(json.dumps({"before": before, "after": after} if before else after, indent=2))
+        return
+
+    if before is None:
+        print(f"{'endpoint':<22} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'bytes':>7}")
+        for name, stats in after.items():
+            print(f"{name:<22} {stats['throughput_rps']:>9} {stats['p50_ms']:>9} {stats['p95_ms']:>9} "
+                  f"{stats['p99_ms']:>9} {stats['response_bytes']:>7}")
+        return
+
+    print(f"baseline {args.baseline} vs working tree, {args.requests} requests per endpoint")
+    print(f"{'endpoint':<22} {'before req/s':>13} {'after req/s':>12} {'before p50':>11} {'after p50':>10} {'speedup':>8}")
+    for name, stats in after.items():
+        old = before[name]
+        print(f"{name:<22} {old['throughput_rps']:>13} {stats['throughput_rps']:>12} {old['p50_ms']:>11} "
+              f"{stats['p50_ms']:>10} {stats['throughput_rps'] / old['throughput_rps']:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
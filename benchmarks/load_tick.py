@@ -0,0 +1,206 @@
+"""
+Load generator that replays a customer tick against the shop, following the
+APISpec purchasing flow for every customer:
+
+    GET /catalog/ -> POST /carts/visits/{visit_id} -> POST /carts/
+    -> POST /carts/{cart_id}/items/{item_sku} -> POST /carts/{cart_id}/checkout
+    -> GET /carts/search/
+
+By default the app runs in process (httpx's ASGITransport, no server
+needed) against BENCHMARK_POSTGRES_URI, which is reset and stocked first,
+so point it at a throwaway database. With --base-url it drives a running
+server instead and only resets it when --reset is given. --snapshot restores
+a snapshot saved with POST /admin/snapshots/{name} instead of stocking.
+
+    BENCHMARK_POSTGRES_URI=postgresql+psycopg2://... python -m benchmarks.load_tick
+    BENCHMARK_POSTGRES_URI=... python -m benchmarks.load_tick --customers 2000 --concurrency 50 --json
+    python -m benchmarks.load_tick --base-url http://localhost:8000 --api-key ... --json
+
+Reports throughput and p50/p95/p99 latency per endpoint. Needs httpx.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+import httpx
+from sqlalchemy.engine import make_url
+
+CLASSES = ["Wizard", "Fighter", "Druid", "Rogue", "Cleric", "Ranger"]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.timings = {}
+        self.errors = {}
+
+    async def call(self, client, name, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            failed = response.status_code >= 400
+        except httpx.HTTPError:
+            response = None
+            failed = True
+        self.timings.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+        if failed:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            return None
+        return response.json()
+
+    def report(self, elapsed):
+        endpoints = {}
+        for name, timings in self.timings.items():
+            timings = sorted(timings)
+            endpoints[name] = {
+                "requests": len(timings),
+                "errors": self.errors.get(name, 0),
+                "throughput_rps": round(len(timings) / elapsed, 2),
+                "p50_ms": round(percentile(timings, 0.50), 3),
+                "p95_ms": round(percentile(timings, 0.95), 3),
+                "p99_ms": round(percentile(timings, 0.99), 3),
+            }
+        return endpoints
+
+
+async def stock_shop(client):
+    """ Reset the shop and bottle a first batch of potions so there is something to buy. """
+    for method, url, body in [
+        ("POST", "/admin/reset", None),
+        ("POST", "/barrels/deliver/1", [
+            {"sku": f"LOAD_{color}", "ml_per_barrel": 10000, "potion_type": potion_type, "price": 0, "quantity": 1}
+            for color, potion_type in [("RED", [1, 0, 0, 0]), ("GREEN", [0, 1, 0, 0]),
+                                       ("BLUE", [0, 0, 1, 0]), ("DARK", [0, 0, 0, 1])]
+        ]),
+    ]:
+        (await client.request(method, url, json=body)).raise_for_status()
+
+    plan = (await client.post("/bottler/plan")).raise_for_status().json()
+    (await client.post("/bottler/deliver/1", json=plan)).raise_for_status()
+
+
+async def customer_visit(client, recorder, semaphore, customer, catalog):
+    async with semaphore:
+        cart = await recorder.call(client, "POST /carts/", "POST", "/carts/", json=customer)
+        if cart is None:
+            return
+        cart_id = cart["cart_id"]
+        for item in random.sample(catalog, min(len(catalog), random.randint(1, 2))):
+            await recorder.call(client, "POST /carts/{cart_id}/items/{item_sku}", "POST",
+                                f"/carts/{cart_id}/items/{item['sku']}", json={"quantity": 1})
+        await recorder.call(client, "POST /carts/{cart_id}/checkout", "POST",
+                            f"/carts/{cart_id}/checkout", json={"payment": "gold"})
+        await recorder.call(client, "GET /carts/search/", "GET", "/carts/search/",
+                            params={"customer_name": customer["customer_name"]})
+
+
+async def run_tick(client, args):
+    recorder = Recorder()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    customers = [
+        {"customer_name": f"load customer {i}", "character_class": random.choice(CLASSES), "level": random.randint(1, 20)}
+        for i in range(args.customers)
+    ]
+
+    start = time.perf_counter()
+
+    # Every customer looks at the catalog first, as the Exchange does
+    async def browse():
+        async with semaphore:
+            return await recorder.call(client, "GET /catalog/", "GET", "/catalog/")
+    catalogs = await asyncio.gather(*(browse() for _ in customers))
+    catalog = next((entry for entry in catalogs if entry), [])
+
+    # Visits are reported in batches, one visit id per batch
+    for visit_id, first in enumerate(range(0, len(customers), args.visit_batch), start=1):
+        await recorder.call(client, "POST /carts/visits/{visit_id}", "POST", f"/carts/visits/{visit_id}",
+                            json=customers[first:first + args.visit_batch])
+
+    if catalog:
+        await asyncio.gather(*(customer_visit(client, recorder, semaphore, customer, catalog) for customer in customers))
+    else:
+        print("The catalog is empty, skipping carts", file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    total = sum(len(timings) for timings in recorder.timings.values())
+    return {
+        "customers": args.customers,
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 2),
+        "endpoints": recorder.report(elapsed),
+    }
+
+
+async def main_async(args):
+    if args.base_url:
+        transport = None
+        base_url = args.base_url
+        api_key = args.api_key or os.environ.get("API_KEY", "")
+    else:
+        from src.api.server import app
+        transport = httpx.ASGITransport(app=app)
+        base_url = "http://shop"
+        api_key = os.environ["API_KEY"]
+
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, headers={"access_token": api_key},
+                                 timeout=args.timeout) as client:
+        if args.snapshot:
+            (await client.post(f"/admin/snapshots/{args.snapshot}/restore")).raise_for_status()
+        elif args.reset or not args.base_url:
+            await stock_shop(client)
+        return await run_tick(client, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--visit-batch", type=int, default=50, help="customers per /carts/visits call")
+    parser.add_argument("--base-url", help="drive a running server instead of the app in process")
+    parser.add_argument("--api-key", help="API key of the running server (default: API_KEY)")
+    parser.add_argument("--reset", action="store_true", help="reset and stock the running server first")
+    parser.add_argument("--snapshot", help="start from this saved shop snapshot instead of a fresh stock")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    if not args.base_url:
+        url = os.environ.get("BENCHMARK_POSTGRES_URI")
+        if not url:
+            sys.exit("Set BENCHMARK_POSTGRES_URI to a scratch database (the shop is reset), or pass --base-url.")
+        os.environ["POSTGRES_URI"] = url
+        os.environ["ASYNC_POSTGRES_URI"] = make_url(url).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+        os.environ.setdefault("API_KEY", "load-tick")
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    result = asyncio.run(main_async(args))
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print(f"{result['customers']} customers, concurrency {result['concurrency']}: "
+          f"{result['requests']} requests in {result['elapsed_s']} s ({result['throughput_rps']} req/s)")
+    print(f"{'endpoint':<40} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, stats in result["endpoints"].items():
+        print(f"{name:<40} {stats['requests']:>9} {stats['errors']:>7} {stats['throughput_rps']:>8} "
+              f"{stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Latency benchmark for /carts/search/ at growing numbers of line items.
+
+Seeds a scratch database with synthetic customers, carts and line items and
+times the first page, a deep page reached through the next tokens, and the
+customer name and potion filters.
+
+The seeding TRUNCATEs customers, carts and cart_items, so point it at a
+throwaway database, never at the shop:
+
+    BENCHMARK_POSTGRES_URI=postgresql+psycopg2://... python -m benchmarks.search_orders
+    BENCHMARK_POSTGRES_URI=... python -m benchmarks.search_orders --sizes 10000 100000 --json
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+import sqlalchemy
+from sqlalchemy.engine import make_url
+
+SEED_SQL = """
+TRUNCATE TABLE cart_items, carts, customers RESTART IDENTITY CASCADE;
+
+INSERT INTO potions_inventory(sku, price, potion_type, potion_name, num_red_ml, num_green_ml, num_blue_ml, num_dark_ml)
+SELECT 'BENCH_' || i, 20 + i, ARRAY[100 - i, i, 0, 0], 'bench potion ' || i, 100 - i, i, 0, 0
+FROM generate_series(1, 20) AS i
+WHERE NOT EXISTS (SELECT 1 FROM potions_inventory);
+
+INSERT INTO customers(customer_name, customer_class, level)
+SELECT 'customer ' || md5(i::text), (ARRAY['Wizard', 'Fighter', 'Druid', 'Rogue'])[1 + i % 4], 1 + i % 20
+FROM generate_series(1, :customers) AS i;
+
+INSERT INTO carts(customer_id, created_at)
+SELECT 1 + i % :customers, now() - i * interval '1 second'
+FROM generate_series(1, :carts) AS i;
+
+INSERT INTO cart_items(cart_id, potion_id, qty, added_at, gold_paid)
+SELECT carts.id, potions.potion_id, 1 + (carts.id + potions.n) % 5, carts.created_at,
+    (1 + (carts.id + potions.n) % 5) * potions.price
+FROM carts
+CROSS JOIN generate_series(0, 1) AS item(n)
+JOIN (
+    SELECT potion_id, price, row_number() OVER (ORDER BY potion_id) - 1 AS n, count(*) OVER () AS total
+    FROM potions_inventory
+) AS potions ON potions.n = (carts.id + item.n) % potions.total;
+
+ANALYZE customers;
+ANALYZE carts;
+ANALYZE cart_items;
+ANALYZE potions_inventory;
+"""
+
+
+def seed(connection, line_items):
+    carts = line_items // 2
+    customers = max(100, line_items // 20)
+    for statement in SEED_SQL.split(";"):
+        if statement.strip():
+            connection.execute(sqlalchemy.text(statement), {"customers": customers, "carts": carts})
+
+
+def time_call(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3)
+    }
+
+
+def deep_page_token(search_orders, pages):
+    token = ""
+    for _ in range(pages):
+        token = search_orders(search_page=token)["next"]
+    return token
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--deep-page", type=int, default=50, help="how many next pages to follow for the deep page case")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    url = os.environ.get("BENCHMARK_POSTGRES_URI")
+    if not url:
+        sys.exit("Set BENCHMARK_POSTGRES_URI to a scratch database; the benchmark truncates the cart tables.")
+    os.environ["POSTGRES_URI"] = url
+    os.environ["ASYNC_POSTGRES_URI"] = make_url(url).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+
+    from src import database as db
+    from src.api import carts
+
+    # The async engine's pool belongs to one event loop, so every call runs on this one
+    loop = asyncio.new_event_loop()
+
+    def search_orders(**filters):
+        return loop.run_until_complete(carts.search_orders(
+            customer_name=filters.get("customer_name", ""),
+            potion_sku=filters.get("potion_sku", ""),
+            search_page=filters.get("search_page", ""),
+            sort_col=carts.search_sort_options.timestamp,
+            sort_order=carts.search_sort_order.desc,
+        ))
+
+    results = []
+    for size in args.sizes:
+        with db.engine.begin() as connection:
+            seed(connection, size)
+
+            potion_name = connection.execute(sqlalchemy.text(
+                "SELECT potion_name FROM potions_inventory ORDER BY potion_id LIMIT 1"
+            )).scalar_one()
+        potion_filter = potion_name[:4]
+
+        deep_token = deep_page_token(search_orders, args.deep_page)
+        cases = {
+            "first_page": lambda: search_orders(),
+            f"page_{args.deep_page + 1}": lambda: search_orders(search_page=deep_token),
+            "customer_filter": lambda: search_orders(customer_name="ab12"),
+            "potion_filter": lambda: search_orders(potion_sku=potion_filter),
+            "both_filters": lambda: search_orders(customer_name="ab", potion_sku=potion_filter),
+        }
+        for case, function in cases.items():
+            function()
+            results.append({"line_items": size, "case": case, **time_call(function, args.repeat)})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'line items':>12} {'case':<18} {'median ms':>10} {'p95 ms':>10}")
+    for result in results:
+        print(f"{result['line_items']:>12} {result['case']:<18} {result['median_ms']:>10} {result['p95_ms']:>10}")
+
+
+if __name__ == "__main__":
+    main()
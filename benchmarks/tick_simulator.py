@@ -0,0 +1,233 @@
+"""
+Offline simulator that runs the shop for many game ticks against a scratch
+database and records how the planners slow down as the ledgers grow.
+
+Each tick follows the Exchange's schedule: the time is posted to
+/info/current_time, every other tick the shop buys barrels (from
+src/api/barrel_catalog.txt) and bottles potions, once a day it plans and
+buys capacity, and every tick a batch of synthetic customers goes through
+the purchasing flow, more of them in the daytime. There are 12 ticks a day
+and 7 days a week.
+
+After every tick it writes one CSV row with the latency of each planner
+call, of the full-ledger balance check and of the catalog, and the row
+counts of the ledger tables. With --chart (needs matplotlib) it also plots
+them against simulated weeks.
+
+The plans are normally answered from memory: precomputed when the time is
+posted (src/precompute.py) or served from the response caches. That would
+make the planner columns measure cache hits, so both are turned off for
+the run and every planner call computes its plan. --plan-caches leaves them
+on, to see the latency the Exchange actually gets.
+
+The shop is reset and given a first batch of potions (or restored from
+--from-snapshot), so point it at a throwaway database. --save-snapshot keeps
+the final state for later runs and benchmarks:
+
+    BENCHMARK_POSTGRES_URI=postgresql+psycopg2://... python -m benchmarks.tick_simulator --weeks 4
+    BENCHMARK_POSTGRES_URI=... python -m benchmarks.tick_simulator --weeks 12 --csv ticks.csv --chart ticks.png
+    BENCHMARK_POSTGRES_URI=... python -m benchmarks.tick_simulator --weeks 8 --save-snapshot week8
+
+Needs httpx.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import random
+import sys
+import time
+
+import httpx
+import sqlalchemy
+from sqlalchemy.engine import make_url
+
+from benchmarks.load_tick import CLASSES, Recorder, customer_visit, stock_shop
+
+DAYS = ["Edgeday", "Bloomday", "Arcanaday", "Hearthday", "Crownday", "Blesseday", "Soulday"]
+HOURS = list(range(0, 24, 2))
+
+LEDGERS = ["gold_ledger", "ml_ledger", "potion_ledger", "carts", "cart_items"]
+
+TIMED = [
+    "POST /barrels/plan",
+    "POST /bottler/plan",
+    "POST /inventory/plan",
+    "GET /catalog/",
+    "GET /admin/balances/check",
+]
+
+CATALOG_PATH = os.path.join(os.path.dirname(__file__), "..", "src", "api", "barrel_catalog.txt")
+
+
+def customers_at(hour, peak):
+    """ Fewer customers at night, most around midday. """
+    return max(1, int(peak * (1 - abs(hour - 12) / 14)))
+
+
+def ledger_sizes(engine):
+    with engine.connect() as connection:
+        row = connection.execute(sqlalchemy.text(
+            "SELECT " + ", ".join(f"(SELECT count(*) FROM {table}) AS {table}" for table in LEDGERS)
+        )).one()
+    return dict(row._mapping)
+
+
+async def timed(client, name, method, url, **kwargs):
+    start = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    elapsed = (time.perf_counter() - start) * 1000
+    response.raise_for_status()
+    return response.json(), elapsed
+
+
+async def run_tick(client, tick, args, barrel_catalog, next_customer):
+    day = DAYS[(tick // len(HOURS)) % len(DAYS)]
+    hour = HOURS[tick % len(HOURS)]
+    row = {"tick": tick, "week": round(tick / (len(HOURS) * len(DAYS)), 3), "day": day, "hour": hour}
+
+    await timed(client, "info", "POST", "/info/current_time", json={"day": day, "hour": hour})
+
+    if tick % 2 == 0:
+        purchase_plan, row["POST /barrels/plan"] = await timed(client, "barrels", "POST", "/barrels/plan", json=barrel_catalog)
+        by_sku = {barrel["sku"]: barrel for barrel in barrel_catalog}
+        delivered = [{**by_sku[entry["sku"]], "quantity": entry["quantity"]} for entry in purchase_plan]
+        if delivered:
+            await timed(client, "barrels", "POST", f"/barrels/deliver/{tick}", json=delivered)
+
+        bottle_plan, row["POST /bottler/plan"] = await timed(client, "bottler", "POST", "/bottler/plan")
+        if bottle_plan:
+            await timed(client, "bottler", "POST", f"/bottler/deliver/{tick}", json=bottle_plan)
+
+    if hour == 0:
+        capacity_plan, row["POST /inventory/plan"] = await timed(client, "inventory", "POST", "/inventory/plan")
+        await timed(client, "inventory", "POST", f"/inventory/deliver/{tick}", json=capacity_plan)
+
+    catalog, row["GET /catalog/"] = await timed(client, "catalog", "GET", "/catalog/")
+
+    customers = []
+    for _ in range(customers_at(hour, args.peak_customers)):
+        # Regulars come back; every so often someone new shows up
+        if next_customer[0] == 0 or random.random() < 0.3:
+            next_customer[0] += 1
+        customers.append({
+            "customer_name": f"sim customer {random.randint(1, next_customer[0])}",
+            "character_class": random.choice(CLASSES),
+            "level": random.randint(1, 20)
+        })
+    if customers:
+        await timed(client, "visits", "POST", f"/carts/visits/{tick}", json=customers)
+    if catalog:
+        recorder = Recorder()
+        semaphore = asyncio.Semaphore(args.concurrency)
+        await asyncio.gather(*(customer_visit(client, recorder, semaphore, customer, catalog) for customer in customers))
+        row["checkouts"] = len(recorder.timings.get("POST /carts/{cart_id}/checkout", []))
+
+    _, row["GET /admin/balances/check"] = await timed(client, "check", "GET", "/admin/balances/check")
+    return row
+
+
+async def simulate(args, writer, engine):
+    from src.api.server import app
+
+    with open(CATALOG_PATH) as catalog_file:
+        barrel_catalog = json.load(catalog_file)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://shop",
+                                 headers={"access_token": os.environ["API_KEY"]}, timeout=60) as client:
+        if args.from_snapshot:
+            (await client.post(f"/admin/snapshots/{args.from_snapshot}/restore")).raise_for_status()
+        else:
+            # A fresh shop's 100 gold buys no barrels, so start it off the way
+            # the load generator does and let sales pay for the rest
+            await stock_shop(client)
+
+        rows = []
+        next_customer = [0]
+        ticks = args.weeks * len(DAYS) * len(HOURS)
+        for tick in range(ticks):
+            row = await run_tick(client, tick, args, barrel_catalog, next_customer)
+            row.update(ledger_sizes(engine))
+            writer.writerow(row)
+            rows.append(row)
+            if tick % len(HOURS) == 0:
+                print(f"tick {tick}/{ticks} week {row['week']}: gold_ledger {row['gold_ledger']} rows, "
+                      f"balance check {row['GET /admin/balances/check']:.1f} ms", file=sys.stderr)
+
+        if args.save_snapshot:
+            (await client.post(f"/admin/snapshots/{args.save_snapshot}")).raise_for_status()
+        return rows
+
+
+def chart(rows, path):
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib import pyplot
+
+    figure, (latency_axes, size_axes) = pyplot.subplots(2, 1, sharex=True, figsize=(10, 8))
+    for name in TIMED:
+        points = [(row["week"], row[name]) for row in rows if row.get(name) is not None]
+        if points:
+            latency_axes.plot(*zip(*points), label=name, linewidth=0.8)
+    latency_axes.set_ylabel("latency (ms)")
+    latency_axes.set_yscale("log")
+    latency_axes.legend(fontsize="small")
+
+    for table in LEDGERS:
+        size_axes.plot([row["week"] for row in rows], [row[table] for row in rows], label=table)
+    size_axes.set_ylabel("rows")
+    size_axes.set_xlabel("simulated weeks")
+    size_axes.legend(fontsize="small")
+
+    figure.tight_layout()
+    figure.savefig(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--weeks", type=int, default=4)
+    parser.add_argument("--peak-customers", type=int, default=12, help="customers in the midday tick")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--csv", default="-", help="where to write the per tick rows (default: stdout)")
+    parser.add_argument("--chart", help="also plot the run to this image file (needs matplotlib)")
+    parser.add_argument("--from-snapshot", help="start from this saved shop snapshot instead of a fresh shop")
+    parser.add_argument("--save-snapshot", help="save the shop as this snapshot after the last tick")
+    parser.add_argument("--plan-caches", action="store_true",
+                        help="keep plan precomputation and the response caches on")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    url = os.environ.get("BENCHMARK_POSTGRES_URI")
+    if not url:
+        sys.exit("Set BENCHMARK_POSTGRES_URI to a scratch database; the simulator resets the shop.")
+    os.environ["POSTGRES_URI"] = url
+    os.environ["ASYNC_POSTGRES_URI"] = make_url(url).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+    os.environ.setdefault("API_KEY", "tick-simulator")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if not args.plan_caches:
+        # Read when the app is imported
+        os.environ["PLAN_PRECOMPUTE"] = "off"
+        os.environ["RESPONSE_CACHE_TTL"] = "0"
+
+    random.seed(args.seed)
+
+    from src import database as db
+
+    fields = ["tick", "week", "day", "hour", *TIMED, "checkouts", *LEDGERS]
+    output = sys.stdout if args.csv == "-" else open(args.csv, "w", newline="")
+    try:
+        writer = csv.DictWriter(output, fieldnames=fields)
+        writer.writeheader()
+        rows = asyncio.run(simulate(args, writer, db.engine))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    if args.chart:
+        chart(rows, args.chart)
+
+
+if __name__ == "__main__":
+    main()
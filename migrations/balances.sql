@@ -0,0 +1,50 @@
+-- Adds the shop_balances and potion_balances tables from schema.sql to an
+-- existing database and fills them from its ledgers. Run it with the shop
+-- stopped, since a sale made while it runs could be missed by the backfill:
+--
+--   psql "$POSTGRES_URI" -v ON_ERROR_STOP=1 -1 -f migrations/balances.sql
+--
+-- Running it again recomputes the balances, like POST /admin/balances/rebuild.
+
+create table if not exists
+  public.shop_balances (
+    id integer not null default 1,
+    gold bigint not null default 0,
+    red_ml bigint not null default 0,
+    green_ml bigint not null default 0,
+    blue_ml bigint not null default 0,
+    dark_ml bigint not null default 0,
+    constraint shop_balances_pkey primary key (id),
+    constraint shop_balances_single_row check (id = 1)
+  ) tablespace pg_default;
+
+create table if not exists
+  public.potion_balances (
+    potion_id integer not null,
+    quantity bigint not null default 0,
+    constraint potion_balances_pkey primary key (potion_id),
+    constraint potion_balances_potion_id_fkey foreign key (potion_id) references potions_inventory (potion_id)
+  ) tablespace pg_default;
+
+insert into public.shop_balances (id, gold, red_ml, green_ml, blue_ml, dark_ml)
+select 1,
+  (select coalesce(sum(gold_change), 0) from public.gold_ledger),
+  coalesce(sum(red_ml_change), 0),
+  coalesce(sum(green_ml_change), 0),
+  coalesce(sum(blue_ml_change), 0),
+  coalesce(sum(dark_ml_change), 0)
+from public.ml_ledger
+on conflict (id) do update
+set gold = excluded.gold,
+  red_ml = excluded.red_ml,
+  green_ml = excluded.green_ml,
+  blue_ml = excluded.blue_ml,
+  dark_ml = excluded.dark_ml;
+
+insert into public.potion_balances (potion_id, quantity)
+select potions_inventory.potion_id, coalesce(sum(potion_ledger.potion_change), 0)
+from public.potions_inventory
+left join public.potion_ledger on potion_ledger.potion_id = potions_inventory.potion_id
+group by potions_inventory.potion_id
+on conflict (potion_id) do update
+set quantity = excluded.quantity;
@@ -0,0 +1,165 @@
+-- Converts the ledgers of an existing database into tables partitioned by
+-- month of created_at, as schema.sql now declares them. Create the
+-- create_ledger_partitions function from the end of schema.sql before
+-- running it. Each ledger is copied into a new partitioned table with the
+-- same ids, so every ledger sum and the running balances stay as they were.
+-- Run it in one go with the shop stopped:
+--
+--   psql "$POSTGRES_URI" -v ON_ERROR_STOP=1 -1 -f migrations/partition_ledgers.sql
+--
+-- Partitioned tables need the partition key in the primary key, so it
+-- becomes (id, created_at). ml_ledger.created_at was nullable; rows without
+-- one are kept with created_at '-infinity' (in the default partition).
+
+-- gold_ledger
+alter table public.gold_ledger rename to gold_ledger_unpartitioned;
+alter table public.gold_ledger_unpartitioned rename constraint gold_ledger_pkey to gold_ledger_unpartitioned_pkey;
+
+create table
+  public.gold_ledger (
+    id bigint generated by default as identity not null,
+    gold_change integer null default 0,
+    created_at timestamp with time zone not null default now(),
+    constraint gold_ledger_pkey primary key (id, created_at)
+  ) partition by range (created_at);
+
+create table public.gold_ledger_default partition of public.gold_ledger default;
+
+select public.create_ledger_partitions(
+  'gold_ledger',
+  coalesce((select min(created_at) from public.gold_ledger_unpartitioned where created_at > '-infinity'), now())::date,
+  (current_date + interval '2 months')::date
+);
+
+insert into public.gold_ledger (id, gold_change, created_at) overriding system value
+select id, gold_change, created_at
+from public.gold_ledger_unpartitioned;
+
+select setval(pg_get_serial_sequence('public.gold_ledger', 'id'), coalesce(max(id), 0) + 1, false)
+from public.gold_ledger;
+
+drop table public.gold_ledger_unpartitioned;
+
+-- ml_ledger
+alter table public.ml_ledger rename to ml_ledger_unpartitioned;
+alter table public.ml_ledger_unpartitioned rename constraint ml_ledge_pkey to ml_ledger_unpartitioned_pkey;
+
+create table
+  public.ml_ledger (
+    id bigint generated by default as identity not null,
+    red_ml_change bigint null default '0'::bigint,
+    green_ml_change bigint null default '0'::bigint,
+    blue_ml_change bigint null default '0'::bigint,
+    dark_ml_change bigint null default '0'::bigint,
+    wrong_created_at time without time zone not null default now(),
+    created_at timestamp with time zone not null default (now() at time zone 'utc'::text),
+    constraint ml_ledge_pkey primary key (id, created_at)
+  ) partition by range (created_at);
+
+create table public.ml_ledger_default partition of public.ml_ledger default;
+
+select public.create_ledger_partitions(
+  'ml_ledger',
+  coalesce((select min(created_at) from public.ml_ledger_unpartitioned where created_at > '-infinity'), now())::date,
+  (current_date + interval '2 months')::date
+);
+
+insert into public.ml_ledger (id, red_ml_change, green_ml_change, blue_ml_change, dark_ml_change, wrong_created_at, created_at) overriding system value
+select id, red_ml_change, green_ml_change, blue_ml_change, dark_ml_change, wrong_created_at,
+  coalesce(created_at, '-infinity')
+from public.ml_ledger_unpartitioned;
+
+select setval(pg_get_serial_sequence('public.ml_ledger', 'id'), coalesce(max(id), 0) + 1, false)
+from public.ml_ledger;
+
+drop table public.ml_ledger_unpartitioned;
+
+-- potion_ledger
+alter table public.potion_ledger rename to potion_ledger_unpartitioned;
+alter table public.potion_ledger_unpartitioned rename constraint potion_ledger_pkey to potion_ledger_unpartitioned_pkey;
+alter table public.potion_ledger_unpartitioned drop constraint potion_ledger_potion_id_fkey;
+
+create table
+  public.potion_ledger (
+    id bigint generated by default as identity not null,
+    created_at timestamp with time zone not null default now(),
+    potion_id integer null default 0,
+    potion_change bigint null default '0'::bigint,
+    constraint potion_ledger_pkey primary key (id, created_at),
+    constraint potion_ledger_potion_id_fkey foreign key (potion_id) references potions_inventory (potion_id)
+  ) partition by range (created_at);
+
+create table public.potion_ledger_default partition of public.potion_ledger default;
+
+select public.create_ledger_partitions(
+  'potion_ledger',
+  coalesce((select min(created_at) from public.potion_ledger_unpartitioned where created_at > '-infinity'), now())::date,
+  (current_date + interval '2 months')::date
+);
+
+insert into public.potion_ledger (id, created_at, potion_id, potion_change) overriding system value
+select id, created_at, potion_id, potion_change
+from public.potion_ledger_unpartitioned;
+
+select setval(pg_get_serial_sequence('public.potion_ledger', 'id'), coalesce(max(id), 0) + 1, false)
+from public.potion_ledger;
+
+drop table public.potion_ledger_unpartitioned;
+
+-- ml_c_ledger
+alter table public.ml_c_ledger rename to ml_c_ledger_unpartitioned;
+alter table public.ml_c_ledger_unpartitioned rename constraint ml_c_ledger_pkey to ml_c_ledger_unpartitioned_pkey;
+
+create table
+  public.ml_c_ledger (
+    id bigint generated by default as identity not null,
+    ml_c_change integer null default 0,
+    created_at timestamp with time zone not null default now(),
+    constraint ml_c_ledger_pkey primary key (id, created_at)
+  ) partition by range (created_at);
+
+create table public.ml_c_ledger_default partition of public.ml_c_ledger default;
+
+select public.create_ledger_partitions(
+  'ml_c_ledger',
+  coalesce((select min(created_at) from public.ml_c_ledger_unpartitioned where created_at > '-infinity'), now())::date,
+  (current_date + interval '2 months')::date
+);
+
+insert into public.ml_c_ledger (id, ml_c_change, created_at) overriding system value
+select id, ml_c_change, created_at
+from public.ml_c_ledger_unpartitioned;
+
+select setval(pg_get_serial_sequence('public.ml_c_ledger', 'id'), coalesce(max(id), 0) + 1, false)
+from public.ml_c_ledger;
+
+drop table public.ml_c_ledger_unpartitioned;
+
+-- potion_c_ledger
+alter table public.potion_c_ledger rename to potion_c_ledger_unpartitioned;
+alter table public.potion_c_ledger_unpartitioned rename constraint potion_c_ledger_pkey to potion_c_ledger_unpartitioned_pkey;
+
+create table
+  public.potion_c_ledger (
+    id bigint generated by default as identity not null,
+    created_at timestamp with time zone not null default now(),
+    potion_c_change integer null default 0,
+    constraint potion_c_ledger_pkey primary key (id, created_at)
+  ) partition by range (created_at);
+
+create table public.potion_c_ledger_default partition of public.potion_c_ledger default;
+
+select public.create_ledger_partitions(
+  'potion_c_ledger',
+  coalesce((select min(created_at) from public.potion_c_ledger_unpartitioned where created_at > '-infinity'), now())::date,
+  (current_date + interval '2 months')::date
+);
+
+insert into public.potion_c_ledger (id, created_at, potion_c_change) overriding system value
+select id, created_at, potion_c_change
+from public.potion_c_ledger_unpartitioned;
+
+select setval(pg_get_serial_sequence('public.potion_c_ledger', 'id'), coalesce(max(id), 0) + 1, false)
+from public.potion_c_ledger;
+
+drop table public.potion_c_ledger_unpartitioned;
@@ -0,0 +1,31 @@
+-- Adds the game_time and potion_sales tables from schema.sql to an existing
+-- database. potion_sales starts empty: carts don't record the game time they
+-- were checked out in, so past sales can't be put under a weekday and hour,
+-- and the catalog and bottler keep their fixed orders until new sales come in.
+--
+--   psql "$POSTGRES_URI" -v ON_ERROR_STOP=1 -1 -f migrations/potion_sales.sql
+
+create table if not exists
+  public.game_time (
+    id integer not null default 1,
+    day text not null,
+    hour integer not null,
+    updated_at timestamp with time zone not null default now(),
+    constraint game_time_pkey primary key (id),
+    constraint game_time_single_row check (id = 1)
+  ) tablespace pg_default;
+
+create table if not exists
+  public.potion_sales (
+    potion_id integer not null,
+    weekday text not null,
+    hour integer not null,
+    customer_class text not null,
+    quantity bigint not null default 0,
+    gold bigint not null default 0,
+    constraint potion_sales_pkey primary key (potion_id, weekday, hour, customer_class),
+    constraint potion_sales_potion_id_fkey foreign key (potion_id) references potions_inventory (potion_id)
+  ) tablespace pg_default;
+
+create index if not exists potion_sales_weekday_hour_idx
+  on public.potion_sales (weekday, hour);
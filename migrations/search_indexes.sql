@@ -0,0 +1,26 @@
+-- Adds the /carts/search/ indexes from schema.sql to an existing database.
+-- pg_trgm has to be available on the server (it is on Supabase). Every
+-- statement is a no-op if it has already been applied:
+--
+--   psql "$POSTGRES_URI" -v ON_ERROR_STOP=1 -f migrations/search_indexes.sql
+--
+-- The trigram indexes let the ILIKE '%...%' filters on customer and potion
+-- names use an index, and the join indexes let the matching rows be joined
+-- to cart_items without a full scan.
+
+create extension if not exists pg_trgm;
+
+create index if not exists customers_customer_name_trgm_idx
+  on public.customers using gin (customer_name gin_trgm_ops);
+
+create index if not exists potions_inventory_potion_name_trgm_idx
+  on public.potions_inventory using gin (potion_name gin_trgm_ops);
+
+create index if not exists carts_customer_id_idx
+  on public.carts (customer_id);
+
+create index if not exists cart_items_potion_id_idx
+  on public.cart_items (potion_id);
+
+create index if not exists cart_items_added_at_id_idx
+  on public.cart_items (added_at, id);
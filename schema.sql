@@ -18,9 +18,9 @@ create table
     created_at timestamp with time zone not null default now(),
     potion_id integer null default 0,
     potion_change bigint null default '0'::bigint,
-    constraint potion_ledger_pkey primary key (id),
+    constraint potion_ledger_pkey primary key (id, created_at),
     constraint potion_ledger_potion_id_fkey foreign key (potion_id) references potions_inventory (potion_id)
-  ) tablespace pg_default;
+  ) partition by range (created_at);
 
 create table
   public.ml_ledger (
@@ -30,33 +30,33 @@ create table
     blue_ml_change bigint null default '0'::bigint,
     dark_ml_change bigint null default '0'::bigint,
     wrong_created_at time without time zone not null default now(),
-    created_at timestamp with time zone null default (now() at time zone 'utc'::text),
-    constraint ml_ledge_pkey primary key (id)
-  ) tablespace pg_default;
+    created_at timestamp with time zone not null default (now() at time zone 'utc'::text),
+    constraint ml_ledge_pkey primary key (id, created_at)
+  ) partition by range (created_at);
 
 create table
   public.potion_c_ledger (
     id bigint generated by default as identity not null,
     created_at timestamp with time zone not null default now(),
     potion_c_change integer null default 0,
-    constraint potion_c_ledger_pkey primary key (id)
-  ) tablespace pg_default;
+    constraint potion_c_ledger_pkey primary key (id, created_at)
+  ) partition by range (created_at);
 
 create table
   public.ml_c_ledger (
     id bigint generated by default as identity not null,
     ml_c_change integer null default 0,
     created_at timestamp with time zone not null default now(),
-    constraint ml_c_ledger_pkey primary key (id)
-  ) tablespace pg_default;
+    constraint ml_c_ledger_pkey primary key (id, created_at)
+  ) partition by range (created_at);
 
   create table
   public.gold_ledger (
     id bigint generated by default as identity not null,
     gold_change integer null default 0,
     created_at timestamp with time zone not null default now(),
-    constraint gold_ledger_pkey primary key (id)
-  ) tablespace pg_default;
+    constraint gold_ledger_pkey primary key (id, created_at)
+  ) partition by range (created_at);
 
   create table
   public.customers (
@@ -94,8 +94,147 @@ create table
     cart_id bigint null,
     potion_id bigint null,
     added_at timestamp with time zone not null default (now() at time zone 'utc'::text),
+    gold_paid integer null,
     constraint cart_items_pkey primary key (id),
     constraint unique_cart_potion unique (cart_id, potion_id),
     constraint cart_items_cart_id_fkey foreign key (cart_id) references carts (id),
     constraint cart_items_potion_id_fkey foreign key (potion_id) references potions_inventory (potion_id)
-  ) tablespace pg_default;
\ No newline at end of file
+  ) tablespace pg_default;
+
+-- Running balances, kept up to date alongside every ledger insert so reads
+-- don't have to SUM the whole ledger history. See src/balances.py.
+create table
+  public.shop_balances (
+    id integer not null default 1,
+    gold bigint not null default 0,
+    red_ml bigint not null default 0,
+    green_ml bigint not null default 0,
+    blue_ml bigint not null default 0,
+    dark_ml bigint not null default 0,
+    constraint shop_balances_pkey primary key (id),
+    constraint shop_balances_single_row check (id = 1)
+  ) tablespace pg_default;
+
+create table
+  public.potion_balances (
+    potion_id integer not null,
+    quantity bigint not null default 0,
+    constraint potion_balances_pkey primary key (potion_id),
+    constraint potion_balances_potion_id_fkey foreign key (potion_id) references potions_inventory (potion_id)
+  ) tablespace pg_default;
+
+-- Backfill the balances from the existing ledgers
+insert into public.shop_balances (id, gold, red_ml, green_ml, blue_ml, dark_ml)
+select 1,
+  (select coalesce(sum(gold_change), 0) from public.gold_ledger),
+  coalesce(sum(red_ml_change), 0),
+  coalesce(sum(green_ml_change), 0),
+  coalesce(sum(blue_ml_change), 0),
+  coalesce(sum(dark_ml_change), 0)
+from public.ml_ledger;
+
+insert into public.potion_balances (potion_id, quantity)
+select potions_inventory.potion_id, coalesce(sum(potion_ledger.potion_change), 0)
+from public.potions_inventory
+left join public.potion_ledger on potion_ledger.potion_id = potions_inventory.potion_id
+group by potions_inventory.potion_id;
+
+-- The game time last sent to /info/current_time, one row.
+create table
+  public.game_time (
+    id integer not null default 1,
+    day text not null,
+    hour integer not null,
+    updated_at timestamp with time zone not null default now(),
+    constraint game_time_pkey primary key (id),
+    constraint game_time_single_row check (id = 1)
+  ) tablespace pg_default;
+
+-- Potions sold per game weekday, hour and customer class, added to by every
+-- checkout so the catalog and bottler can rank potions by demand without
+-- scanning cart_items. Sales made before game_time has a row aren't counted.
+create table
+  public.potion_sales (
+    potion_id integer not null,
+    weekday text not null,
+    hour integer not null,
+    customer_class text not null,
+    quantity bigint not null default 0,
+    gold bigint not null default 0,
+    constraint potion_sales_pkey primary key (potion_id, weekday, hour, customer_class),
+    constraint potion_sales_potion_id_fkey foreign key (potion_id) references potions_inventory (potion_id)
+  ) tablespace pg_default;
+
+create index if not exists potion_sales_weekday_hour_idx
+  on public.potion_sales (weekday, hour);
+
+-- Indexes for /carts/search/. The trigram indexes let the ILIKE '%...%'
+-- filters on customer and potion names use an index, and the join indexes
+-- let the matching rows be joined to cart_items without a full scan.
+create extension if not exists pg_trgm;
+
+create index if not exists customers_customer_name_trgm_idx
+  on public.customers using gin (customer_name gin_trgm_ops);
+
+create index if not exists potions_inventory_potion_name_trgm_idx
+  on public.potions_inventory using gin (potion_name gin_trgm_ops);
+
+create index if not exists carts_customer_id_idx
+  on public.carts (customer_id);
+
+create index if not exists cart_items_potion_id_idx
+  on public.cart_items (potion_id);
+
+create index if not exists cart_items_added_at_id_idx
+  on public.cart_items (added_at, id);
+
+-- The ledgers are partitioned by month of created_at (gold_ledger_2026_10,
+-- ...), with a default partition for anything outside them, so months that
+-- have been compacted (see src/ledgers.py) can be dropped as whole tables.
+-- Existing databases are converted by migrations/partition_ledgers.sql.
+--
+-- Creates the monthly partitions of a ledger from first_month through
+-- last_month that don't exist yet and returns their names. A month that
+-- already has rows in the default partition is skipped, since Postgres won't
+-- create a partition over rows the default holds.
+create or replace function public.create_ledger_partitions(ledger text, first_month date, last_month date)
+returns setof text
+language plpgsql
+as $$
+declare
+  -- The partitions go in the ledger's own schema (see src/tenants.py)
+  ledger_schema text := (select relnamespace::regnamespace::text from pg_class where oid = to_regclass(ledger));
+  month timestamp with time zone := date_trunc('month', first_month);
+  partition text;
+  in_default boolean;
+begin
+  while month <= last_month loop
+    partition := ledger || '_' || to_char(month, 'YYYY_MM');
+    if to_regclass(format('%I.%I', ledger_schema, partition)) is null then
+      execute format(
+        'select exists (select 1 from %I.%I where created_at >= %L and created_at < %L)',
+        ledger_schema, ledger || '_default', month, month + interval '1 month'
+      ) into in_default;
+      if in_default then
+        raise notice '% has rows for % in its default partition, not creating %', ledger, to_char(month, 'YYYY-MM'), partition;
+      else
+        execute format(
+          'create table %I.%I partition of %I.%I for values from (%L) to (%L)',
+          ledger_schema, partition, ledger_schema, ledger, month, month + interval '1 month'
+        );
+        return next partition;
+      end if;
+    end if;
+    month := month + interval '1 month';
+  end loop;
+end;
+$$;
+
+create table if not exists public.gold_ledger_default partition of public.gold_ledger default;
+create table if not exists public.ml_ledger_default partition of public.ml_ledger default;
+create table if not exists public.potion_ledger_default partition of public.potion_ledger default;
+create table if not exists public.ml_c_ledger_default partition of public.ml_c_ledger default;
+create table if not exists public.potion_c_ledger_default partition of public.potion_c_ledger default;
+
+select public.create_ledger_partitions(ledger, current_date, (current_date + interval '2 months')::date)
+from unnest(array['gold_ledger', 'ml_ledger', 'potion_ledger', 'ml_c_ledger', 'potion_c_ledger']) as ledger;
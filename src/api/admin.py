@@ -1,6 +1,16 @@
+import time
 import sqlalchemy
 from src import database as db
-from fastapi import APIRouter, Depends, Request
+from src import balances
+from src import cache
+from src import potion_index
+from src import cart_store
+from src import metrics
+from src import ledgers
+from src import log
+from src import snapshots
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from src.api import auth
 
@@ -10,50 +20,30 @@ router = APIRouter(
     dependencies=[Depends(auth.get_api_key)],
 )
 
+logger = log.get_logger(__name__)
+
 @router.post("/reset")
-def reset():
+async def reset():
     """
     Reset the game state. Gold goes to 100, all potions are removed from
-    inventory, and all barrels are removed from inventory. Carts are all reset.
+    inventory, and all barrels are removed from inventory. Carts are all reset,
+    along with the sales per game hour and the game time.
     """
-    with db.engine.begin() as connection:
+    async with db.async_engine.begin() as connection:
 
        # Clear all ledger tables
-        connection.execute(sqlalchemy.text("TRUNCATE TABLE ml_ledger"))
-        connection.execute(sqlalchemy.text("TRUNCATE TABLE potion_ledger"))
-        connection.execute(sqlalchemy.text("TRUNCATE TABLE gold_ledger"))
-        connection.execute(sqlalchemy.text("TRUNCATE TABLE capacities"))
-        connection.execute(sqlalchemy.text("TRUNCATE TABLE ml_c_ledger"))
-        connection.execute(sqlalchemy.text("TRUNCATE TABLE potion_c_ledger"))
+        await connection.execute(sqlalchemy.text("TRUNCATE TABLE ml_ledger"))
+        await connection.execute(sqlalchemy.text("TRUNCATE TABLE potion_ledger"))
+        await connection.execute(sqlalchemy.text("TRUNCATE TABLE gold_ledger"))
+        await connection.execute(sqlalchemy.text("TRUNCATE TABLE capacities"))
+        await connection.execute(sqlalchemy.text("TRUNCATE TABLE ml_c_ledger"))
+        await connection.execute(sqlalchemy.text("TRUNCATE TABLE potion_c_ledger"))
         
-        # Initialize ml in the ledger
-        connection.execute(sqlalchemy.text(
-            """
-            INSERT INTO ml_ledger(red_ml_change, green_ml_change, blue_ml_change, dark_ml_change)
-            VALUES (0,0,0,0)
-            """
-        ))
-
-        # Initialize potion in the ledger
-        connection.execute(sqlalchemy.text(
-            """
-            INSERT INTO potion_ledger(potion_id, potion_change)
-            SELECT potions_inventory.potion_id, 0
-            FROM potions_inventory
-            GROUP BY potions_inventory.potion_id
-            """
-        ))
-
-        # Initialize gold to 100 in the ledger
-        connection.execute(sqlalchemy.text(
-            """
-            INSERT INTO gold_ledger(gold_change)
-            VALUES (100)
-            """
-        ))
+        # Initialize gold to 100, ml and every potion to 0 in the ledgers and balances
+        await balances.reset(connection, 100)
 
         # Initialize capacities in the ledger
-        connection.execute(sqlalchemy.text(
+        await connection.execute(sqlalchemy.text(
             """
             INSERT INTO capacities(potion_c, ml_c, buy_potion_c, buy_ml_c)
             VALUES (50, 10000, TRUE, TRUE)
@@ -78,8 +68,135 @@ def reset():
         
 
         # Clear carts and cart_items
-        connection.execute(sqlalchemy.text("TRUNCATE TABLE carts CASCADE"))
+        await connection.execute(sqlalchemy.text("TRUNCATE TABLE carts CASCADE"))
+
+        # And the demand learned from them, so the catalog and bottler start
+        # over from their fixed orders
+        await connection.execute(sqlalchemy.text("TRUNCATE TABLE potion_sales, game_time"))
 
+    if cart_store.enabled():
+        cart_store.store.clear()
+    cache.bump_inventory_version()
 
     return {"message": "Shop has been reset to 0 for inventory and 100 for gold."}
 
+
+@router.get("/balances/check")
+async def check_balances():
+    """
+    Compare the running balances against the full ledger sums. Any mismatch
+    is listed; an empty list means the balances are consistent.
+    """
+    async with db.async_engine.begin() as connection:
+        mismatches = await balances.check(connection)
+
+    return {"consistent": len(mismatches) == 0, "mismatches": mismatches}
+
+@router.post("/balances/rebuild")
+async def rebuild_balances():
+    """ Recompute the running balances from the full ledger sums. """
+    async with db.async_engine.begin() as connection:
+        await balances.rebuild(connection)
+
+    cache.bump_inventory_version()
+    return "OK"
+
+@router.post("/potions/refresh")
+async def refresh_potions():
+    """
+    Reload the in-memory potion index after editing potions_inventory (skus,
+    prices or recipes), instead of waiting for it to expire.
+    """
+    potion_index.invalidate()
+    cache.bump_inventory_version()
+    await potion_index.get_index()
+    return "OK"
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """ Request latency, queries per request and pool stats for Prometheus. """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@router.post("/ledgers/compact")
+async def compact_ledgers(horizon_days: int = Query(ledgers.HORIZON_DAYS, ge=0)):
+    """
+    Fold ledger rows older than horizon_days into checkpoint rows (balances
+    are unchanged) and drop the monthly partitions that are left empty.
+    Reports how many rows and partitions were reclaimed.
+    """
+    cutoff = ledgers.cutoff_for(horizon_days)
+
+    async with db.async_engine.begin() as connection:
+        folded = await ledgers.compact(connection, cutoff)
+
+    # Partition DDL locks the ledgers, so it gets its own short transaction
+    # rather than being held for the whole compaction
+    dropped = []
+    async with db.async_engine.begin() as connection:
+        created = await ledgers.ensure_partitions(connection)
+        for ledger, partition, rows, size in await ledgers.old_partitions(connection, cutoff):
+            if rows == 0:
+                await ledgers.drop_partition(connection, ledger, partition)
+                dropped.append({"partition": partition, "bytes": size})
+
+    logger.info("compacted ledgers before %s: %s, dropped %s partitions", cutoff, folded, len(dropped))
+    return {
+        "cutoff": cutoff.isoformat(),
+        "ledgers": {
+            ledger: {**counts, "rows_reclaimed": counts["rows_folded"] - counts["checkpoint_rows"]}
+            for ledger, counts in folded.items()
+        },
+        "partitions_created": created,
+        "partitions_dropped": dropped,
+        "bytes_reclaimed": sum(partition["bytes"] for partition in dropped),
+    }
+
+@router.get("/snapshots")
+async def list_snapshots():
+    """ The saved shop snapshots. """
+    return snapshots.list_snapshots()
+
+@router.post("/snapshots/{name}")
+async def save_snapshot(name: str):
+    """
+    Save the whole shop (ledgers, balances, capacities, customers and carts)
+    as a named snapshot, replacing one of the same name.
+    """
+    try:
+        snapshots.path_for(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    start = time.perf_counter()
+    engine = db.async_engine.execution_options(isolation_level="REPEATABLE READ")
+    async with engine.begin() as connection:
+        manifest = await snapshots.save(connection, name)
+
+    return {
+        "name": name,
+        "rows": {table: info["rows"] for table, info in manifest["tables"].items()},
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+    }
+
+@router.post("/snapshots/{name}/restore")
+async def restore_snapshot(name: str):
+    """ Put the shop back in the state saved under name. Open carts are dropped. """
+    start = time.perf_counter()
+    try:
+        async with db.async_engine.begin() as connection:
+            manifest = await snapshots.restore(connection, name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except snapshots.SnapshotNotFound:
+        raise HTTPException(status_code=404, detail=f"No snapshot named {name}")
+
+    if cart_store.enabled():
+        cart_store.store.clear()
+    potion_index.invalidate()
+    cache.bump_inventory_version()
+
+    return {
+        "name": name,
+        "rows": {table: info["rows"] for table, info in manifest["tables"].items()},
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+    }
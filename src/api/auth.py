@@ -2,12 +2,15 @@ from fastapi import Security, HTTPException, status, Request
 from fastapi.security.api_key import APIKeyHeader
 import os
 import dotenv
+from src import tenants
 
 dotenv.load_dotenv()
 
 api_keys = []  
 
 api_keys.append(os.environ.get("API_KEY"))
+# In multi-tenant mode every tenant's key is accepted (and picks its schema)
+api_keys.extend(tenants.by_api_key)
 api_key_header = APIKeyHeader(name="access_token", auto_error=False)
 
 
@@ -1,10 +1,23 @@
 import sqlalchemy
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from src.api import auth
 from enum import Enum
 from src import database as db
+from src import balances
+from src import cache
+from src import log
+from src import potion_index
+from src import cart_store
+from src import responses
 from sqlalchemy import text
+from datetime import datetime
+import base64
+import binascii
+import csv
+import io
+import json
 
 
 router = APIRouter(
@@ -13,6 +26,8 @@ router = APIRouter(
     dependencies=[Depends(auth.get_api_key)],
 )
 
+logger = log.get_logger(__name__)
+
 class search_sort_options(str, Enum):
     customer_name = "customer_name"
     item_sku = "item_sku"
@@ -23,8 +38,75 @@ class search_sort_order(str, Enum):
     asc = "asc"
     desc = "desc"   
 
+def encode_search_cursor(sort_col, sort_order, direction, row):
+    """
+    Builds an opaque page token holding the sort key and line item id of the
+    row the requested page should continue from.
+    """
+    value = row.sort_key
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    cursor = {
+        "col": sort_col.value,
+        "order": sort_order.value,
+        "direction": direction,
+        "value": value,
+        "id": row.line_item_id
+    }
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+def decode_search_cursor(search_page, sort_col, sort_order):
+    """
+    Reads a page token made by encode_search_cursor. Tokens that can't be
+    read or were made for a different sort start from the first page.
+    """
+    if not search_page:
+        return None
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(search_page.encode()))
+        if cursor["col"] != sort_col.value or cursor["order"] != sort_order.value:
+            return None
+        if cursor["direction"] not in ("prev", "next"):
+            return None
+        # The value has to be of the sort column's type to be compared with it
+        if sort_col is search_sort_options.timestamp:
+            cursor["value"] = datetime.fromisoformat(cursor["value"])
+        elif sort_col is search_sort_options.line_item_total:
+            if type(cursor["value"]) is not int:
+                raise ValueError("line_item_total cursor value must be an int")
+        elif not isinstance(cursor["value"], str):
+            raise ValueError(f"{sort_col.value} cursor value must be a string")
+        if type(cursor["id"]) is not int:
+            raise ValueError("cursor id must be an int")
+    except (ValueError, TypeError, KeyError, binascii.Error):
+        return None
+    return cursor
+
+def search_filters(customer_name, potion_sku):
+    """
+    The customers and potions to join cart_items against, narrowed down to
+    the ones matching the search filters.
+    """
+    # Narrow the small tables down first (the filters are backed by trigram
+    # indexes) and only then join cart_items against what matched.
+    customers = db.customers
+    potions = db.potions_inventory
+    if customer_name:
+        customers = (
+            sqlalchemy.select(db.customers.c.id, db.customers.c.customer_name)
+            .where(db.customers.c.customer_name.ilike(f"%{customer_name}%"))
+            .subquery("matching_customers")
+        )
+    if potion_sku:
+        potions = (
+            sqlalchemy.select(db.potions_inventory.c.potion_id, db.potions_inventory.c.sku, db.potions_inventory.c.potion_name)
+            .where(db.potions_inventory.c.potion_name.ilike(f"%{potion_sku}%"))
+            .subquery("matching_potions")
+        )
+    return customers, potions
+
 @router.get("/search/", tags=["search"])
-def search_orders(
+async def search_orders(
     customer_name: str = "",
     potion_sku: str = "",
     search_page: str = "",
@@ -57,65 +139,75 @@ def search_orders(
     """
 
     limit = 5
-    #page = int(search_page) if search_page else 1
-    if search_page.startswith("?search_page="):
-        try:
-            page = int(search_page.split("=")[-1])
-        except ValueError:
-            page = 1
-    else:
-        page = 1
-    offset = (page - 1) * limit
+    cursor = decode_search_cursor(search_page, sort_col, sort_order)
+    customers, potions = search_filters(customer_name, potion_sku)
 
     if sort_col is search_sort_options.customer_name:
-        order_by = db.customers.c.customer_name
+        sort_key = sqlalchemy.func.coalesce(customers.c.customer_name, "")
     elif sort_col is search_sort_options.item_sku:
-        order_by = db.potions_inventory.c.potion_name
+        sort_key = sqlalchemy.func.coalesce(potions.c.potion_name, "")
     elif sort_col is search_sort_options.line_item_total:
-        order_by = db.cart_items.c.gold_paid
+        sort_key = sqlalchemy.func.coalesce(db.cart_items.c.gold_paid, 0)
     elif sort_col is search_sort_options.timestamp:
-        order_by = db.cart_items.c.added_at
+        sort_key = db.cart_items.c.added_at
     else: 
         assert False, "Invalid sort option"
-    
-    # Do descending order if specified
-    if sort_order == search_sort_order.desc:
-        order_by = sqlalchemy.desc(order_by)
+
+    # The line item id breaks ties so every row has a unique position.
+    # Going back a page walks the sort the other way and flips the rows after.
+    descending = sort_order == search_sort_order.desc
+    backwards = cursor is not None and cursor["direction"] == "prev"
+    if backwards:
+        descending = not descending
+
+    if descending:
+        order_by = [sqlalchemy.desc(sort_key), sqlalchemy.desc(db.cart_items.c.id)]
+    else:
+        order_by = [sort_key, db.cart_items.c.id]
     
     stmt = (
         sqlalchemy.select(
             db.cart_items.c.id.label("line_item_id"),
-            db.customers.c.customer_name,
+            customers.c.customer_name,
             db.cart_items.c.qty.label("quantity"),
-            db.potions_inventory.c.sku,
-            db.potions_inventory.c.potion_name,
+            potions.c.sku,
+            potions.c.potion_name,
             db.cart_items.c.gold_paid.label("line_item_total"),
-            db.cart_items.c.added_at.label("timestamp")
+            db.cart_items.c.added_at.label("timestamp"),
+            sort_key.label("sort_key")
         )
         .select_from(
-            db.cart_items
-            .join(db.carts, db.cart_items.c.cart_id == db.carts.c.id)
-            .join(db.customers, db.carts.c.customer_id == db.customers.c.id)
-            .join(db.potions_inventory, db.cart_items.c.potion_id == db.potions_inventory.c.potion_id)
+            customers
+            .join(db.carts, db.carts.c.customer_id == customers.c.id)
+            .join(db.cart_items, db.cart_items.c.cart_id == db.carts.c.id)
+            .join(potions, db.cart_items.c.potion_id == potions.c.potion_id)
         )
-        .order_by(order_by, db.carts.c.id)
+        .order_by(*order_by)
         .limit(limit + 1)
-        .offset(offset)
     )
 
-    # Apply filters only if parameters are provided
-    if customer_name:
-        stmt = stmt.where(db.customers.c.customer_name.ilike(f"%{customer_name}%"))
-    if potion_sku:
-        stmt = stmt.where(db.potions_inventory.c.potion_name.ilike(f"%{potion_sku}%"))
+    # Seek past the row the cursor points at instead of using an offset
+    if cursor is not None:
+        position = sqlalchemy.tuple_(sort_key, db.cart_items.c.id)
+        anchor = sqlalchemy.tuple_(sqlalchemy.literal(cursor["value"]), sqlalchemy.literal(cursor["id"]))
+        stmt = stmt.where(position < anchor if descending else position > anchor)
 
-    with db.engine.connect() as conn:
-        result = conn.execute(stmt)
+    async with db.async_engine.connect() as conn:
+        result = await conn.execute(stmt)
         rows = result.fetchall()
 
-    has_next_page = len(rows) > limit
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+        has_previous_page = has_more
+        has_next_page = True
+    else:
+        has_previous_page = cursor is not None
+        has_next_page = has_more
+
     json_result = []
-    for row in rows[:limit]:
+    for row in rows:
         item_sku_display = f"{row.quantity} {row.potion_name}s"
         timestamp_display = row.timestamp.isoformat()
         json_result.append(
@@ -128,8 +220,12 @@ def search_orders(
             }
         )
     # Pagination tokens for previous and next pages
-    previous = f"?search_page={page-1}" if page > 1 else ""
-    next = f"?search_page={page+1}" if has_next_page else ""
+    previous = ""
+    next = ""
+    if rows and has_previous_page:
+        previous = encode_search_cursor(sort_col, sort_order, "prev", rows[0])
+    if rows and has_next_page:
+        next = encode_search_cursor(sort_col, sort_order, "next", rows[-1])
 
     return {
         "previous": previous,
@@ -151,37 +247,123 @@ def search_orders(
     #     ],
     # }
 
+class export_format(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+# Rows fetched from the server-side cursor at a time
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_COLUMNS = ["line_item_id", "cart_id", "customer_name", "sku", "potion_name",
+                  "quantity", "line_item_total", "timestamp"]
+
+@router.get("/export/", tags=["search"])
+async def export_line_items(
+    customer_name: str = "",
+    potion_sku: str = "",
+    output_format: export_format = Query(export_format.ndjson, alias="format"),
+):
+    """
+    Every cart line item matching the same customer name and potion sku
+    filters as search, oldest first, as NDJSON (one object per line) or CSV.
+
+    The rows are streamed from a server-side cursor as they are read, so the
+    export can be any size.
+    """
+    customers, potions = search_filters(customer_name, potion_sku)
+    stmt = (
+        sqlalchemy.select(
+            db.cart_items.c.id.label("line_item_id"),
+            db.cart_items.c.cart_id,
+            customers.c.customer_name,
+            potions.c.sku,
+            potions.c.potion_name,
+            db.cart_items.c.qty.label("quantity"),
+            db.cart_items.c.gold_paid.label("line_item_total"),
+            db.cart_items.c.added_at.label("timestamp")
+        )
+        .select_from(
+            customers
+            .join(db.carts, db.carts.c.customer_id == customers.c.id)
+            .join(db.cart_items, db.cart_items.c.cart_id == db.carts.c.id)
+            .join(potions, db.cart_items.c.potion_id == potions.c.potion_id)
+        )
+        .order_by(db.cart_items.c.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+
+    async def lines():
+        if output_format is export_format.csv:
+            yield ",".join(EXPORT_COLUMNS).encode() + b"\r\n"
+        async with db.async_engine.connect() as conn:
+            result = await conn.stream(stmt)
+            async for rows in result.partitions():
+                if output_format is export_format.csv:
+                    buffer = io.StringIO()
+                    csv.writer(buffer).writerows(
+                        (*row[:-1], row.timestamp.isoformat()) for row in rows
+                    )
+                    yield buffer.getvalue().encode()
+                else:
+                    yield b"".join(responses.dumps(row._asdict()) + b"\n" for row in rows)
+
+    if output_format is export_format.csv:
+        media_type, filename = "text/csv", "line_items.csv"
+    else:
+        media_type, filename = "application/x-ndjson", "line_items.ndjson"
+    return StreamingResponse(lines(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
 class Customer(BaseModel):
     customer_name: str
     character_class: str
     level: int
 
 @router.post("/visits/{visit_id}")
-def post_visits(visit_id: int, customers: list[Customer]):
+async def post_visits(visit_id: int, customers: list[Customer]):
     """
     Which customers visited the shop today?
     """
-    print(customers)
+    logger.debug("visitors: %s", customers)
 
-    # Update or insert customers in the database
-    with db.engine.begin() as connection:
+    # Upsert every visitor in one statement. Rows whose class and level
+    # haven't changed are left alone, so they are looked up instead of
+    # returned by the upsert. Ids come back in the order the visitors were sent.
+    async with db.async_engine.begin() as connection:
         customer_sql = """
-        INSERT INTO customers (customer_name, customer_class, level)
-        VALUES (:customer_name, :customer_class, :level)
-        ON CONFLICT (customer_name) DO UPDATE
-        SET customer_class = :customer_class, level = :level
-        RETURNING id
+        WITH visitors AS (
+            SELECT customer_name, customer_class, level, visit_order
+            FROM unnest(
+                CAST(:customer_names AS varchar[]),
+                CAST(:customer_classes AS varchar[]),
+                CAST(:levels AS integer[])
+            ) WITH ORDINALITY AS visitors(customer_name, customer_class, level, visit_order)
+        ), latest AS (
+            SELECT DISTINCT ON (customer_name) customer_name, customer_class, level
+            FROM visitors
+            ORDER BY customer_name, visit_order DESC
+        ), upserted AS (
+            INSERT INTO customers (customer_name, customer_class, level)
+            SELECT customer_name, customer_class, level
+            FROM latest
+            ON CONFLICT (customer_name) DO UPDATE
+            SET customer_class = EXCLUDED.customer_class, level = EXCLUDED.level
+            WHERE customers.customer_class IS DISTINCT FROM EXCLUDED.customer_class
+               OR customers.level IS DISTINCT FROM EXCLUDED.level
+            RETURNING id, customer_name
+        )
+        SELECT COALESCE(upserted.id, customers.id) AS id
+        FROM visitors
+        LEFT JOIN upserted ON upserted.customer_name = visitors.customer_name
+        LEFT JOIN customers ON customers.customer_name = visitors.customer_name
+        ORDER BY visitors.visit_order
         """
-        customer_ids = []
-        for customer in customers:
-            # Insert or update each customer in the list
-            result = connection.execute(sqlalchemy.text(customer_sql), {
-                "customer_name": customer.customer_name,
-                "customer_class": customer.character_class,
-                "level": customer.level
-            })
-            customer_id = result.scalar()
-            customer_ids.append(customer_id)
+        customer_result = await connection.execute(sqlalchemy.text(customer_sql), {
+            "customer_names": [customer.customer_name for customer in customers],
+            "customer_classes": [customer.character_class for customer in customers],
+            "levels": [customer.level for customer in customers]
+        })
+        customer_ids = customer_result.scalars().all()
 
     # Return the list of customer IDs as confirmation
     return {
@@ -191,34 +373,39 @@ def post_visits(visit_id: int, customers: list[Customer]):
 
 
 @router.post("/")
-def create_cart(new_cart: Customer):
+async def create_cart(new_cart: Customer):
     """ Create a cart to store the quantity"""
 
     # Assume the customer already exists (updated in post_visits)
-    with db.engine.begin() as connection:
+    async with db.async_engine.begin() as connection:
         # Retrieve the customer ID from the database
         get_customer_sql = """
         SELECT id FROM customers WHERE customer_name = :customer_name
         """
-        customer_result = connection.execute(sqlalchemy.text(get_customer_sql), {
+        customer_result = await connection.execute(sqlalchemy.text(get_customer_sql), {
             "customer_name": new_cart.customer_name
         })
         customer_id = customer_result.scalar()
 
         if not customer_id:
             raise ValueError("Customer does not exist. Please add the customer through post_visits first.")
-        # Now, create a new cart for this customer
-        create_cart_sql = """
-        INSERT INTO carts (customer_id, created_at)
-        VALUES (:customer_id, now())
-        RETURNING id
-        """
-        cart_result = connection.execute(sqlalchemy.text(create_cart_sql), {
-            "customer_id": customer_id
-        })
-        cart_id = cart_result.scalar()
-        print(f"Cart_id in create cart: {cart_id}")
-        print(f"Customer who created the cart: {new_cart.customer_name}")
+
+        if cart_store.enabled():
+            # Held in memory until checkout
+            cart_id = await cart_store.store.create(connection, customer_id)
+        else:
+            # Now, create a new cart for this customer
+            create_cart_sql = """
+            INSERT INTO carts (customer_id, created_at)
+            VALUES (:customer_id, now())
+            RETURNING id
+            """
+            cart_result = await connection.execute(sqlalchemy.text(create_cart_sql), {
+                "customer_id": customer_id
+            })
+            cart_id = cart_result.scalar()
+        logger.debug("Cart_id in create cart: %s", cart_id)
+        logger.debug("Customer who created the cart: %s", new_cart.customer_name)
 
     return {
         "cart_id": cart_id,
@@ -233,37 +420,50 @@ class CartItem(BaseModel):
 
 
 @router.post("/{cart_id}/items/{item_sku}")
-def set_item_quantity(cart_id: int, item_sku: str, cart_item: CartItem):
+async def set_item_quantity(cart_id: int, item_sku: str, cart_item: CartItem):
     """ Customers can add multiple items of green potions. Check cart and inventory first.  """
 
-    # Update or insert the cart_items record
-    with db.engine.begin() as connection:
-        # Define the SQL statement to insert or update cart items
-        create_cart_items_sql = """
-            INSERT INTO cart_items (cart_id, potion_id, qty, added_at, gold_paid)
-            SELECT :cart_id, potion_id, :qty, now(), :qty * price
-            FROM potions_inventory
-            WHERE potions_inventory.sku = :item_sku
-            ON CONFLICT (cart_id, potion_id) DO UPDATE SET qty = :qty
-            RETURNING id
-        """
+    potion = await potion_index.by_sku(item_sku)
+    cart_item_id = None
+    open_cart = cart_store.store.get(cart_id) if cart_store.enabled() else None
 
-        # Execute the SQL statement with parameters
-        cart_items_result = connection.execute(
-            sqlalchemy.text(create_cart_items_sql), 
-            {
-                "cart_id": cart_id,
-                "qty": cart_item.quantity,
-                "item_sku": item_sku
-            }
-        )
-
-        # Retrieve the cart item ID from the result
-        cart_item_id = cart_items_result.scalar()
-        print(f"Cart item ID in create cart: {cart_item_id}")
+    if potion is not None and open_cart is not None:
+        cart_store.store.set_item(open_cart, potion.potion_id, cart_item.quantity, cart_item.quantity * potion.price)
+    # Update or insert the cart_items record
+    elif potion is not None:
+        async with db.async_engine.begin() as connection:
+            # Define the SQL statement to insert or update cart items
+            # Nothing is inserted for a cart that doesn't exist (or was
+            # evicted from the cart store before it was ever written)
+            create_cart_items_sql = """
+                INSERT INTO cart_items (cart_id, potion_id, qty, added_at, gold_paid)
+                SELECT id, CAST(:potion_id AS bigint), CAST(:qty AS integer), now(), CAST(:gold_paid AS integer)
+                FROM carts
+                WHERE id = :cart_id
+                ON CONFLICT (cart_id, potion_id) DO UPDATE
+                SET qty = EXCLUDED.qty, gold_paid = EXCLUDED.gold_paid
+                RETURNING id
+            """
 
-    print(f"cart id in set item quantity: {cart_id}, cart item id: {cart_item_id}")
-    print(f"CI quantity: {cart_item.quantity} and item sku: {item_sku}")
+            # Execute the SQL statement with parameters
+            cart_items_result = await connection.execute(
+                sqlalchemy.text(create_cart_items_sql), 
+                {
+                    "cart_id": cart_id,
+                    "potion_id": potion.potion_id,
+                    "qty": cart_item.quantity,
+                    "gold_paid": cart_item.quantity * potion.price
+                }
+            )
+
+            # Retrieve the cart item ID from the result
+            cart_item_id = cart_items_result.scalar()
+            logger.debug("Cart item ID in create cart: %s", cart_item_id)
+        if cart_item_id is None:
+            raise HTTPException(status_code=404, detail=f"No cart with id {cart_id}")
+
+    logger.debug("cart id in set item quantity: %s, cart item id: %s", cart_id, cart_item_id)
+    logger.debug("CI quantity: %s and item sku: %s", cart_item.quantity, item_sku)
     #print(f"customer who added potions to the cart: {customer_name}")
     
     return {
@@ -276,47 +476,41 @@ class CartCheckout(BaseModel):
     payment: str
 
 @router.post("/{cart_id}/checkout")
-def checkout(cart_id: int, cart_checkout: CartCheckout):
+async def checkout(cart_id: int, cart_checkout: CartCheckout):
     """ Make sure if potions are in the inventory before checking out """
-    total_potions_bought = 0
-    total_price = 0
-
-    with db.engine.begin() as connection:
-        connection.execute(sqlalchemy.text(
-            """
-            INSERT INTO potion_ledger(potion_id, potion_change)
-            SELECT cart_items.potion_id, (cart_items.qty * -1)
-            FROM cart_items
-            WHERE cart_items.cart_id = :cart_id
-            """
-        ),[{"cart_id": cart_id}])
-        
-        total_potions_bought = connection.execute(sqlalchemy.text(
-            """
-            SELECT qty
-            FROM cart_items
-            WHERE cart_id = :cart_id
-            """
-        ), {"cart_id": cart_id}).scalar_one()
-
-        total_price = connection.execute(sqlalchemy.text(
-            """
-            SELECT SUM(qty * potions_inventory.price)
-            FROM cart_items
-            JOIN potions_inventory ON potions_inventory.potion_id = cart_items.potion_id
-            WHERE cart_id = :cart_id
-            """
-        ), {"cart_id": cart_id}).scalar_one()
-
-        connection.execute(sqlalchemy.text(
-             """
-            INSERT INTO gold_ledger(gold_change)
-            VALUES (:total_gold)
-             """
-        ), [{"total_gold":total_price }])
-        
+    # Taken out of the store before anything is awaited, so a second
+    # checkout of the same cart meanwhile finds it neither in memory nor
+    # (until this one commits) in the database, and answers 404
+    open_cart = cart_store.store.take(cart_id) if cart_store.enabled() else None
+
+    # Both ledgers and balances are written by one statement
+    try:
+        async with db.async_engine.begin() as connection:
+            if open_cart is not None:
+                # An open cart from memory is written in the same transaction as the sale
+                await cart_store.flush(connection, open_cart)
+            else:
+                cart_exists = await connection.execute(sqlalchemy.text(
+                    "SELECT EXISTS (SELECT 1 FROM carts WHERE id = :cart_id)"
+                ), {"cart_id": cart_id})
+                if not cart_exists.scalar():
+                    # Raised inside the transaction, so nothing is recorded
+                    raise HTTPException(status_code=404, detail=f"No cart with id {cart_id}")
+            totals = await balances.record_checkout(connection, cart_id)
+    except BaseException:
+        if open_cart is not None:
+            cart_store.store.put_back(open_cart)
+        raise
+
+    if open_cart is not None:
+        cart_store.store.checked_out(cart_id)
+
+    total_potions_bought = totals.total_potions_bought
+    total_price = totals.total_gold_paid
+
+    cache.bump_inventory_version()
       
-    print(f"total_potions_bought: {total_potions_bought}, total_gold_paid: {total_price}")
+    logger.debug("total_potions_bought: %s, total_gold_paid: %s", total_potions_bought, total_price)
     
     return {
         "total_potions_bought": total_potions_bought,
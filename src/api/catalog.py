@@ -1,67 +1,73 @@
 import sqlalchemy
 from fastapi import APIRouter
 from src import database as db
+from src import cache
+from src import log
+from src import potion_index
+from src import responses
+from src import sales
 
 router = APIRouter()
 
+logger = log.get_logger(__name__)
+
 
 @router.get("/catalog/", tags=["catalog"])
-def get_catalog():
+async def get_catalog():
     """
     Each unique item combination must have only a single price.
     """
 
+    # Served from memory, already serialized, until the inventory changes; a
+    # burst of requests at the start of a tick only runs the query once.
+    return await responses.cached(cache.catalog_cache, cache.inventory_version(), load_catalog)
+
+
+async def load_catalog():
+    """ Build the catalog from the current potion balances. """
     my_catalog = []
 
-    with db.engine.begin() as connection:
-        result = connection.execute(sqlalchemy.text(
-            """
-            SELECT 
-                SUM(potion_ledger.potion_change) AS inventory, 
-                sku, 
-                price, 
-                potion_type, 
-                potion_name
-            FROM 
-                potions_inventory
-            JOIN 
-                potion_ledger 
-            ON 
-                potion_ledger.potion_id = potions_inventory.potion_id
-            WHERE 
-                potions_inventory.potion_id NOT IN (3,6,7, 14)
-            GROUP BY 
-                potions_inventory.potion_id
-            HAVING 
-                SUM(potion_ledger.potion_change) > 0
-            ORDER BY 
-                CASE 
-                    WHEN potions_inventory.potion_id = 11 THEN 0
-                    WHEN potions_inventory.potion_id = 5 THEN 0
-                    WHEN potions_inventory.potion_id = 18 THEN 0
-                    ELSE 1
-                END, 
-                inventory DESC;
+    # Only the balances and demand come from the database; the potions themselves are in the index
+    index = await potion_index.get_index()
+    result = await db.execute(sqlalchemy.text(
+        f"""
+        SELECT potion_balances.potion_id, potion_balances.quantity,
+            COALESCE(demand.quantity, 0) AS demand
+        FROM potion_balances
+        LEFT JOIN ({sales.CURRENT_DEMAND}) AS demand ON demand.potion_id = potion_balances.potion_id
+        WHERE potion_balances.quantity > 0
+        """
+    ))
+    in_stock = [(index.by_id.get(row.potion_id), row.quantity, row.demand) for row in result]
 
-            """
-        )).fetchall()
+    # Potions kept off the catalog, and the ones listed first after the best
+    # sellers at this game hour (all of them, before anything has sold)
+    hidden = (3, 6, 7, 14)
+    featured = (11, 5, 18)
+    result = sorted(
+        (
+            (potion, inventory, demand) for potion, inventory, demand in in_stock
+            if potion is not None and potion.potion_id not in hidden
+        ),
+        key=lambda entry: (-entry[2], 0 if entry[0].potion_id in featured else 1, -entry[1])
+    )
 
     count = 0
     if len(result) > 0:
-        for row in result:
+        for row, inventory, demand in result:
             # print(row) - gonna print all the available potions (7)
             if count == 6:
                 break
             my_catalog.append(
                 {
                     "sku": row.sku,
-                    "name":row.potion_name,
-                    "quantity": row.inventory,
+                    "name": row.potion_name,
+                    "quantity": inventory,
                     "price": row.price,
                     "potion_type": row.potion_type
                 })
             count += 1
 
-    print(f"my catalog: {my_catalog}")
+    logger.debug("my catalog: %s", my_catalog)
     # Return an empty catalog if no potions are available
     return my_catalog 
@@ -1,6 +1,12 @@
 from fastapi import APIRouter, Depends, Request
 from pydantic import BaseModel
 from src.api import auth
+from src import database as db
+from src import cache
+from src import ledgers
+from src import log
+from src import precompute
+from src import sales
 
 router = APIRouter(
     prefix="/info",
@@ -8,15 +14,28 @@ router = APIRouter(
     dependencies=[Depends(auth.get_api_key)],
 )
 
+logger = log.get_logger(__name__)
+
 class Timestamp(BaseModel):
     day: str
     hour: int
 
 @router.post("/current_time")
-def post_time(timestamp: Timestamp):
+async def post_time(timestamp: Timestamp):
     """
     Share current time.
     """
-    print(f"Current Time: {timestamp.day} {timestamp.hour}")
+    log.set_tick(timestamp.day, timestamp.hour)
+    async with db.async_engine.begin() as connection:
+        await sales.set_game_time(connection, timestamp.day, timestamp.hour)
+    if ledgers.upcoming_partitions_due():
+        # Partition DDL locks the ledgers, so it gets its own short transaction
+        async with db.async_engine.begin() as connection:
+            await ledgers.ensure_upcoming_partitions(connection)
+    # The catalog and plans rank by the demand for this hour
+    cache.bump_inventory_version()
+    # Have the plans ready before the Exchange asks for them
+    precompute.schedule()
+    logger.info("Current Time: %s %s", timestamp.day, timestamp.hour)
     return "OK"
 
@@ -4,6 +4,12 @@ from fastapi import APIRouter, Depends
 from pydantic import BaseModel
 from src.api import auth
 from src import database as db
+from src import balances
+from src import cache
+from src import log
+from src import shop_state
+from src import responses
+from src import precompute
 
 router = APIRouter(
     prefix="/inventory",
@@ -11,88 +17,59 @@ router = APIRouter(
     dependencies=[Depends(auth.get_api_key)],
 )
 
+logger = log.get_logger(__name__)
+
 @router.get("/audit")
-def get_inventory():
+async def get_inventory():
     """ Get what we have currently from the database """
-    with db.engine.begin() as connection: 
-        row = connection.execute(sqlalchemy.text(
-            """
-            SELECT 
-            (SELECT COALESCE(SUM(red_ml_change), 0) FROM ml_ledger) AS red_ml,
-            (SELECT COALESCE(SUM(green_ml_change), 0) FROM ml_ledger) AS green_ml,
-            (SELECT COALESCE(SUM(blue_ml_change), 0) FROM ml_ledger) AS blue_ml,
-            (SELECT COALESCE(SUM(dark_ml_change), 0) FROM ml_ledger) AS dark_ml,
-            (SELECT COALESCE(SUM(gold_change), 0) FROM gold_ledger) AS gold
-            """
-        )).fetchone()
-        total_ml = row.red_ml + row.green_ml + row.blue_ml + row.dark_ml
-        gold = row.gold
+    return await responses.cached(cache.audit_cache, cache.state_version(), audit)
 
-        total_potions = connection.execute(sqlalchemy.text(
-            """
-            SELECT COALESCE(SUM(potion_change), 0) FROM potion_ledger
-            """
-        )).scalar_one() or 0
+async def audit():
+    state = await shop_state.load()
 
     return {
-        "number_of_potions": total_potions,
-        "ml_in_barrels": total_ml,
-        "gold": gold
+        "number_of_potions": state.total_potions,
+        "ml_in_barrels": state.total_ml,
+        "gold": state.gold
     }
 
 # Gets called once a day
 @router.post("/plan")
-def get_capacity_plan():
+async def get_capacity_plan():
     """ 
     Start with 1 capacity for 50 potions and 1 capacity for 10000 ml of potion. Each additional 
     capacity unit costs 1000 gold.
     """
-    print("CALLED get_capacity_plan().")
-    with db.engine.begin() as connection:
-        inventory_row = connection.execute(sqlalchemy.text(
-            """
-            SELECT 
-                (SELECT COALESCE(SUM(gold_change), 0) FROM gold_ledger) AS gold, 
-                (SELECT COALESCE(SUM(red_ml_change) + SUM(green_ml_change) + SUM(blue_ml_change) + SUM(dark_ml_change), 0) FROM ml_ledger) AS total_ml,
-                (SELECT COALESCE(SUM(potion_change), 0) FROM potion_ledger) AS total_potions
-            """
-        )).fetchone()
-    
-        gold = inventory_row.gold
-        total_ml = inventory_row.total_ml
-        total_potions = inventory_row.total_potions
-    
-    with db.engine.begin() as connection:
-        capacity_row = connection.execute(sqlalchemy.text(
-            """
-            SELECT potion_c, ml_c, buy_potion_c, buy_ml_c
-            FROM capacities
-            """
-        )).fetchone()
+    logger.debug("CALLED get_capacity_plan().")
+    return await precompute.cached("capacity", cache.capacity_plan_cache, cache.state_version(), capacity_plan)
+
+async def capacity_plan():
+    state = await shop_state.load()
 
-        potion_capacity = capacity_row.potion_c
-        ml_capacity = capacity_row.ml_c
-        buy_potion = capacity_row.buy_potion_c
-        buy_ml = capacity_row.buy_ml_c
+    gold = state.gold
+    total_ml = state.total_ml
+    total_potions = state.total_potions
+
+    potion_capacity = state.potion_c
+    ml_capacity = state.ml_c
+    buy_potion = state.buy_potion_c
+    buy_ml = state.buy_ml_c
     
     gold_to_buy_capacity_threshold = 1 #to change back to 0.5
     # use the threshold I set of my available gold to buy capacities
     #gold_to_buy_capacity = max(gold // 4, 0) if gold >= 4000 else 0
     gold_to_buy_capacity = (gold * gold_to_buy_capacity_threshold)
-    print(f"gold_to_buy_capacity (1): {gold_to_buy_capacity}")
+    logger.debug("gold_to_buy_capacity (1): %s", gold_to_buy_capacity)
 
     potion_capacity_to_buy = 0
     ml_capacity_to_buy = 0
     capacity_threshold = 0.6 #to change back
-    print()
-    print(f"total potion: {total_potions}")
-    print(f"potion capacity: {potion_capacity}")
-    print(f"75% of potion_capacity: {potion_capacity * capacity_threshold}")
-    print()
-    print(f"total ml: {total_ml}")
-    print(f"ml capacity: {ml_capacity}")
-    print(f"75% of ml_capacity: {ml_capacity * capacity_threshold}")
-    print()
+    logger.debug("total potion: %s", total_potions)
+    logger.debug("potion capacity: %s", potion_capacity)
+    logger.debug("%s of potion_capacity: %s", capacity_threshold, potion_capacity * capacity_threshold)
+    logger.debug("total ml: %s", total_ml)
+    logger.debug("ml capacity: %s", ml_capacity)
+    logger.debug("%s of ml_capacity: %s", capacity_threshold, ml_capacity * capacity_threshold)
 
     if (
         gold_to_buy_capacity >= 1000
@@ -102,14 +79,13 @@ def get_capacity_plan():
         potion_capacity_to_buy = 1
         gold_to_buy_capacity -= 1000
     
-    print(f"gold_to_buy_capacity for potion: {gold_to_buy_capacity}")
+    logger.debug("gold_to_buy_capacity for potion: %s", gold_to_buy_capacity)
 
     # how many capacity I have in my database
     num_potion_capacity = potion_capacity // 50
     num_ml_capacity = ml_capacity // 10000
-    print(f"num_potion_capacity: {num_potion_capacity}")
-    print(f"num_ml_capacity: {num_ml_capacity}")
-    print()
+    logger.debug("num_potion_capacity: %s", num_potion_capacity)
+    logger.debug("num_ml_capacity: %s", num_ml_capacity)
 
     if (
         gold_to_buy_capacity >= 1000
@@ -120,7 +96,7 @@ def get_capacity_plan():
         ml_capacity_to_buy = 1
         gold_to_buy_capacity -= 1000
 
-    print(f"gold_to_buy_capacity for ml: {gold_to_buy_capacity}")
+    logger.debug("gold_to_buy_capacity for ml: %s", gold_to_buy_capacity)
     
     # use this later in the game
     # if (
@@ -132,9 +108,8 @@ def get_capacity_plan():
     # ):
     #     ml_capacity_to_buy = 1
     #     gold_to_buy_capacity -= 1000
-    print()
-    print(f"potion_capacity: {potion_capacity_to_buy}")
-    print(f"ml_capacity: {ml_capacity_to_buy}")
+    logger.debug("potion_capacity: %s", potion_capacity_to_buy)
+    logger.debug("ml_capacity: %s", ml_capacity_to_buy)
         
     return {
         "potion_capacity": potion_capacity_to_buy,
@@ -147,19 +122,19 @@ class CapacityPurchase(BaseModel):
 
 # Gets called once a day
 @router.post("/deliver/{order_id}")
-def deliver_capacity_plan(capacity_purchase : CapacityPurchase, order_id: int):
+async def deliver_capacity_plan(capacity_purchase : CapacityPurchase, order_id: int):
     """ 
     Start with 1 capacity for 50 potions and 1 capacity for 10000 ml of potion. Each additional 
     capacity unit costs 1000 gold.
     """
-    print("CALLED deliver_capacity_plan().")
+    logger.debug("CALLED deliver_capacity_plan().")
     potion_to_add = capacity_purchase.potion_capacity * 50
     ml_to_add = capacity_purchase.ml_capacity * 10000
     gold_paid = (capacity_purchase.potion_capacity + capacity_purchase.ml_capacity) * 1000
 
     # Update capacities 
-    with db.engine.begin() as connection:
-        connection.execute(sqlalchemy.text(
+    async with db.async_engine.begin() as connection:
+        await connection.execute(sqlalchemy.text(
             """
             UPDATE capacities 
             SET potion_c = potion_c + :potion_to_add,
@@ -170,17 +145,12 @@ def deliver_capacity_plan(capacity_purchase : CapacityPurchase, order_id: int):
             "ml_to_add": ml_to_add
         })
 
-    with db.engine.begin() as connection:
-        connection.execute(sqlalchemy.text(
-            """
-            INSERT INTO gold_ledger(gold_change)
-            VALUES (:gold_change)
-            """
-        ), {"gold_change": -gold_paid})
+    async with db.async_engine.begin() as connection:
+        await balances.record_gold(connection, -gold_paid)
     
     if ml_to_add > 0:
-        with db.engine.begin() as connection:
-            connection.execute(sqlalchemy.text(
+        async with db.async_engine.begin() as connection:
+            await connection.execute(sqlalchemy.text(
                 """
                 INSERT INTO ml_c_ledger(ml_c_change)
                 VALUES (:ml_c_change)
@@ -188,15 +158,16 @@ def deliver_capacity_plan(capacity_purchase : CapacityPurchase, order_id: int):
             ), {"ml_c_change": ml_to_add})
     
     if potion_to_add > 0:
-        with db.engine.begin() as connection:
-            connection.execute(sqlalchemy.text(
+        async with db.async_engine.begin() as connection:
+            await connection.execute(sqlalchemy.text(
                 """
                 INSERT INTO potion_c_ledger(potion_c_change)
                 VALUES (:potion_c_change)
                 """
             ), {"potion_c_change": potion_to_add})
     
-    print(f"Potion Capacity increase: {potion_to_add} and ML Capacity increase: {ml_to_add}~")
+    cache.bump_state_version()
+    logger.info("Potion Capacity increase: %s and ML Capacity increase: %s~", potion_to_add, ml_to_add)
     return "OK"
         
 
@@ -1,12 +1,17 @@
 from fastapi import FastAPI, exceptions
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from pydantic import ValidationError
 from src.api import carts, catalog, bottler, barrels, admin, info, inventory
-import json
-import logging
+from src import log
+from src import metrics
+from src import tenants
 import sys
+import uuid
 from starlette.middleware.cors import CORSMiddleware
 
+log.configure()
+logger = log.get_logger(__name__)
+
 description = """
 Central Coast Cauldrons is the premier ecommerce site for all your alchemical desires.
 """
@@ -15,6 +20,7 @@ app = FastAPI(
     title="Central Coast Cauldrons",
     description=description,
     version="0.0.1",
+    default_response_class=ORJSONResponse,
     terms_of_service="http://example.com/terms/",
     contact={
         "name": "Lucas Pierce",
@@ -32,6 +38,22 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if tenants.enabled():
+    app.add_middleware(tenants.TenantMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.middleware("http")
+async def request_id_middleware(request, call_next):
+    """ Tag every log record made while handling a request with its id. """
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:12]
+    token = log.request_id.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        log.request_id.reset(token)
+    response.headers["x-request-id"] = request_id
+    return response
+
 app.include_router(inventory.router)
 app.include_router(carts.router)
 app.include_router(catalog.router)
@@ -43,13 +65,12 @@ app.include_router(info.router)
 @app.exception_handler(exceptions.RequestValidationError)
 @app.exception_handler(ValidationError)
 async def validation_exception_handler(request, exc):
-    logging.error(f"The client sent invalid data!: {exc}")
-    exc_json = json.loads(exc.json())
+    logger.error("The client sent invalid data!: %s", exc)
     response = {"message": [], "data": None}
-    for error in exc_json:
-        response['message'].append(f"{error['loc']}: {error['msg']}")
+    for error in exc.errors():
+        response['message'].append(f"{list(error['loc'])}: {error['msg']}")
 
-    return JSONResponse(response, status_code=422)
+    return ORJSONResponse(response, status_code=422)
 
 @app.get("/")
 async def root():
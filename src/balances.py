@@ -0,0 +1,281 @@
+import sqlalchemy
+
+# Running balances for the gold, ml and potion ledgers.
+#
+# The ledgers stay the source of truth, but every write to them also updates
+# shop_balances (gold and ml per color, one row) and potion_balances (one row
+# per potion) in the same statement, so the hot endpoints can read the current
+# state without summing the whole ledger history.
+
+
+async def record_gold(connection, gold_change):
+    """ Append to gold_ledger and update the gold balance. """
+    await connection.execute(sqlalchemy.text(
+        """
+        WITH ledger AS (
+            INSERT INTO gold_ledger(gold_change)
+            VALUES (:gold_change)
+        )
+        UPDATE shop_balances
+        SET gold = gold + :gold_change
+        WHERE id = 1
+        """
+    ), {"gold_change": gold_change})
+
+
+async def record_ml(connection, red_ml, green_ml, blue_ml, dark_ml):
+    """ Append to ml_ledger and update the per color ml balances. """
+    await connection.execute(sqlalchemy.text(
+        """
+        WITH ledger AS (
+            INSERT INTO ml_ledger(red_ml_change, green_ml_change, blue_ml_change, dark_ml_change)
+            VALUES (:red_ml, :green_ml, :blue_ml, :dark_ml)
+        )
+        UPDATE shop_balances
+        SET red_ml = red_ml + :red_ml,
+            green_ml = green_ml + :green_ml,
+            blue_ml = blue_ml + :blue_ml,
+            dark_ml = dark_ml + :dark_ml
+        WHERE id = 1
+        """
+    ), {"red_ml": red_ml, "green_ml": green_ml, "blue_ml": blue_ml, "dark_ml": dark_ml})
+
+
+async def record_checkout(connection, cart_id):
+    """
+    Sell everything in a cart in one statement: the potions come out of
+    potion_ledger and potion_balances and the gold paid goes into gold_ledger
+    and the gold balance, and the sale is added to potion_sales under the
+    current game time. Returns total_potions_bought and total_gold_paid.
+    """
+    result = await connection.execute(sqlalchemy.text(
+        """
+        WITH items AS (
+            SELECT cart_items.potion_id,
+                SUM(cart_items.qty) AS qty,
+                SUM(cart_items.qty * potions_inventory.price) AS gold
+            FROM cart_items
+            JOIN potions_inventory ON potions_inventory.potion_id = cart_items.potion_id
+            WHERE cart_items.cart_id = :cart_id
+            GROUP BY cart_items.potion_id
+        ), totals AS (
+            SELECT COALESCE(SUM(qty), 0) AS total_potions_bought,
+                COALESCE(SUM(gold), 0) AS total_gold_paid
+            FROM items
+        ), potion_ledger_rows AS (
+            INSERT INTO potion_ledger(potion_id, potion_change)
+            SELECT potion_id, -qty
+            FROM items
+        ), potion_balance_rows AS (
+            INSERT INTO potion_balances(potion_id, quantity)
+            SELECT potion_id, -qty
+            FROM items
+            ON CONFLICT (potion_id) DO UPDATE
+            SET quantity = potion_balances.quantity + EXCLUDED.quantity
+        ), gold_ledger_rows AS (
+            INSERT INTO gold_ledger(gold_change)
+            SELECT total_gold_paid
+            FROM totals
+        ), gold_balance AS (
+            UPDATE shop_balances
+            SET gold = gold + totals.total_gold_paid
+            FROM totals
+            WHERE shop_balances.id = 1
+        ), sales_rows AS (
+            INSERT INTO potion_sales(potion_id, weekday, hour, customer_class, quantity, gold)
+            SELECT items.potion_id, game_time.day, game_time.hour,
+                COALESCE(customers.customer_class, ''), items.qty, items.gold
+            FROM items
+            CROSS JOIN game_time
+            JOIN carts ON carts.id = :cart_id
+            LEFT JOIN customers ON customers.id = carts.customer_id
+            ON CONFLICT (potion_id, weekday, hour, customer_class) DO UPDATE
+            SET quantity = potion_sales.quantity + EXCLUDED.quantity,
+                gold = potion_sales.gold + EXCLUDED.gold
+        )
+        SELECT total_potions_bought, total_gold_paid
+        FROM totals
+        """
+    ), {"cart_id": cart_id})
+    return result.one()
+
+
+async def record_bottling(connection, potions_delivered):
+    """
+    Add a whole bottler delivery in one statement: the bottled potions go
+    into potion_ledger and potion_balances and the ml they used comes out of
+    ml_ledger and the ml balances. potions_delivered is a list of
+    (potion_id, potion_type, quantity); a potion_id of None still uses up
+    the ml but adds no potion.
+    """
+    await connection.execute(sqlalchemy.text(
+        """
+        WITH delivered AS (
+            SELECT *
+            FROM unnest(
+                CAST(:potion_ids AS integer[]),
+                CAST(:num_red_ml AS integer[]),
+                CAST(:num_green_ml AS integer[]),
+                CAST(:num_blue_ml AS integer[]),
+                CAST(:num_dark_ml AS integer[]),
+                CAST(:quantities AS integer[])
+            ) AS delivered(potion_id, num_red_ml, num_green_ml, num_blue_ml, num_dark_ml, quantity)
+        ), potions AS (
+            SELECT potion_id, SUM(quantity) AS quantity
+            FROM delivered
+            WHERE potion_id IS NOT NULL
+            GROUP BY potion_id
+        ), potion_ledger_rows AS (
+            INSERT INTO potion_ledger(potion_change, potion_id)
+            SELECT quantity, potion_id
+            FROM potions
+        ), potion_balance_rows AS (
+            INSERT INTO potion_balances(potion_id, quantity)
+            SELECT potion_id, quantity
+            FROM potions
+            ON CONFLICT (potion_id) DO UPDATE
+            SET quantity = potion_balances.quantity + EXCLUDED.quantity
+        ), ml_used AS (
+            SELECT COALESCE(SUM(num_red_ml * quantity), 0) AS red_ml,
+                COALESCE(SUM(num_green_ml * quantity), 0) AS green_ml,
+                COALESCE(SUM(num_blue_ml * quantity), 0) AS blue_ml,
+                COALESCE(SUM(num_dark_ml * quantity), 0) AS dark_ml
+            FROM delivered
+        ), ml_ledger_rows AS (
+            INSERT INTO ml_ledger(red_ml_change, green_ml_change, blue_ml_change, dark_ml_change)
+            SELECT -red_ml, -green_ml, -blue_ml, -dark_ml
+            FROM ml_used
+        )
+        UPDATE shop_balances
+        SET red_ml = shop_balances.red_ml - ml_used.red_ml,
+            green_ml = shop_balances.green_ml - ml_used.green_ml,
+            blue_ml = shop_balances.blue_ml - ml_used.blue_ml,
+            dark_ml = shop_balances.dark_ml - ml_used.dark_ml
+        FROM ml_used
+        WHERE shop_balances.id = 1
+        """
+    ), {
+        "potion_ids": [potion_id for potion_id, _, _ in potions_delivered],
+        "num_red_ml": [potion_type[0] for _, potion_type, _ in potions_delivered],
+        "num_green_ml": [potion_type[1] for _, potion_type, _ in potions_delivered],
+        "num_blue_ml": [potion_type[2] for _, potion_type, _ in potions_delivered],
+        "num_dark_ml": [potion_type[3] for _, potion_type, _ in potions_delivered],
+        "quantities": [quantity for _, _, quantity in potions_delivered]
+    })
+
+
+async def reset(connection, gold):
+    """
+    Start the balances over with the given gold, no ml and zero of every
+    potion. The caller is expected to have truncated the ledgers already.
+    """
+    await connection.execute(sqlalchemy.text("TRUNCATE TABLE shop_balances, potion_balances"))
+    await connection.execute(sqlalchemy.text(
+        """
+        INSERT INTO shop_balances(id, gold, red_ml, green_ml, blue_ml, dark_ml)
+        VALUES (1, 0, 0, 0, 0, 0)
+        """
+    ))
+    await connection.execute(sqlalchemy.text(
+        """
+        INSERT INTO potion_balances(potion_id, quantity)
+        SELECT potion_id, 0
+        FROM potions_inventory
+        """
+    ))
+    await record_gold(connection, gold)
+    await record_ml(connection, 0, 0, 0, 0)
+    await connection.execute(sqlalchemy.text(
+        """
+        INSERT INTO potion_ledger(potion_id, potion_change)
+        SELECT potion_id, 0
+        FROM potions_inventory
+        """
+    ))
+
+
+async def rebuild(connection):
+    """ Recompute every balance from the full ledger sums. """
+    await connection.execute(sqlalchemy.text(
+        """
+        INSERT INTO shop_balances(id, gold, red_ml, green_ml, blue_ml, dark_ml)
+        SELECT 1,
+            (SELECT COALESCE(SUM(gold_change), 0) FROM gold_ledger),
+            COALESCE(SUM(red_ml_change), 0),
+            COALESCE(SUM(green_ml_change), 0),
+            COALESCE(SUM(blue_ml_change), 0),
+            COALESCE(SUM(dark_ml_change), 0)
+        FROM ml_ledger
+        ON CONFLICT (id) DO UPDATE
+        SET gold = EXCLUDED.gold,
+            red_ml = EXCLUDED.red_ml,
+            green_ml = EXCLUDED.green_ml,
+            blue_ml = EXCLUDED.blue_ml,
+            dark_ml = EXCLUDED.dark_ml
+        """
+    ))
+    await connection.execute(sqlalchemy.text(
+        """
+        INSERT INTO potion_balances(potion_id, quantity)
+        SELECT potions_inventory.potion_id, COALESCE(SUM(potion_ledger.potion_change), 0)
+        FROM potions_inventory
+        LEFT JOIN potion_ledger ON potion_ledger.potion_id = potions_inventory.potion_id
+        GROUP BY potions_inventory.potion_id
+        ON CONFLICT (potion_id) DO UPDATE
+        SET quantity = EXCLUDED.quantity
+        """
+    ))
+
+
+async def check(connection):
+    """
+    Compare the balances against the full ledger sums. Returns a list of
+    mismatches, empty when everything agrees.
+    """
+    mismatches = []
+
+    row = (await connection.execute(sqlalchemy.text(
+        """
+        SELECT
+            shop_balances.gold, shop_balances.red_ml, shop_balances.green_ml,
+            shop_balances.blue_ml, shop_balances.dark_ml,
+            (SELECT COALESCE(SUM(gold_change), 0) FROM gold_ledger) AS ledger_gold,
+            (SELECT COALESCE(SUM(red_ml_change), 0) FROM ml_ledger) AS ledger_red_ml,
+            (SELECT COALESCE(SUM(green_ml_change), 0) FROM ml_ledger) AS ledger_green_ml,
+            (SELECT COALESCE(SUM(blue_ml_change), 0) FROM ml_ledger) AS ledger_blue_ml,
+            (SELECT COALESCE(SUM(dark_ml_change), 0) FROM ml_ledger) AS ledger_dark_ml
+        FROM shop_balances
+        WHERE id = 1
+        """
+    ))).fetchone()
+
+    if row is None:
+        mismatches.append({"balance": "shop_balances", "balance_value": None, "ledger_value": None})
+    else:
+        for name in ["gold", "red_ml", "green_ml", "blue_ml", "dark_ml"]:
+            balance_value = getattr(row, name)
+            ledger_value = getattr(row, f"ledger_{name}")
+            if balance_value != ledger_value:
+                mismatches.append({"balance": name, "balance_value": balance_value, "ledger_value": ledger_value})
+
+    potion_rows = (await connection.execute(sqlalchemy.text(
+        """
+        SELECT potions_inventory.potion_id,
+            COALESCE(potion_balances.quantity, 0) AS balance_value,
+            (SELECT COALESCE(SUM(potion_change), 0)
+             FROM potion_ledger
+             WHERE potion_ledger.potion_id = potions_inventory.potion_id) AS ledger_value
+        FROM potions_inventory
+        LEFT JOIN potion_balances ON potion_balances.potion_id = potions_inventory.potion_id
+        """
+    ))).fetchall()
+
+    for potion in potion_rows:
+        if potion.balance_value != potion.ledger_value:
+            mismatches.append({
+                "balance": f"potion_{potion.potion_id}",
+                "balance_value": potion.balance_value,
+                "ledger_value": potion.ledger_value
+            })
+
+    return mismatches
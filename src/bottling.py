@@ -0,0 +1,257 @@
+import os
+import random
+from itertools import count
+
+from src import log
+
+# Bottle planning, kept apart from the bottler router so the planners are
+# plain functions of the shop state: the potions (rows with sku, inventory,
+# price and num_*_ml), the ml on hand per color, the potion capacity and the
+# demand (sku -> potions sold at the current game hour, see src/sales.py).
+#
+# Potions are bottled best sellers first; among potions that sold the same,
+# including all of them before anything has sold, the fixed priority below
+# decides.
+#
+# BOTTLER_PLANNER picks the planner used by /bottler/plan:
+#   greedy      walk the potions in priority order, one at a time (default)
+#   vectorized  same order and caps, but solved in batches with numpy, for
+#               catalogs with many recipes
+
+logger = log.get_logger(__name__)
+
+BASE_CAP_PERCENTAGE = 0.1 # Base cap for each potion
+MAX_INVENTORY_PER_POTION = 70 # to change back
+# max_per_potion_type = int(potion_capacity * 0.25)  # 25% limit per potion type - uncomment when i have more potion capacity
+
+priority_counter = count(1)
+# Define priority based on popularity ranking
+POTION_PRIORITY = {
+    (50, 50, 0, 0): next(priority_counter), # YELLOW
+    (25, 25, 25, 25): next(priority_counter),
+    (100, 0, 0, 0): next(priority_counter),
+    (0, 100, 0, 0): next(priority_counter),
+    (20, 0, 80, 0): next(priority_counter),
+    (0, 80, 0, 20): next(priority_counter),
+    (75, 25, 0, 0): next(priority_counter),
+    (60, 40, 0, 0): next(priority_counter),
+    (95, 5, 0, 0): next(priority_counter),
+    (30, 25, 45, 0): next(priority_counter),
+    (50, 0, 50, 0): next(priority_counter), # PURPLE
+    (0, 0, 100, 0): next(priority_counter)
+}
+FIRST = (50, 50, 0, 0)
+DEPRIORITIZED = [(0, 50, 50, 0), (0, 30, 70, 0)]
+
+
+def recipe(potion):
+    return (potion.num_red_ml, potion.num_green_ml, potion.num_blue_ml, potion.num_dark_ml)
+
+
+def bottle_limits(potion_capacity, total_inventory):
+    """ Returns (production_limit, tier_cap) for the current inventory level. """
+    production_limit = int(potion_capacity * 1) # to change back to 0.95
+
+    # Determine base cap using percentage of total capacity
+    base_cap = int(potion_capacity * BASE_CAP_PERCENTAGE)
+
+    # Adjust cap for each potion based on current inventory levels using tiered logic
+    if total_inventory < production_limit * 0.25:
+        tier_cap = int(base_cap * 1)  # Increase cap by 50% for low inventory 1.25
+    elif total_inventory < production_limit * 0.75:
+        tier_cap = base_cap  # Maintain base cap for medium inventory
+    else:
+        tier_cap = int(base_cap * 0.3)  # Decrease cap by 50% for high inventory
+
+    logger.debug("production_limit: %s, tier_cap: %s", production_limit, tier_cap)
+    return production_limit, tier_cap
+
+
+def rank_potions(potions, demand=None):
+    demand = demand or {}
+    return sorted(
+        potions,
+        key=lambda p: (
+            -demand.get(p.sku, 0),  # Best sellers at this hour
+            0 if recipe(p) == FIRST else 1,  # Special case first
+            POTION_PRIORITY.get(recipe(p), float('inf')),  # Popularity priority
+            sum(1 for ml in recipe(p) if ml > 0),  # Non-zero ML count
+            1 if recipe(p) in DEPRIORITIZED else 0,  # Deprioritize
+            p.price,  # Price in ascending order
+            random.random()  # Tie-breaker
+        )
+    )
+
+
+def greedy_plan(potions, ml, potion_capacity, demand=None):
+    red_ml, green_ml, blue_ml, dark_ml = ml
+
+    total_inventory = sum(potion.inventory or 0 for potion in potions)
+    logger.debug("total_inventory from database: %s", total_inventory)
+
+    production_limit, tier_cap = bottle_limits(potion_capacity, total_inventory)
+
+    sorted_potions = rank_potions(potions, demand)
+    logger.debug("sorted_potions: %s", sorted_potions)
+
+    total_potion_made = 0
+    my_bottle_plan = []
+    potion_quantities = {potion.sku: 0 for potion in sorted_potions}
+
+    for potion in sorted_potions:
+        # Skip production if total inventory for this potion already exceeds the max inventory cap
+        current_inventory = potion.inventory or 0
+        if current_inventory >= MAX_INVENTORY_PER_POTION:
+            logger.debug("Skipping %s as it exceeds the max inventory limit of %s", potion.sku, MAX_INVENTORY_PER_POTION)
+            continue
+        # A recipe without any ml (a potion whose ml columns are NULL) can't be bottled
+        if not any(recipe(potion)):
+            continue
+
+        logger.debug("current inventory of %s: %s", potion.sku, current_inventory)
+
+        max_bottles_possible = min(
+            red_ml // potion.num_red_ml if potion.num_red_ml > 0 else float('inf'),
+            green_ml // potion.num_green_ml if potion.num_green_ml > 0 else float('inf'),
+            blue_ml // potion.num_blue_ml if potion.num_blue_ml > 0 else float('inf'),
+            dark_ml // potion.num_dark_ml if potion.num_dark_ml > 0 else float ('inf')
+        )
+        logger.debug("max_bottles_possible: %s", max_bottles_possible)
+
+        # Limit production to the per-potion cap, available capacity, and max inventory
+        target_quantity = min(
+            max_bottles_possible,
+            production_limit - total_potion_made,
+            tier_cap - potion_quantities[potion.sku]
+        )
+
+        if total_potion_made + target_quantity > production_limit:
+            target_quantity = production_limit - total_potion_made
+
+        # If target_quantity is zero, skip production
+        if target_quantity <= 0:
+            continue
+
+        red_ml -= potion.num_red_ml * target_quantity
+        green_ml -= potion.num_green_ml * target_quantity
+        blue_ml -= potion.num_blue_ml * target_quantity
+        dark_ml -= potion.num_dark_ml * target_quantity
+
+        potion_quantities[potion.sku] += target_quantity # adding target_quantity directly no looping required
+        total_potion_made += target_quantity
+        logger.debug("TOTAL POTION MADE after the if target_quantity > 0: %s", total_potion_made)
+
+        if total_potion_made + total_inventory >= production_limit:
+            logger.debug("total_potion_made + total_inventory  >= production_limit so breaking 2")
+            break
+
+        my_bottle_plan.append({
+            "potion_type": list(recipe(potion)),
+            "quantity": target_quantity
+        })
+        logger.debug("my_bottle_plan: %s", my_bottle_plan)
+
+    return my_bottle_plan
+
+
+def vectorized_plan(potions, ml, potion_capacity, demand=None):
+    """
+    The greedy plan solved in batches. The potions are ranked the same way
+    and each gets at most the tier cap, but instead of walking them one at a
+    time this takes the running ml and bottle totals of every remaining potion
+    at once: everything before the first potion that would overdraw a color
+    or the capacity is bottled in full, that potion gets whatever is left, and
+    the rest is solved again. The number of passes is bounded by how often a
+    potion is cut short, not by the number of recipes.
+
+    Unlike the greedy loop, the potion that fills the capacity is kept in the
+    plan rather than dropped.
+    """
+    # Imported here so the default planner doesn't pay for numpy on cold start
+    import numpy as np
+
+    if not potions:
+        return []
+
+    recipes = np.array([recipe(potion) for potion in potions], dtype=np.int64)
+    inventory = np.array([potion.inventory or 0 for potion in potions], dtype=np.int64)
+    prices = np.array([potion.price for potion in potions], dtype=np.int64)
+    sold = np.array([(demand or {}).get(potion.sku, 0) for potion in potions], dtype=np.int64)
+
+    total_inventory = int(inventory.sum())
+    production_limit, tier_cap = bottle_limits(potion_capacity, total_inventory)
+
+    # Same ranking as rank_potions; lexsort takes the most significant key last.
+    # A recipe is at most 100 ml per color, so one byte per color is a unique code.
+    weights = np.array([1 << 24, 1 << 16, 1 << 8, 1], dtype=np.int64)
+    codes = recipes @ weights
+    priority_codes = np.array(list(POTION_PRIORITY), dtype=np.int64) @ weights
+    priority_ranks = np.array(list(POTION_PRIORITY.values()), dtype=np.float64)
+    by_code = np.argsort(priority_codes)
+    position = np.clip(np.searchsorted(priority_codes[by_code], codes), 0, len(by_code) - 1)
+    known = priority_codes[by_code][position] == codes
+    priority = np.where(known, priority_ranks[by_code][position], np.inf)
+    order = np.lexsort((
+        np.random.random(len(potions)),
+        prices,
+        np.isin(codes, np.array(DEPRIORITIZED, dtype=np.int64) @ weights),
+        (recipes > 0).sum(axis=1),
+        priority,
+        codes != np.array(FIRST, dtype=np.int64) @ weights,
+        -sold,
+    ))
+
+    recipes = recipes[order]
+    bottleable = (inventory[order] < MAX_INVENTORY_PER_POTION) & (recipes.sum(axis=1) > 0)
+    wanted = np.where(bottleable, max(tier_cap, 0), 0)
+    quantities = np.zeros(len(order), dtype=np.int64)
+    remaining = np.array(ml, dtype=np.int64)
+    room = production_limit - total_inventory
+
+    start = 0
+    while start < len(order) and room > 0:
+        batch = recipes[start:]
+        # Recipes that can't make a single bottle from what is left drop out
+        want = np.where((batch <= remaining).all(axis=1), wanted[start:], 0)
+        used = np.cumsum(want[:, None] * batch, axis=0)
+        made = np.cumsum(want)
+        short = (used > remaining).any(axis=1) | (made > room)
+        if not short.any():
+            quantities[start:] = want
+            break
+
+        stop = int(short.argmax())
+        quantities[start:start + stop] = want[:stop]
+        if stop > 0:
+            remaining -= used[stop - 1]
+            room -= int(made[stop - 1])
+
+        # The first potion that doesn't fit in full gets what is left
+        needed = batch[stop]
+        per_color = np.where(needed > 0, remaining // np.maximum(needed, 1), room)
+        quantity = max(0, min(int(want[stop]), int(per_color.min()), room))
+        quantities[start + stop] = quantity
+        remaining -= needed * quantity
+        room -= quantity
+        start += stop + 1
+
+    planned = np.flatnonzero(quantities > 0)
+    return [
+        {"potion_type": recipes[i].tolist(), "quantity": int(quantities[i])}
+        for i in planned
+    ]
+
+
+planners = {
+    "greedy": greedy_plan,
+    "vectorized": vectorized_plan,
+}
+
+PLANNER = os.environ.get("BOTTLER_PLANNER", "greedy")
+if PLANNER not in planners:
+    raise ValueError(f"BOTTLER_PLANNER must be one of {', '.join(planners)}, not {PLANNER!r}")
+
+
+def plan(potions, ml, potion_capacity, demand=None):
+    """ Bottle plan from the configured planner. """
+    return planners[PLANNER](potions, ml, potion_capacity, demand)
@@ -0,0 +1,116 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+
+from src import tenants
+
+# Process-local inventory version. Anything that changes which potions are in
+# stock (checkout, bottle delivery, reset) bumps it after committing, which
+# invalidates every cache keyed on it.
+_inventory_version = 0
+_version_lock = threading.Lock()
+
+
+def inventory_version():
+    return _inventory_version
+
+
+def bump_inventory_version():
+    global _inventory_version, _state_version
+    with _version_lock:
+        _inventory_version += 1
+        _state_version += 1
+
+
+# Broader than the inventory version: also bumped when gold, ml or capacity
+# change (barrel and capacity deliveries), for the audit and plan caches.
+_state_version = 0
+
+
+def state_version():
+    return _state_version
+
+
+def bump_state_version():
+    global _state_version
+    with _version_lock:
+        _state_version += 1
+
+
+# Same for the potions themselves (skus, prices and recipes). They only change
+# when potions_inventory is edited by hand, so this is bumped from the admin
+# refresh endpoint rather than by the shop's own writes.
+_potions_version = 0
+
+
+def potions_version():
+    return _potions_version
+
+
+def bump_potions_version():
+    global _potions_version
+    with _version_lock:
+        _potions_version += 1
+
+
+class VersionedCache:
+    """
+    Holds a single value computed for a given version. Concurrent misses for
+    the same version are coalesced: the loader runs once, in a task of its
+    own, and every caller awaits its result.
+
+    The version only knows about writes made by this process, so entries also
+    expire after ttl seconds to pick up writes made by other workers.
+
+    In multi-tenant mode there is one value per tenant; the versions are
+    shared, so a write by one tenant only costs the others a reload.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        # tenant -> (version, value, loaded_at)
+        self._entries = {}
+        self._pending = {}
+
+    async def get(self, version, loader):
+        tenant = tenants.current.get()
+        entry = self._entries.get(tenant)
+        if entry is not None and entry[0] == version and time.monotonic() - entry[2] < self.ttl:
+            return entry[1]
+
+        key = (tenant, version)
+        task = self._pending.get(key)
+        if task is None:
+            # The loader runs as its own task, which every caller awaits
+            # through a shield, so a caller that is cancelled (say its client
+            # disconnected) doesn't cancel the load for the others
+            task = asyncio.get_running_loop().create_task(loader())
+            self._pending[key] = task
+            task.add_done_callback(functools.partial(self._loaded, tenant, version))
+        return await asyncio.shield(task)
+
+    def _loaded(self, tenant, version, task):
+        # Runs before the waiters resume
+        del self._pending[(tenant, version)]
+        if task.cancelled():
+            return
+        # Also marks the exception as retrieved, in case nobody is left waiting
+        if task.exception() is not None:
+            return
+        self._entries[tenant] = (version, task.result(), time.monotonic())
+
+    def clear(self):
+        self._entries.clear()
+
+
+catalog_cache = VersionedCache(ttl=float(os.environ.get("CATALOG_CACHE_TTL", "2")))
+potion_index_cache = VersionedCache(ttl=float(os.environ.get("POTION_INDEX_TTL", "300")))
+
+# Pre-serialized response bodies, see src/responses.py
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "2"))
+audit_cache = VersionedCache(ttl=RESPONSE_CACHE_TTL)
+bottler_plan_cache = VersionedCache(ttl=RESPONSE_CACHE_TTL)
+barrels_plan_cache = VersionedCache(ttl=RESPONSE_CACHE_TTL)
+capacity_plan_cache = VersionedCache(ttl=RESPONSE_CACHE_TTL)
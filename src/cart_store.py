@@ -0,0 +1,230 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import sqlalchemy
+
+from src import log
+from src import tenants
+
+# Open carts, kept in process memory when CART_STORE=memory (the default,
+# CART_STORE=database, writes every cart and item straight to Postgres).
+#
+# Most carts are abandoned, so in memory mode nothing is written until
+# checkout, which inserts the cart and its items and sells them in one
+# transaction. Cart ids still come from the carts identity, reserved a block
+# at a time, so the id handed out at create_cart is the id the cart is
+# stored under.
+#
+# Open carts are bounded (CART_STORE_MAX_CARTS, least recently used go
+# first) and expire after CART_STORE_TTL seconds without activity. With
+# CART_STORE_JOURNAL set to a file path every change is appended to it as a
+# JSON line and replayed on startup, so carts that were open when the
+# process died survive a restart. A cart evicted before checkout is gone:
+# adding to it or checking it out answers 404.
+#
+# Memory mode only works with a single worker process. Open carts live in
+# this process alone, so a second uvicorn worker (or serverless instance)
+# sharing the database would never see carts opened on this one.
+
+logger = log.get_logger(__name__)
+
+MODE = os.environ.get("CART_STORE", "database")
+if MODE not in ("database", "memory"):
+    raise ValueError(f"CART_STORE must be database or memory, not {MODE!r}")
+if MODE == "memory" and tenants.enabled():
+    # Open carts are keyed by id alone, and every tenant has its own carts ids
+    raise ValueError("CART_STORE=memory can't be used with TENANTS")
+
+MAX_CARTS = int(os.environ.get("CART_STORE_MAX_CARTS", "10000"))
+TTL = float(os.environ.get("CART_STORE_TTL", "3600"))
+ID_BLOCK_SIZE = int(os.environ.get("CART_STORE_ID_BLOCK", "100"))
+JOURNAL = os.environ.get("CART_STORE_JOURNAL")
+
+
+def enabled():
+    return MODE == "memory"
+
+
+class Cart:
+    def __init__(self, cart_id, customer_id, created_at):
+        self.cart_id = cart_id
+        self.customer_id = customer_id
+        self.created_at = created_at
+        # potion_id -> {"qty", "gold_paid", "added_at"}
+        self.items = {}
+        self.touched_at = time.monotonic()
+
+
+class CartStore:
+    def __init__(self, max_carts, ttl, journal_path=None):
+        self.max_carts = max_carts
+        self.ttl = ttl
+        self.journal_path = journal_path
+        self._carts = OrderedDict()
+        self._free_ids = []
+        self._journal = None
+        if journal_path:
+            self._recover()
+
+    async def _next_id(self, connection):
+        if not self._free_ids:
+            result = await connection.execute(sqlalchemy.text(
+                """
+                SELECT nextval(pg_get_serial_sequence('carts', 'id'))
+                FROM generate_series(1, :block_size)
+                """
+            ), {"block_size": ID_BLOCK_SIZE})
+            # Requests that run out at the same time each reserve a block; the
+            # spare ids are simply used later
+            self._free_ids.extend(result.scalars().all())
+        return self._free_ids.pop(0)
+
+    async def create(self, connection, customer_id):
+        """ Open a cart for the customer and return its id. """
+        cart_id = await self._next_id(connection)
+        cart = Cart(cart_id, customer_id, datetime.now(timezone.utc))
+        self._carts[cart_id] = cart
+        self._write({"op": "create", "cart_id": cart_id, "customer_id": customer_id,
+                     "created_at": cart.created_at.isoformat()})
+        self._evict()
+        return cart_id
+
+    def get(self, cart_id):
+        """ The open cart, or None if it isn't held here (or has expired). """
+        self._evict()
+        cart = self._carts.get(cart_id)
+        if cart is not None:
+            cart.touched_at = time.monotonic()
+            self._carts.move_to_end(cart_id)
+        return cart
+
+    def set_item(self, cart, potion_id, qty, gold_paid):
+        added_at = datetime.now(timezone.utc)
+        cart.items[potion_id] = {"qty": qty, "gold_paid": gold_paid, "added_at": added_at}
+        self._write({"op": "set_item", "cart_id": cart.cart_id, "potion_id": potion_id,
+                     "qty": qty, "gold_paid": gold_paid, "added_at": added_at.isoformat()})
+
+    def take(self, cart_id):
+        """
+        Take an open cart out for checkout, so a concurrent checkout of it
+        doesn't find it too. It stays in the journal until checked_out, and
+        goes back with put_back if the checkout fails.
+        """
+        cart = self.get(cart_id)
+        if cart is not None:
+            del self._carts[cart_id]
+        return cart
+
+    def put_back(self, cart):
+        """ Reopen a cart whose checkout failed. """
+        cart.touched_at = time.monotonic()
+        self._carts[cart.cart_id] = cart
+
+    def checked_out(self, cart_id):
+        """ Forget a taken cart once it has been written to the database. """
+        self._write({"op": "remove", "cart_id": cart_id})
+
+    def remove(self, cart_id):
+        """ Forget an open cart. """
+        if self._carts.pop(cart_id, None) is not None:
+            self._write({"op": "remove", "cart_id": cart_id})
+
+    def clear(self):
+        """ Drop every open cart, e.g. when the shop is reset or restored. """
+        for cart_id in list(self._carts):
+            self.remove(cart_id)
+        # A restored carts sequence may have been moved past the reserved ids
+        self._free_ids.clear()
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._carts:
+            cart_id, cart = next(iter(self._carts.items()))
+            if len(self._carts) <= self.max_carts and now - cart.touched_at < self.ttl:
+                break
+            del self._carts[cart_id]
+            self._write({"op": "remove", "cart_id": cart_id})
+            logger.debug("evicted cart %s", cart_id)
+
+    def _write(self, entry):
+        if self._journal is None:
+            return
+        self._journal.write(json.dumps(entry) + "\n")
+        self._journal.flush()
+
+    def _recover(self):
+        """
+        Replay the journal into memory, then rewrite it with only the carts
+        that are still open so it doesn't grow forever.
+        """
+        carts = OrderedDict()
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by the crash
+                        continue
+                    if entry["op"] == "create":
+                        carts[entry["cart_id"]] = Cart(
+                            entry["cart_id"], entry["customer_id"],
+                            datetime.fromisoformat(entry["created_at"])
+                        )
+                    elif entry["op"] == "set_item" and entry["cart_id"] in carts:
+                        carts[entry["cart_id"]].items[entry["potion_id"]] = {
+                            "qty": entry["qty"],
+                            "gold_paid": entry["gold_paid"],
+                            "added_at": datetime.fromisoformat(entry["added_at"])
+                        }
+                    elif entry["op"] == "remove":
+                        carts.pop(entry["cart_id"], None)
+
+        self._carts = carts
+        with open(self.journal_path + ".tmp", "w") as journal:
+            for cart in carts.values():
+                journal.write(json.dumps({"op": "create", "cart_id": cart.cart_id, "customer_id": cart.customer_id,
+                                          "created_at": cart.created_at.isoformat()}) + "\n")
+                for potion_id, item in cart.items.items():
+                    journal.write(json.dumps({"op": "set_item", "cart_id": cart.cart_id, "potion_id": potion_id,
+                                              "qty": item["qty"], "gold_paid": item["gold_paid"],
+                                              "added_at": item["added_at"].isoformat()}) + "\n")
+        os.replace(self.journal_path + ".tmp", self.journal_path)
+        self._journal = open(self.journal_path, "a")
+        logger.info("recovered %s open carts from %s", len(carts), self.journal_path)
+
+
+async def flush(connection, cart):
+    """ Insert an open cart and its items, ready for balances.record_checkout. """
+    await connection.execute(sqlalchemy.text(
+        """
+        INSERT INTO carts (id, customer_id, created_at)
+        VALUES (:cart_id, :customer_id, :created_at)
+        """
+    ), {"cart_id": cart.cart_id, "customer_id": cart.customer_id, "created_at": cart.created_at})
+
+    if cart.items:
+        await connection.execute(sqlalchemy.text(
+            """
+            INSERT INTO cart_items (cart_id, potion_id, qty, added_at, gold_paid)
+            SELECT :cart_id, potion_id, qty, added_at, gold_paid
+            FROM unnest(
+                CAST(:potion_ids AS bigint[]),
+                CAST(:quantities AS integer[]),
+                CAST(:added_at AS timestamptz[]),
+                CAST(:gold_paid AS integer[])
+            ) AS items(potion_id, qty, added_at, gold_paid)
+            """
+        ), {
+            "cart_id": cart.cart_id,
+            "potion_ids": list(cart.items),
+            "quantities": [item["qty"] for item in cart.items.values()],
+            "added_at": [item["added_at"] for item in cart.items.values()],
+            "gold_paid": [item["gold_paid"] for item in cart.items.values()]
+        })
+
+
+store = CartStore(MAX_CARTS, TTL, JOURNAL) if enabled() else None
@@ -2,15 +2,114 @@ import os
 import dotenv
 import sqlalchemy
 from sqlalchemy import create_engine
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.engine import make_url
+from src import metrics
+from src import tenants
 
 def database_connection_url():
     dotenv.load_dotenv()
 
     return os.environ.get("POSTGRES_URI")
 
-engine = create_engine(database_connection_url(), pool_pre_ping=True)
+def async_database_connection_url():
+    """
+    Same database as POSTGRES_URI, but through the asyncpg driver. Set
+    ASYNC_POSTGRES_URI to use a different url for the async engine.
+    """
+    dotenv.load_dotenv()
+
+    url = os.environ.get("ASYNC_POSTGRES_URI")
+    if url:
+        return url
+    return make_url(database_connection_url()).set(drivername="postgresql+asyncpg")
+
+# Both engines are created on first use rather than at import, so importing
+# the app (and every serverless cold start) doesn't wait on the database.
+# The sync engine is kept for scripts and benchmarks; the API handlers use
+# the async engine so they don't tie up the thread pool while waiting on
+# the database.
+_engine = None
+_async_engine = None
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine = create_engine(database_connection_url(), pool_pre_ping=True, poolclass=metrics.TimedQueuePool)
+        metrics.instrument(_engine, "sync")
+    return _engine
+
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        _async_engine = create_async_engine(
+            async_database_connection_url(),
+            pool_pre_ping=True,
+            pool_size=int(os.environ.get("DB_POOL_SIZE", "5")),
+            max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", "10")),
+            # In multi-tenant mode every shop shares this one pool
+            poolclass=tenants.TenantLimitedPool if tenants.enabled() else metrics.TimedAsyncAdaptedQueuePool
+        )
+        metrics.instrument(_async_engine.sync_engine, "async")
+        if tenants.enabled():
+            tenants.instrument(_async_engine.sync_engine)
+    return _async_engine
+
+def __getattr__(name):
+    # Keeps db.engine and db.async_engine working while creating them lazily
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+async def execute(statement, parameters=None):
+    """
+    Run a read on its own connection and return the buffered result, so
+    independent reads can be awaited together with asyncio.gather.
+    """
+    async with get_async_engine().connect() as connection:
+        return await connection.execute(statement, parameters or {})
+
+# Declared to match schema.sql instead of reflected from the database, which
+# cost several round trips on every import.
 metadata_obj = sqlalchemy.MetaData()
-customers = sqlalchemy.Table("customers", metadata_obj, autoload_with=engine)
-potions_inventory = sqlalchemy.Table("potions_inventory", metadata_obj, autoload_with=engine)
-carts = sqlalchemy.Table("carts", metadata_obj, autoload_with=engine)
-cart_items = sqlalchemy.Table("cart_items", metadata_obj, autoload_with=engine)
\ No newline at end of file
+
+customers = sqlalchemy.Table(
+    "customers", metadata_obj,
+    sqlalchemy.Column("id", sqlalchemy.BigInteger, sqlalchemy.Identity(), primary_key=True),
+    sqlalchemy.Column("customer_name", sqlalchemy.String, unique=True),
+    sqlalchemy.Column("customer_class", sqlalchemy.String),
+    sqlalchemy.Column("level", sqlalchemy.Integer),
+)
+
+potions_inventory = sqlalchemy.Table(
+    "potions_inventory", metadata_obj,
+    sqlalchemy.Column("potion_id", sqlalchemy.Integer, sqlalchemy.Identity(), primary_key=True),
+    sqlalchemy.Column("sku", sqlalchemy.Text),
+    sqlalchemy.Column("price", sqlalchemy.Integer),
+    sqlalchemy.Column("potion_type", ARRAY(sqlalchemy.Integer)),
+    sqlalchemy.Column("potion_name", sqlalchemy.Text),
+    sqlalchemy.Column("num_red_ml", sqlalchemy.Integer),
+    sqlalchemy.Column("num_green_ml", sqlalchemy.Integer),
+    sqlalchemy.Column("num_blue_ml", sqlalchemy.Integer),
+    sqlalchemy.Column("num_dark_ml", sqlalchemy.Integer),
+)
+
+carts = sqlalchemy.Table(
+    "carts", metadata_obj,
+    sqlalchemy.Column("id", sqlalchemy.BigInteger, sqlalchemy.Identity(), primary_key=True),
+    sqlalchemy.Column("customer_id", sqlalchemy.Integer, sqlalchemy.ForeignKey("customers.id")),
+    sqlalchemy.Column("created_at", sqlalchemy.DateTime(timezone=True), nullable=False),
+)
+
+cart_items = sqlalchemy.Table(
+    "cart_items", metadata_obj,
+    sqlalchemy.Column("id", sqlalchemy.BigInteger, sqlalchemy.Identity(), primary_key=True),
+    sqlalchemy.Column("qty", sqlalchemy.Integer, nullable=False),
+    sqlalchemy.Column("cart_id", sqlalchemy.BigInteger, sqlalchemy.ForeignKey("carts.id")),
+    sqlalchemy.Column("potion_id", sqlalchemy.BigInteger, sqlalchemy.ForeignKey("potions_inventory.potion_id")),
+    sqlalchemy.Column("added_at", sqlalchemy.DateTime(timezone=True), nullable=False),
+    sqlalchemy.Column("gold_paid", sqlalchemy.Integer),
+)
@@ -0,0 +1,158 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import sqlalchemy
+
+from src import log
+from src import tenants
+
+# Compaction and partition upkeep for the append-only ledgers.
+#
+# Compaction folds every row older than a horizon into checkpoint rows: one
+# per ledger (one per potion for potion_ledger) holding the sum of the rows
+# it replaces, dated at the cutoff. Every ledger sum, and so every balance,
+# comes out the same. Compacting again later folds the old checkpoint into
+# the new one.
+#
+# The ledgers are partitioned by month of created_at (see schema.sql), so
+# once a month lies entirely before the cutoff its partition is empty and is
+# dropped as a whole table instead of leaving dead rows behind. The coming
+# months' partitions are created on the first tick of every day, so rows
+# don't land in the default partition (which would keep their month from
+# ever getting one) when the ledgers go a while without being compacted.
+
+logger = log.get_logger(__name__)
+
+HORIZON_DAYS = int(os.environ.get("LEDGER_COMPACTION_HORIZON_DAYS", "30"))
+PARTITION_MONTHS_AHEAD = 2
+
+# ledger -> (summed columns, columns a checkpoint is kept per)
+LEDGERS = {
+    "gold_ledger": (["gold_change"], []),
+    "ml_ledger": (["red_ml_change", "green_ml_change", "blue_ml_change", "dark_ml_change"], []),
+    "potion_ledger": (["potion_change"], ["potion_id"]),
+    "ml_c_ledger": (["ml_c_change"], []),
+    "potion_c_ledger": (["potion_c_change"], []),
+}
+
+
+def cutoff_for(horizon_days, now=None):
+    return (now or datetime.now(timezone.utc)) - timedelta(days=horizon_days)
+
+
+async def compact(connection, cutoff):
+    """
+    Fold the rows of every ledger created before cutoff into checkpoint rows.
+    Returns {ledger: {"rows_folded", "checkpoint_rows"}}.
+    """
+    folded = {}
+    for ledger, (sums, keys) in LEDGERS.items():
+        columns = keys + sums
+        summed = keys + [f"SUM({column})" for column in sums]
+        group_by = f"GROUP BY {', '.join(keys)}" if keys else "HAVING COUNT(*) > 0"
+        row = (await connection.execute(sqlalchemy.text(
+            f"""
+            WITH folded AS (
+                DELETE FROM {ledger}
+                WHERE created_at < :cutoff
+                RETURNING {', '.join(columns)}
+            ), checkpoint AS (
+                INSERT INTO {ledger}({', '.join(columns)}, created_at)
+                SELECT {', '.join(summed)}, CAST(:cutoff AS timestamptz)
+                FROM folded
+                {group_by}
+                RETURNING 1
+            )
+            SELECT (SELECT COUNT(*) FROM folded) AS rows_folded,
+                (SELECT COUNT(*) FROM checkpoint) AS checkpoint_rows
+            """
+        ), {"cutoff": cutoff})).one()
+        folded[ledger] = {"rows_folded": row.rows_folded, "checkpoint_rows": row.checkpoint_rows}
+    return folded
+
+
+async def ensure_partitions(connection, months_ahead=PARTITION_MONTHS_AHEAD):
+    """ Create the monthly partitions through months_ahead from now. Returns the new ones. """
+    result = await connection.execute(sqlalchemy.text(
+        """
+        SELECT create_ledger_partitions(ledger, current_date,
+            (current_date + make_interval(months => :months_ahead))::date)
+        FROM unnest(CAST(:ledgers AS text[])) AS ledger
+        """
+    ), {"months_ahead": months_ahead, "ledgers": list(LEDGERS)})
+    return result.scalars().all()
+
+
+# tenant -> the day ensure_partitions last ran for it from the tick
+_partitions_ensured_on = {}
+
+
+def _today():
+    return datetime.now(timezone.utc).date()
+
+
+def upcoming_partitions_due():
+    """ Whether the tick should run ensure_upcoming_partitions: once a day per tenant. """
+    return _partitions_ensured_on.get(tenants.current.get()) != _today()
+
+
+async def ensure_upcoming_partitions(connection):
+    """ ensure_partitions from the tick. Returns the new partitions. """
+    created = await ensure_partitions(connection)
+    _partitions_ensured_on[tenants.current.get()] = _today()
+    if created:
+        logger.info("created ledger partitions %s", created)
+    return created
+
+
+def partition_range(ledger, partition):
+    """
+    The [start, end) months of a monthly partition of ledger, e.g.
+    gold_ledger_2024_11 -> (2024-11-01, 2024-12-01), or None for the default
+    partition.
+    """
+    month = partition[len(ledger) + 1:]
+    try:
+        start = datetime.strptime(month, "%Y_%m").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+
+async def old_partitions(connection, cutoff):
+    """
+    The monthly partitions that end on or before cutoff, as (ledger,
+    partition, rows, bytes).
+    """
+    result = await connection.execute(sqlalchemy.text(
+        """
+        SELECT parent.relname AS ledger, child.relname AS partition
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = ANY(CAST(:ledgers AS regclass[]))
+        ORDER BY child.relname
+        """
+    ), {"ledgers": list(LEDGERS)})
+
+    partitions = []
+    for ledger, partition in result:
+        month = partition_range(ledger, partition)
+        # None for the default partition
+        if month is None or month[1] > cutoff:
+            continue
+        row = (await connection.execute(sqlalchemy.text(
+            f"""
+            SELECT (SELECT COUNT(*) FROM {partition}) AS rows,
+                pg_total_relation_size(CAST(:partition AS regclass)) AS bytes
+            """
+        ), {"partition": partition})).one()
+        partitions.append((ledger, partition, row.rows, row.bytes))
+    return partitions
+
+
+async def drop_partition(connection, ledger, partition):
+    """ Detach a partition from its ledger and drop it. Only call this on an empty one. """
+    await connection.execute(sqlalchemy.text(f"ALTER TABLE {ledger} DETACH PARTITION {partition}"))
+    await connection.execute(sqlalchemy.text(f"DROP TABLE {partition}"))
+    logger.info("dropped ledger partition %s", partition)
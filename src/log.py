@@ -0,0 +1,94 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+# Logging for the shop. Every record is one JSON line carrying the request id
+# of the request that produced it and the game tick it happened in, so the
+# lines for one Exchange call (or one tick) can be pulled out together.
+#
+# Configured from the environment:
+#   LOG_LEVEL        level for everything under src (default INFO)
+#   LOG_LEVELS       per-module overrides, e.g. "src.api.bottler=DEBUG,src.api.carts=WARNING"
+#   LOG_SAMPLE_RATE  fraction of DEBUG records to keep (default 1.0)
+#
+# Call sites pass their values as arguments (logger.debug("plan: %s", plan))
+# so nothing is formatted unless the record is actually emitted.
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+_current_tick = None
+
+
+def set_tick(day, hour):
+    """ Remember the game time from /info/current_time for every following record. """
+    global _current_tick
+    _current_tick = f"{day} {hour}"
+
+
+def current_tick():
+    return _current_tick
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": request_id.get(),
+            "tick": _current_tick,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DebugSampler(logging.Filter):
+    """ Keeps only a fraction of DEBUG records; everything above DEBUG passes. """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+def parse_levels(spec):
+    """ "a=DEBUG,b=WARNING" -> {"a": "DEBUG", "b": "WARNING"} """
+    levels = {}
+    for part in spec.split(","):
+        if "=" not in part:
+            continue
+        name, level = part.split("=", 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure():
+    root = logging.getLogger("src")
+    if getattr(root, "_shop_configured", False):
+        return
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(DebugSampler(float(os.environ.get("LOG_SAMPLE_RATE", "1"))))
+
+    root.addHandler(handler)
+    root.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    root.propagate = False
+    for name, level in parse_levels(os.environ.get("LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(level)
+
+    root._shop_configured = True
+
+
+def get_logger(name):
+    return logging.getLogger(name)
@@ -0,0 +1,220 @@
+import contextvars
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# Request and database metrics, served in the Prometheus text format by
+# GET /admin/metrics.
+#
+# Everything is plain counters kept in process memory: recording a request
+# is a few dict lookups and additions, so this stays on in production. The
+# numbers are per worker process and start over when it restarts.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250, 1000, 10000)
+WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+# Queries and rows of the request being handled, added to by the engine events
+_request_db = contextvars.ContextVar("request_db", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{format_labels({**labels, "le": bound})} {cumulative}'
+        yield f'{name}_bucket{format_labels({**labels, "le": "+Inf"})} {self.count}'
+        yield f"{name}_sum{format_labels(labels)} {self.sum}"
+        yield f"{name}_count{format_labels(labels)} {self.count}"
+
+
+class Family:
+    """ One metric name with a histogram or counter per label set. """
+
+    def __init__(self, name, kind, help, buckets=None):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.buckets = buckets
+        self.values = {}
+
+    def histogram(self, **labels):
+        key = tuple(sorted(labels.items()))
+        histogram = self.values.get(key)
+        if histogram is None:
+            histogram = self.values[key] = Histogram(self.buckets)
+        return histogram
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def lines(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for key, value in self.values.items():
+            if self.kind == "histogram":
+                yield from value.lines(self.name, dict(key))
+            else:
+                yield f"{self.name}{format_labels(dict(key))} {value}"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = (
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(pairs) + "}"
+
+
+request_duration = Family(
+    "shop_http_request_duration_seconds", "histogram",
+    "Time to handle a request, by route template.", LATENCY_BUCKETS)
+requests_total = Family(
+    "shop_http_requests_total", "counter",
+    "Requests handled, by route template and status code.")
+request_queries = Family(
+    "shop_db_queries_per_request", "histogram",
+    "SQL statements run while handling a request.", COUNT_BUCKETS)
+request_rows = Family(
+    "shop_db_rows_per_request", "histogram",
+    "Rows returned by the SQL statements of a request.", COUNT_BUCKETS)
+pool_wait = Family(
+    "shop_db_pool_checkout_wait_seconds", "histogram",
+    "Time spent waiting for a connection from the pool.", WAIT_BUCKETS)
+pool_invalidations = Family(
+    "shop_db_pool_invalidations_total", "counter",
+    "Pooled connections invalidated, including failed pre-pings.")
+
+families = [request_duration, requests_total, request_queries, request_rows, pool_wait, pool_invalidations]
+
+# name -> pool of every instrumented engine, read when the metrics are served
+_pools = {}
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (no per-request task or body buffering like
+    BaseHTTPMiddleware) that times every request and counts its queries.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        db_counts = {"queries": 0, "rows": 0}
+        token = _request_db.set(db_counts)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_db.reset(token)
+            # The router leaves the matched route in the scope; label by its
+            # template so /carts/{cart_id}/checkout is one series, not one per cart
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            method = scope["method"]
+            request_duration.histogram(method=method, route=path).observe(elapsed)
+            requests_total.inc(method=method, route=path, status=status["code"])
+            request_queries.histogram(route=path).observe(db_counts["queries"])
+            request_rows.histogram(route=path).observe(db_counts["rows"])
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    db_counts = _request_db.get()
+    if db_counts is None:
+        return
+    db_counts["queries"] += 1
+    if cursor.description is not None and cursor.rowcount > 0:
+        db_counts["rows"] += cursor.rowcount
+
+
+class TimedQueuePool(QueuePool):
+    """ QueuePool that records how long each checkout waited. """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_wait.histogram(engine=getattr(self, "metrics_name", "")).observe(time.perf_counter() - start)
+
+
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    """ The async engine's pool, recording how long each checkout waited. """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_wait.histogram(engine=getattr(self, "metrics_name", "")).observe(time.perf_counter() - start)
+
+
+def instrument(engine, name):
+    """
+    Count the queries and rows of every request on the engine and follow its
+    pool. engine is a sync Engine; pass async_engine.sync_engine for an
+    AsyncEngine.
+    """
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    pool = engine.pool
+    pool.metrics_name = name
+    _pools[name] = pool
+
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        pool_invalidations.inc(engine=name, reason=type(exception).__name__ if exception else "none")
+
+    event.listen(pool, "invalidate", on_invalidate)
+    event.listen(pool, "soft_invalidate", on_invalidate)
+
+
+def render():
+    """ Every metric in the Prometheus text exposition format. """
+    lines = []
+    for family in families:
+        lines.extend(family.lines())
+
+    for kind, help in [
+        ("size", "Connections the pool keeps open."),
+        ("checked_out", "Connections currently checked out."),
+        ("overflow", "Connections open beyond the pool size (negative while below it)."),
+    ]:
+        lines.append(f"# HELP shop_db_pool_{kind} {help}")
+        lines.append(f"# TYPE shop_db_pool_{kind} gauge")
+        for name, pool in _pools.items():
+            value = {"size": pool.size, "checked_out": pool.checkedout, "overflow": pool.overflow}[kind]()
+            lines.append(f"shop_db_pool_{kind}{format_labels({'engine': name})} {value}")
+
+    return "\n".join(lines) + "\n"
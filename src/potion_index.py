@@ -0,0 +1,74 @@
+import time
+
+import sqlalchemy
+
+from src import cache
+from src import database as db
+from src import log
+
+# Process-local copy of potions_inventory, looked up by sku, by recipe
+# (num_red_ml, num_green_ml, num_blue_ml, num_dark_ml) and by potion_id, so
+# the carts, bottler and catalog don't need a round trip to find a potion.
+#
+# The table hardly ever changes. The index is reloaded after POTION_INDEX_TTL
+# seconds, after POST /admin/potions/refresh, and when a lookup misses (at
+# most once a second, so unknown skus can't turn every call into a reload).
+
+logger = log.get_logger(__name__)
+
+MISS_RELOAD_INTERVAL = 1.0
+
+_last_miss_reload = 0.0
+
+
+class PotionIndex:
+    def __init__(self, rows):
+        self.by_id = {row.potion_id: row for row in rows}
+        self.by_sku = {row.sku: row for row in rows}
+        self.by_recipe = {
+            (row.num_red_ml, row.num_green_ml, row.num_blue_ml, row.num_dark_ml): row
+            for row in rows
+        }
+
+
+async def load_index():
+    result = await db.execute(sqlalchemy.text(
+        """
+        SELECT potion_id, sku, price, potion_type, potion_name,
+            num_red_ml, num_green_ml, num_blue_ml, num_dark_ml
+        FROM potions_inventory
+        """
+    ))
+    rows = result.fetchall()
+    logger.debug("potion index loaded with %s potions", len(rows))
+    return PotionIndex(rows)
+
+
+async def get_index():
+    return await cache.potion_index_cache.get(cache.potions_version(), load_index)
+
+
+def invalidate():
+    cache.bump_potions_version()
+
+
+async def _lookup(mapping, key):
+    global _last_miss_reload
+
+    potion = getattr(await get_index(), mapping).get(key)
+    if potion is None and time.monotonic() - _last_miss_reload >= MISS_RELOAD_INTERVAL:
+        # Possibly a potion added since the index was loaded
+        _last_miss_reload = time.monotonic()
+        invalidate()
+        potion = getattr(await get_index(), mapping).get(key)
+    return potion
+
+
+async def by_sku(sku):
+    """ The potion with this sku, or None. """
+    return await _lookup("by_sku", sku)
+
+
+async def by_recipe(potion_type):
+    """ The potion brewed from this [r, g, b, d] recipe, or None. """
+    return await _lookup("by_recipe", tuple(potion_type))
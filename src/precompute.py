@@ -0,0 +1,112 @@
+import asyncio
+import os
+import time
+
+from src import cache
+from src import log
+from src import responses
+from src import tenants
+
+# Speculative plan precomputation. Every /info/current_time starts a
+# background task that works out the bottle, capacity and barrel plans for
+# the shop state as it is then, so when the Exchange asks for them a moment
+# later the response is already serialized in memory. A barrel delivery
+# starts another for the bottle plan, which is asked for next.
+#
+# A precomputed plan is only served for the state version it was made at
+# (see src/cache.py); after any write the endpoint computes the plan live as
+# before. Plans older than PLAN_PRECOMPUTE_MAX_AGE seconds are not served
+# either, since the version doesn't see other workers' writes; it defaults to
+# RESPONSE_CACHE_TTL, the staleness the response caches already allow.
+# The barrel plan needs the wholesale catalog, so it is precomputed against
+# the last one /barrels/plan was called with.
+#
+# PLAN_PRECOMPUTE=off turns it off.
+
+logger = log.get_logger(__name__)
+
+PRECOMPUTE = os.environ.get("PLAN_PRECOMPUTE", "on")
+if PRECOMPUTE not in ("on", "off"):
+    raise ValueError(f"PLAN_PRECOMPUTE must be on or off, not {PRECOMPUTE!r}")
+
+MAX_AGE = float(os.environ.get("PLAN_PRECOMPUTE_MAX_AGE", cache.RESPONSE_CACHE_TTL))
+
+# (tenant, plan) -> (version, future of the serialized plan, started_at)
+_plans = {}
+# tenant -> the last wholesale catalog offered to /barrels/plan
+_offers = {}
+# Running tasks, so they aren't garbage collected before they finish
+_tasks = set()
+
+
+def enabled():
+    return PRECOMPUTE == "on"
+
+
+def remember_offer(wholesale_catalog):
+    _offers[tenants.current.get()] = wholesale_catalog
+
+
+async def cached(name, response_cache, version, loader):
+    """
+    Respond with the plan precomputed at this version if there is one (waiting
+    for it if it's still being worked out), otherwise like responses.cached.
+    """
+    entry = _plans.get((tenants.current.get(), name))
+    if entry is not None and entry[0] == version and time.monotonic() - entry[2] < MAX_AGE:
+        try:
+            return responses.PreSerialized(await asyncio.shield(entry[1]))
+        except Exception:
+            # Already logged by the task; compute it live instead
+            pass
+    return await responses.cached(response_cache, version, loader)
+
+
+def _jobs():
+    """ plan name -> (version, loader) for the state as it is now. """
+    # Imported here since the routers import this module
+    from src.api import barrels, bottler, inventory
+
+    jobs = {
+        "bottler": (cache.state_version(), bottler.bottle_plan),
+        "capacity": (cache.state_version(), inventory.capacity_plan),
+    }
+    offer = _offers.get(tenants.current.get())
+    if offer is not None:
+        jobs["barrels"] = (barrels.plan_version(offer), lambda: barrels.purchase_plan(offer))
+    return jobs
+
+
+async def _precompute(name, future, loader):
+    start = time.perf_counter()
+    try:
+        future.set_result(responses.dumps(await loader()))
+    except Exception as error:
+        logger.exception("precomputing the %s plan failed", name)
+        future.set_exception(error)
+        # Nobody may be waiting; mark the exception as retrieved
+        future.exception()
+    else:
+        logger.debug("precomputed the %s plan in %.1f ms", name, (time.perf_counter() - start) * 1000)
+
+
+def schedule(names=None):
+    """
+    Start working out the named plans (all of them by default) in the
+    background. The task inherits the current tenant.
+    """
+    if not enabled():
+        return
+    tenant = tenants.current.get()
+    loop = asyncio.get_running_loop()
+    for name, (version, loader) in _jobs().items():
+        if names is not None and name not in names:
+            continue
+        entry = _plans.get((tenant, name))
+        if entry is not None and entry[0] == version and not entry[1].done():
+            continue
+        future = loop.create_future()
+        _plans[(tenant, name)] = (version, future, time.monotonic())
+        task = loop.create_task(_precompute(name, future, loader))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
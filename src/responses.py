@@ -0,0 +1,26 @@
+import orjson
+from fastapi.responses import Response
+
+# JSON responses are rendered with orjson: server.py makes ORJSONResponse the
+# app's default response class, and responses that rarely change (catalog,
+# audit, plans) are serialized once per cache version and served as the same
+# bytes until it changes. A returned Response skips FastAPI's
+# jsonable_encoder pass as well as the serialization.
+
+
+class PreSerialized(Response):
+    """ A body that is already JSON bytes. """
+    media_type = "application/json"
+
+
+def dumps(content):
+    """ content as JSON bytes, with the options ORJSONResponse uses. """
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+
+async def cached(cache, version, loader):
+    """ Respond with loader()'s result, serialized at most once per version of the cache. """
+    async def load_body():
+        return dumps(await loader())
+
+    return PreSerialized(await cache.get(version, load_body))
@@ -0,0 +1,30 @@
+import sqlalchemy
+
+# Demand per potion, from the potion_sales aggregate (see schema.sql).
+#
+# Every checkout adds its potions to potion_sales under the game weekday and
+# hour in game_time and the customer's class (balances.record_checkout), so
+# reading the demand for the current hour touches one row per potion and
+# class that sold then, not the cart history. The catalog and the bottler
+# rank by it, falling back to their fixed orders where nothing has sold yet.
+
+# Potions sold in the current game weekday and hour, as (potion_id, quantity);
+# for use as a subquery.
+CURRENT_DEMAND = """
+    SELECT potion_sales.potion_id, SUM(potion_sales.quantity) AS quantity
+    FROM potion_sales
+    JOIN game_time ON game_time.day = potion_sales.weekday AND game_time.hour = potion_sales.hour
+    GROUP BY potion_sales.potion_id
+"""
+
+
+async def set_game_time(connection, day, hour):
+    """ Record the game time that following checkouts are counted under. """
+    await connection.execute(sqlalchemy.text(
+        """
+        INSERT INTO game_time(id, day, hour, updated_at)
+        VALUES (1, :day, :hour, now())
+        ON CONFLICT (id) DO UPDATE
+        SET day = EXCLUDED.day, hour = EXCLUDED.hour, updated_at = EXCLUDED.updated_at
+        """
+    ), {"day": day, "hour": hour})
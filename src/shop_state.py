@@ -0,0 +1,91 @@
+from typing import Optional
+
+import sqlalchemy
+from pydantic import BaseModel, validator
+
+from src import database as db
+from src import sales
+
+# Everything the planners read about the shop, loaded by a single statement
+# so it is one round trip and one snapshot: the gold and ml can't be from
+# before a delivery while the potion counts are from after it.
+
+
+class PotionState(BaseModel):
+    # potions_inventory allows NULL in every column. A hand edited row with
+    # a NULL price or ml counts it as 0 instead of failing validation, which
+    # the app's handler would report to the caller as a 422.
+    id: int
+    sku: Optional[str]
+    price: int
+    potion_type: Optional[list[int]]
+    potion_name: Optional[str]
+    num_red_ml: int
+    num_green_ml: int
+    num_blue_ml: int
+    num_dark_ml: int
+    inventory: Optional[int]
+
+    @validator("price", "num_red_ml", "num_green_ml", "num_blue_ml", "num_dark_ml", pre=True)
+    def null_as_zero(cls, value):
+        return 0 if value is None else value
+
+
+class ShopState(BaseModel):
+    gold: int
+    red_ml: int
+    green_ml: int
+    blue_ml: int
+    dark_ml: int
+    potion_c: Optional[int]
+    ml_c: Optional[int]
+    buy_potion_c: Optional[bool]
+    buy_ml_c: Optional[bool]
+    potions: list[PotionState]
+    # sku -> potions sold in the current game weekday and hour
+    demand: dict[str, int]
+
+    @property
+    def total_ml(self):
+        return self.red_ml + self.green_ml + self.blue_ml + self.dark_ml
+
+    @property
+    def total_potions(self):
+        return sum(potion.inventory or 0 for potion in self.potions)
+
+
+async def load():
+    """ Read the balances, capacities, every potion with its inventory and the current demand. """
+    result = await db.execute(sqlalchemy.text(
+        f"""
+        SELECT shop_balances.gold, shop_balances.red_ml, shop_balances.green_ml,
+            shop_balances.blue_ml, shop_balances.dark_ml,
+            capacities.potion_c, capacities.ml_c,
+            capacities.buy_potion_c, capacities.buy_ml_c,
+            (
+                SELECT COALESCE(json_agg(json_build_object(
+                    'id', potions_inventory.potion_id,
+                    'sku', potions_inventory.sku,
+                    'price', potions_inventory.price,
+                    'potion_type', potions_inventory.potion_type,
+                    'potion_name', potions_inventory.potion_name,
+                    'num_red_ml', potions_inventory.num_red_ml,
+                    'num_green_ml', potions_inventory.num_green_ml,
+                    'num_blue_ml', potions_inventory.num_blue_ml,
+                    'num_dark_ml', potions_inventory.num_dark_ml,
+                    'inventory', potion_balances.quantity
+                ) ORDER BY potions_inventory.potion_id), '[]')
+                FROM potions_inventory
+                LEFT JOIN potion_balances ON potion_balances.potion_id = potions_inventory.potion_id
+            ) AS potions,
+            (
+                SELECT COALESCE(json_object_agg(potions_inventory.sku, demand.quantity), '{{}}')
+                FROM ({sales.CURRENT_DEMAND}) AS demand
+                JOIN potions_inventory ON potions_inventory.potion_id = demand.potion_id
+            ) AS demand
+        FROM shop_balances
+        LEFT JOIN (SELECT * FROM capacities LIMIT 1) AS capacities ON TRUE
+        WHERE shop_balances.id = 1
+        """
+    ).columns(potions=sqlalchemy.JSON, demand=sqlalchemy.JSON))
+    return ShopState(**result.one()._mapping)
@@ -0,0 +1,194 @@
+import asyncio
+import contextvars
+import os
+import re
+
+from sqlalchemy import event
+from sqlalchemy.util.concurrency import await_only
+
+from src import metrics
+
+# Multi-tenant mode: several shops served by one process from one database,
+# each in its own schema, sharing the async engine's connection pool.
+#
+# Enabled by TENANTS, a list of api_key=schema pairs:
+#
+#   TENANTS="key-for-shop-a=shop_a,key-for-shop-b=shop_b"
+#
+# Every request is mapped to its tenant by its access_token header
+# (TenantMiddleware), and every transaction it opens starts with
+# SET LOCAL search_path to the tenant's schema, so the SQL stays unqualified
+# and a pooled connection carries nothing over to the next tenant. public
+# stays on the path for the pg_trgm operators and create_ledger_partitions.
+#
+# Each tenant may hold at most TENANT_MAX_CONNECTIONS pooled connections at
+# once (default 5), so one busy shop can't take the whole pool (DB_POOL_SIZE
+# plus DB_MAX_OVERFLOW) from the others.
+#
+# A tenant's schema is created from schema.sql with the public. prefixes
+# dropped: python -m src.tenants <schema>. Without TENANTS the shop runs as
+# before, with API_KEY and the default search_path.
+
+SCHEMA_PATTERN = re.compile(r"^[a-z_][a-z0-9_]{0,62}$")
+
+PUBLIC_PATHS = ("/", "/docs", "/redoc", "/openapi.json")
+
+MAX_CONNECTIONS = int(os.environ.get("TENANT_MAX_CONNECTIONS", "5"))
+
+# Schema of the tenant the current request (or task started by it) belongs to
+current = contextvars.ContextVar("tenant", default=None)
+
+
+def parse_tenants(spec):
+    """ "key_a=shop_a,key_b=shop_b" -> {"key_a": "shop_a", "key_b": "shop_b"} """
+    tenants = {}
+    for part in spec.split(","):
+        if "=" not in part:
+            continue
+        api_key, schema = part.rsplit("=", 1)
+        schema = schema.strip()
+        if not SCHEMA_PATTERN.match(schema):
+            raise ValueError(f"TENANTS: {schema!r} is not a valid schema name")
+        tenants[api_key.strip()] = schema
+    return tenants
+
+
+by_api_key = parse_tenants(os.environ.get("TENANTS", ""))
+
+
+def enabled():
+    return bool(by_api_key)
+
+
+def schema_for(api_key):
+    return by_api_key.get(api_key)
+
+
+class TenantMiddleware:
+    """
+    Pure ASGI middleware that looks up the tenant of every request from its
+    access_token header. Requests with an unknown key are turned away here,
+    before they can reach the database.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in PUBLIC_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        api_key = next((value.decode("latin-1") for name, value in scope["headers"] if name == b"access_token"), None)
+        schema = schema_for(api_key)
+        if schema is None:
+            await send({"type": "http.response.start", "status": 401,
+                        "headers": [(b"content-type", b"application/json")]})
+            await send({"type": "http.response.body", "body": b'{"detail":"Forbidden"}'})
+            return
+
+        token = current.set(schema)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current.reset(token)
+
+
+def _on_begin(connection):
+    schema = current.get()
+    if schema is None:
+        raise RuntimeError("No tenant for this transaction; was it opened outside a request?")
+    connection.exec_driver_sql(f'SET LOCAL search_path TO "{schema}", public')
+
+
+# schema -> semaphore limiting the pooled connections the tenant holds
+_limits = {}
+
+
+def _limit():
+    schema = current.get()
+    if schema is None:
+        return None
+    limit = _limits.get(schema)
+    if limit is None:
+        limit = _limits[schema] = asyncio.Semaphore(MAX_CONNECTIONS)
+    return limit
+
+
+class TenantLimitedPool(metrics.TimedAsyncAdaptedQueuePool):
+    """
+    The async engine's pool, shared by every tenant but giving each at most
+    MAX_CONNECTIONS connections at a time. A tenant over its limit waits
+    for one of its own connections to come back.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # connection record -> the semaphore its checkout took a permit from.
+        # Not kept in record.info, which SQLAlchemy clears when it reconnects
+        # an invalidated or recycled record after _do_get has returned.
+        self._permits = {}
+
+    def _do_get(self):
+        limit = _limit()
+        if limit is not None:
+            # Checkouts run in SQLAlchemy's greenlet, which can wait on the event loop
+            await_only(limit.acquire())
+        try:
+            record = super()._do_get()
+        except BaseException:
+            if limit is not None:
+                limit.release()
+            raise
+        if limit is not None:
+            self._permits[record] = limit
+        return record
+
+    def _do_return_conn(self, record):
+        # Every checkin comes through here, including invalidated connections
+        # and checkouts whose connect or pre-ping failed
+        limit = self._permits.pop(record, None)
+        try:
+            super()._do_return_conn(record)
+        finally:
+            if limit is not None:
+                limit.release()
+
+
+def instrument(engine):
+    """ Scope every transaction on engine (a sync Engine) to the current tenant's schema. """
+    event.listen(engine, "begin", _on_begin)
+
+
+def provision_statements(schema, schema_sql):
+    """ The statements that create a tenant's schema: schema.sql moved out of public. """
+    if not SCHEMA_PATTERN.match(schema):
+        raise ValueError(f"{schema!r} is not a valid schema name")
+    return [
+        f'CREATE SCHEMA IF NOT EXISTS "{schema}"',
+        f'SET LOCAL search_path TO "{schema}", public',
+        schema_sql.replace("public.", ""),
+    ]
+
+
+def provision(connection, schema, schema_sql):
+    """ Create a tenant's schema on connection (a sync Connection inside a transaction). """
+    # schema.sql has literal % signs (format() in plpgsql), which the driver
+    # would take for parameter markers
+    connection = connection.execution_options(no_parameters=True)
+    for statement in provision_statements(schema, schema_sql):
+        connection.exec_driver_sql(statement)
+
+
+if __name__ == "__main__":
+    # python -m src.tenants shop_a  -- create a tenant schema in POSTGRES_URI
+    import sys
+
+    from src import database as db
+
+    schema_path = os.path.join(os.path.dirname(__file__), "..", "schema.sql")
+    with open(schema_path) as schema_file:
+        schema_sql = schema_file.read()
+    with db.engine.begin() as connection:
+        provision(connection, sys.argv[1], schema_sql)
+    print(f"created schema {sys.argv[1]}")
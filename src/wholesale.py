@@ -0,0 +1,294 @@
+import os
+from functools import reduce
+from math import gcd
+
+from src import log
+
+# Wholesale barrel planning, kept apart from the barrels router so the
+# planners are plain functions of the catalog offered, the shop balance (a
+# row with gold and *_ml) and the ml capacity.
+#
+# BARRELS_PLANNER picks the planner used by /barrels/plan:
+#   heuristic  split the gold into per size budgets and buy one barrel size
+#              per color, neediest color first (default)
+#   knapsack   choose the barrels as a bounded knapsack over the gold and
+#              the ml room, filling each color up to its target
+
+logger = log.get_logger(__name__)
+
+COLORS = ["red", "green", "blue", "dark"]
+SIZES = ["LARGE", "MEDIUM", "SMALL", "MINI"]
+
+# Stop buying a color once it holds this much ml
+ML_LIMITS = {"red": 13000, "green": 13000, "blue": 13000, "dark": 10000}
+
+
+def barrel_color(barrel):
+    """ The color of a single color barrel, None for mixed ones. """
+    if sorted(barrel.potion_type) != [0, 0, 0, 1]:
+        return None
+    return COLORS[barrel.potion_type.index(1)]
+
+
+def barrel_size(barrel):
+    return next((size for size in SIZES if size in barrel.sku), None)
+
+
+def index_catalog(wholesale_catalog):
+    """
+    Group the catalog by (color, size), in catalog order within a group.
+    Mixed barrels and barrels that are sold out or free are left out.
+    """
+    index = {}
+    for barrel in wholesale_catalog:
+        color = barrel_color(barrel)
+        if color is None or barrel.quantity <= 0 or barrel.price <= 0 or barrel.ml_per_barrel <= 0:
+            continue
+        index.setdefault((color, barrel_size(barrel)), []).append(barrel)
+    return index
+
+
+def purchase_budget(cur_gold):
+    """ Returns (available_gold, budget per size, sizes in the order to buy them). """
+    if cur_gold < 1000:
+        min_gold_reserve = 0
+        gold_spent_threshold = 1
+        available_gold = (cur_gold - min_gold_reserve) * gold_spent_threshold
+        budgets = {
+            "LARGE": int(available_gold * 1), #to change back to 0.4
+            "MEDIUM": int(available_gold * 0), #to change back to 0.3
+            "SMALL": int(available_gold * 0), #to change back to 0.3
+        }
+        tiered_priority = ["MEDIUM", "SMALL", "LARGE"]
+    elif cur_gold < 2000:
+        min_gold_reserve = 0 # to change back to 600
+        gold_spent_threshold = 0.98 #to change back to 0.7
+        available_gold = (cur_gold - min_gold_reserve) * gold_spent_threshold
+        budgets = {
+            "LARGE": int(available_gold * 0.3), #to change back to 0.4
+            "MEDIUM": int(available_gold * 0.7), #to change back to 0.3
+            "SMALL": int(available_gold * 0.0), #to change back to 0.3
+        }
+        tiered_priority = ["MEDIUM", "LARGE", "SMALL"]
+    else:
+        min_gold_reserve = 0 # to change back to 600
+        gold_spent_threshold = 0.9 #to change back to 0.7
+        available_gold = (cur_gold - min_gold_reserve) * gold_spent_threshold
+        budgets = {
+            "LARGE": int(available_gold * 0.7), #to change back to 0.6
+            "MEDIUM": int(available_gold * 0.2), #to change back to 0.3
+            "SMALL": int(available_gold * 0.1), #to change back to 0.1
+        }
+        tiered_priority = ["LARGE", "MEDIUM","SMALL"]
+
+    logger.debug("cur_gold: %s available_gold: %s budgets: %s", cur_gold, available_gold, budgets)
+    return available_gold, budgets, tiered_priority
+
+
+def color_priority(balance):
+    """ Dark first, then the other colors with the least ml first. """
+    other_colors = [
+        ("red", balance.red_ml),
+        ("green", balance.green_ml),
+        ("blue", balance.blue_ml)
+    ]
+    # random.shuffle(other_colors)
+    other_colors.sort(key=lambda x: x[1])
+    return [("dark", balance.dark_ml)] + other_colors
+
+
+def ml_room(balance, ml_capacity):
+    total_ml = balance.red_ml + balance.green_ml + balance.blue_ml + balance.dark_ml
+    logger.debug("ml capacity: %s total ml: %s", ml_capacity, total_ml)
+    return ml_capacity - total_ml
+
+
+def heuristic_plan(wholesale_catalog, balance, ml_capacity):
+    available_gold, budgets, tiered_priority = purchase_budget(balance.gold)
+    room = ml_room(balance, ml_capacity)
+
+    if room <= 0 or available_gold <= 0:
+        return []
+
+    index = index_catalog(wholesale_catalog)
+    priority = color_priority(balance)
+    logger.debug("color priority sorted: %s", priority)
+
+    purchase_plan = []
+    colors_purchased = set()
+
+    for tier in tiered_priority:
+        for color, current_ml in priority:
+            # Skip buying for this color once it holds enough ml
+            if current_ml >= ML_LIMITS[color]:
+                continue
+            if color in colors_purchased:
+                continue # Skip if color has already been purchased
+
+            for barrel in index.get((color, tier), []):
+                if room <= 0:
+                    break
+
+                # Calculate max quantity that can be purchased
+                max_quantity = min(
+                    barrel.quantity, # Available stock in catalog
+                    budgets[tier] // barrel.price, # to check how many barrel I can buy with the budget
+                    room // barrel.ml_per_barrel # to check how many ml I can fit in the ml room
+                )
+
+                if max_quantity > 0:
+                    purchase_plan.append(
+                        {
+                            "sku": barrel.sku,
+                            "quantity": max_quantity
+                        }
+                    )
+                    budgets[tier] -= int(max_quantity * barrel.price)
+                    room -= max_quantity * barrel.ml_per_barrel
+                    logger.debug("bought %s %s, budget left %s, ml_room left %s", max_quantity, barrel.sku, budgets[tier], room)
+
+                    # Mark color as purchased
+                    colors_purchased.add(color)
+
+                    # Stop searching for this color in smaller tiers
+                    break
+
+        # Rollover unused budget to the next tier
+        if tier == "LARGE" and budgets["LARGE"] > 0:
+            budgets["MEDIUM"] += budgets["LARGE"]
+            budgets["LARGE"] = 0
+        elif tier == "MEDIUM" and budgets["MEDIUM"] > 0:
+            budgets["SMALL"] += budgets["MEDIUM"]
+            budgets["MEDIUM"] = 0
+
+    return purchase_plan
+
+
+def knapsack_plan(wholesale_catalog, balance, ml_capacity):
+    """
+    Each color gets a target, the ml that would bring it up to its limit,
+    handed out in color priority order until the ml room runs out. The plan
+    is then the set of barrels that gets the most ml towards those targets
+    within the gold budget, with ml counted higher for colors earlier in
+    the priority order and no color bought past its target.
+
+    Solved in two steps: per color, the cheapest way to buy exactly m ml
+    (a bounded knapsack over that color's barrels), then the split of the
+    gold between the colors over those per color costs.
+    """
+    # Imported here so the default planner doesn't pay for numpy on cold start
+    import numpy as np
+
+    available_gold, _, _ = purchase_budget(balance.gold)
+    budget = int(available_gold)
+    room = ml_room(balance, ml_capacity)
+
+    if room <= 0 or budget <= 0:
+        return []
+
+    index = index_catalog(wholesale_catalog)
+    priority = color_priority(balance)
+
+    targets = {}
+    for color, current_ml in priority:
+        targets[color] = max(0, min(ML_LIMITS[color] - current_ml, room))
+        room -= targets[color]
+    logger.debug("ml targets: %s", targets)
+
+    # Within a (color, size) group the cheapest barrels are always bought
+    # first, so only as many as could fit in the target are worth solving for
+    candidates = {color: [] for color in targets}
+    for (color, _), barrels in index.items():
+        stock = 0
+        for barrel in sorted(barrels, key=lambda barrel: barrel.price / barrel.ml_per_barrel):
+            fits = targets[color] // barrel.ml_per_barrel
+            if stock >= fits:
+                break
+            if barrel.price <= budget:
+                candidates[color].append(barrel)
+                stock += barrel.quantity
+    sizes = [barrel.ml_per_barrel for barrels in candidates.values() for barrel in barrels]
+    if not sizes:
+        return []
+    # Work in units of the largest ml amount every barrel is a multiple of
+    unit = reduce(gcd, sizes)
+
+    # cost[m] is the least gold that buys exactly m units of the color.
+    # Barrel quantities are split into 1, 2, 4, ... lots so each lot is a 0/1 item.
+    fills = {}
+    for color, barrels in candidates.items():
+        units = targets[color] // unit
+        cost = np.full(units + 1, np.inf)
+        cost[0] = 0
+        lots = []
+        for barrel in barrels:
+            size = barrel.ml_per_barrel // unit
+            left = min(barrel.quantity, units // size)
+            lot = 1
+            while left > 0:
+                quantity = min(lot, left)
+                weight = quantity * size
+                candidate = np.full(units + 1, np.inf)
+                candidate[weight:] = cost[:units + 1 - weight] + quantity * barrel.price
+                taken = candidate < cost
+                cost = np.where(taken, candidate, cost)
+                lots.append((barrel, quantity, weight, taken))
+                left -= quantity
+                lot *= 2
+        fills[color] = (cost, lots)
+
+    # Split the gold between the colors. value is weighted units, spent[v]
+    # the least gold reaching exactly value v. Only fills that are cheaper
+    # than every larger fill of the same color are worth considering.
+    weights = {color: len(priority) - rank for rank, (color, _) in enumerate(priority)}
+    spent = np.zeros(1)
+    choices = []
+    for color, _ in priority:
+        cost, _ = fills[color]
+        cheaper_above = np.append(np.minimum.accumulate(cost[::-1])[::-1][1:], np.inf)
+        worth = np.flatnonzero(np.isfinite(cost) & (cost < cheaper_above))
+
+        width = len(spent) + weights[color] * (len(cost) - 1)
+        best = np.full(width, np.inf)
+        choice = np.zeros(width, dtype=np.int64)
+        for units in worth:
+            shift = weights[color] * units
+            candidate = np.full(width, np.inf)
+            candidate[shift:shift + len(spent)] = spent + cost[units]
+            better = candidate < best
+            best = np.where(better, candidate, best)
+            choice[better] = units
+        spent = best
+        choices.append((color, choice))
+
+    value = int(np.flatnonzero(spent <= budget).max())
+
+    purchase = {}
+    for color, choice in reversed(choices):
+        units = int(choice[value])
+        value -= weights[color] * units
+        _, lots = fills[color]
+        for barrel, quantity, weight, taken in reversed(lots):
+            if units > 0 and taken[units]:
+                purchase[barrel.sku] = purchase.get(barrel.sku, 0) + quantity
+                units -= weight
+
+    return [
+        {"sku": barrel.sku, "quantity": purchase[barrel.sku]}
+        for barrel in wholesale_catalog if barrel.sku in purchase
+    ]
+
+
+planners = {
+    "heuristic": heuristic_plan,
+    "knapsack": knapsack_plan,
+}
+
+PLANNER = os.environ.get("BARRELS_PLANNER", "heuristic")
+if PLANNER not in planners:
+    raise ValueError(f"BARRELS_PLANNER must be one of {', '.join(planners)}, not {PLANNER!r}")
+
+
+def plan(wholesale_catalog, balance, ml_capacity):
+    """ Purchase plan from the configured planner. """
+    return planners[PLANNER](wholesale_catalog, balance, ml_capacity)
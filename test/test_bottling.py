@@ -0,0 +1,89 @@
+from collections import namedtuple
+
+import pytest
+
+from src import bottling
+
+Potion = namedtuple("Potion", "sku inventory price num_red_ml num_green_ml num_blue_ml num_dark_ml")
+
+# Distinct prices, so the ranking never falls through to its random tie-breaker
+POTIONS = [
+    Potion("YELLOW", 0, 45, 50, 50, 0, 0),
+    Potion("MUD", 0, 30, 25, 25, 25, 25),
+    Potion("RED", 0, 50, 100, 0, 0, 0),
+    Potion("GREEN", 0, 51, 0, 100, 0, 0),
+    Potion("PURPLE", 0, 55, 50, 0, 50, 0),
+    Potion("BLUE", 0, 60, 0, 0, 100, 0),
+    Potion("MOSTLY_DARK", 0, 70, 10, 10, 10, 70),
+]
+
+PLANNERS = [bottling.greedy_plan, bottling.vectorized_plan]
+
+
+def stocked(inventory):
+    return [potion._replace(inventory=inventory) for potion in POTIONS]
+
+
+def ml_used(plan):
+    return [sum(entry["potion_type"][color] * entry["quantity"] for entry in plan) for color in range(4)]
+
+
+@pytest.mark.parametrize("potion_capacity", [50, 100, 500, 5000])
+@pytest.mark.parametrize("ml", [(1000, 1000, 1000, 1000), (10000, 10000, 10000, 10000), (300, 5000, 200, 0)])
+@pytest.mark.parametrize("inventory", [0, 20])
+def test_planners_agree_when_capacity_is_not_filled(potion_capacity, ml, inventory):
+    potions = stocked(inventory)
+    assert bottling.vectorized_plan(potions, ml, potion_capacity) == bottling.greedy_plan(potions, ml, potion_capacity)
+
+
+@pytest.mark.parametrize("potion_capacity", [95, 100, 120])
+def test_vectorized_keeps_the_potion_that_fills_capacity(potion_capacity):
+    potions = stocked(10)
+    ml = (10000, 10000, 10000, 10000)
+    greedy = bottling.greedy_plan(potions, ml, potion_capacity)
+    vectorized = bottling.vectorized_plan(potions, ml, potion_capacity)
+
+    # The greedy loop drops the potion that fills the capacity; the
+    # vectorized planner keeps it, cut down to the room that was left
+    assert vectorized[:-1] == greedy
+    assert sum(entry["quantity"] for entry in vectorized) + 10 * len(potions) == potion_capacity
+
+
+@pytest.mark.parametrize("planner", PLANNERS)
+@pytest.mark.parametrize("ml", [(300, 5000, 200, 0), (1000, 0, 0, 50), (0, 0, 0, 0)])
+def test_plans_stay_within_the_ml(planner, ml):
+    plan = planner(stocked(0), ml, 5000)
+    assert all(used <= available for used, available in zip(ml_used(plan), ml))
+
+
+@pytest.mark.parametrize("planner", PLANNERS)
+@pytest.mark.parametrize("potion_capacity", [10, 50, 95, 100, 500])
+def test_plans_stay_within_the_capacity_and_tier_cap(planner, potion_capacity):
+    potions = stocked(5)
+    total_inventory = 5 * len(potions)
+    production_limit, tier_cap = bottling.bottle_limits(potion_capacity, total_inventory)
+    plan = planner(potions, (10000, 10000, 10000, 10000), potion_capacity)
+
+    assert sum(entry["quantity"] for entry in plan) <= max(0, production_limit - total_inventory)
+    assert all(0 < entry["quantity"] <= tier_cap for entry in plan)
+
+
+@pytest.mark.parametrize("planner", PLANNERS)
+def test_potions_at_the_inventory_cap_are_not_bottled(planner):
+    potions = stocked(0)
+    potions[0] = potions[0]._replace(inventory=bottling.MAX_INVENTORY_PER_POTION)
+    plan = planner(potions, (10000, 10000, 10000, 10000), 5000)
+    assert [50, 50, 0, 0] not in [entry["potion_type"] for entry in plan]
+
+
+@pytest.mark.parametrize("planner", PLANNERS)
+def test_best_sellers_are_bottled_first(planner):
+    plan = planner(stocked(0), (10000, 10000, 10000, 10000), 500, {"BLUE": 3, "RED": 1})
+    assert [entry["potion_type"] for entry in plan][:3] == [[0, 0, 100, 0], [100, 0, 0, 0], [50, 50, 0, 0]]
+
+
+@pytest.mark.parametrize("planner", PLANNERS)
+def test_recipes_without_ml_are_not_bottled(planner):
+    potions = stocked(0) + [Potion("NO_RECIPE", 0, 0, 0, 0, 0, 0)]
+    plan = planner(potions, (10000, 10000, 10000, 10000), 500)
+    assert [0, 0, 0, 0] not in [entry["potion_type"] for entry in plan]
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from src import cache
+
+
+def run(main):
+    return asyncio.run(main())
+
+
+def test_concurrent_misses_load_once():
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "catalog"
+
+    async def main():
+        versioned = cache.VersionedCache(ttl=60)
+        results = await asyncio.gather(*(versioned.get(1, loader) for _ in range(10)))
+        # Loaded, so a later get for the same version doesn't call it again
+        results.append(await versioned.get(1, loader))
+        return results
+
+    assert run(main) == ["catalog"] * 11
+    assert len(calls) == 1
+
+
+def test_a_new_version_loads_again():
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        return len(calls)
+
+    async def main():
+        versioned = cache.VersionedCache(ttl=60)
+        return [await versioned.get(1, loader), await versioned.get(1, loader), await versioned.get(2, loader)]
+
+    assert run(main) == [1, 1, 2]
+
+
+def test_loader_errors_reach_every_waiter():
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ConnectionError("database is down")
+
+    async def main():
+        versioned = cache.VersionedCache(ttl=60)
+        results = await asyncio.gather(*(versioned.get(1, loader) for _ in range(5)), return_exceptions=True)
+        # Errors aren't cached
+        with pytest.raises(ConnectionError):
+            await versioned.get(1, loader)
+        return results
+
+    results = run(main)
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert len(calls) == 2
+
+
+def test_cancelling_the_loading_caller_leaves_the_others_waiting():
+    async def loader():
+        await asyncio.sleep(0.05)
+        return "catalog"
+
+    async def main():
+        versioned = cache.VersionedCache(ttl=60)
+        loading = asyncio.ensure_future(versioned.get(1, loader))
+        await asyncio.sleep(0)
+        waiting = [asyncio.ensure_future(versioned.get(1, loader)) for _ in range(3)]
+        await asyncio.sleep(0)
+        loading.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await loading
+        return await asyncio.gather(*waiting)
+
+    assert run(main) == ["catalog"] * 3
@@ -0,0 +1,173 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+
+from src import cart_store
+
+CREATED_AT = datetime(2024, 11, 3, 12, 30, tzinfo=timezone.utc)
+
+
+def journal_lines(path):
+    with open(path) as journal:
+        return [json.loads(line) for line in journal]
+
+
+def write_journal(path, entries, tail=""):
+    with open(path, "w") as journal:
+        for entry in entries:
+            journal.write(json.dumps(entry) + "\n")
+        journal.write(tail)
+
+
+def create(cart_id, customer_id=7):
+    return {"op": "create", "cart_id": cart_id, "customer_id": customer_id, "created_at": CREATED_AT.isoformat()}
+
+
+def set_item(cart_id, potion_id, qty):
+    return {"op": "set_item", "cart_id": cart_id, "potion_id": potion_id,
+            "qty": qty, "gold_paid": qty * 50, "added_at": CREATED_AT.isoformat()}
+
+
+class Result:
+    def __init__(self, values):
+        self.values = values
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self.values
+
+
+class SequenceConnection:
+    """ Hands out ids from the carts sequence a block at a time. """
+
+    def __init__(self):
+        self.next_id = 1
+        self.blocks = 0
+
+    async def execute(self, statement, parameters):
+        block_size = parameters["block_size"]
+        self.blocks += 1
+        self.next_id += block_size
+        return Result(list(range(self.next_id - block_size, self.next_id)))
+
+
+def open_carts(store, count, connection=None):
+    connection = connection or SequenceConnection()
+
+    async def main():
+        return [await store.create(connection, customer_id) for customer_id in range(count)]
+
+    return asyncio.run(main())
+
+
+def test_take_hides_the_cart_until_put_back():
+    store = cart_store.CartStore(max_carts=10, ttl=60)
+    cart_id, = open_carts(store, 1)
+    cart = store.take(cart_id)
+    assert cart.cart_id == cart_id
+    # A concurrent checkout doesn't find it
+    assert store.take(cart_id) is None
+    store.put_back(cart)
+    assert store.get(cart_id) is cart
+
+
+def test_checked_out_carts_are_not_recovered(tmp_path):
+    path = str(tmp_path / "carts.journal")
+    store = cart_store.CartStore(max_carts=10, ttl=60, journal_path=path)
+    first, second = open_carts(store, 2)
+    store.take(first)
+    # Still journaled until the checkout commits
+    assert [entry["op"] for entry in journal_lines(path)] == ["create", "create"]
+    store.checked_out(first)
+    assert list(cart_store.CartStore(10, 60, path)._carts) == [second]
+
+
+def test_recover_replays_creates_items_and_removes(tmp_path):
+    path = str(tmp_path / "carts.journal")
+    write_journal(path, [
+        create(1), create(2, customer_id=8), create(3),
+        set_item(1, 10, 2), set_item(2, 11, 1), set_item(1, 10, 3), set_item(1, 12, 1),
+        {"op": "remove", "cart_id": 3},
+        # Items of a cart that was never created (evicted and compacted away) are dropped
+        set_item(4, 10, 1),
+    ])
+    store = cart_store.CartStore(max_carts=10, ttl=60, journal_path=path)
+
+    assert list(store._carts) == [1, 2]
+    assert store.get(2).customer_id == 8
+    assert store.get(1).created_at == CREATED_AT
+    assert {potion_id: item["qty"] for potion_id, item in store.get(1).items.items()} == {10: 3, 12: 1}
+    assert store.get(1).items[10]["gold_paid"] == 150
+
+
+def test_recover_skips_a_truncated_last_line(tmp_path):
+    path = str(tmp_path / "carts.journal")
+    write_journal(path, [create(1), set_item(1, 10, 2)], tail=json.dumps(set_item(1, 11, 5))[:30])
+    store = cart_store.CartStore(max_carts=10, ttl=60, journal_path=path)
+    assert list(store.get(1).items) == [10]
+
+
+def test_recover_compacts_the_journal(tmp_path):
+    path = str(tmp_path / "carts.journal")
+    write_journal(path, [create(1), create(2), set_item(1, 10, 2), set_item(1, 10, 4), {"op": "remove", "cart_id": 2}])
+    store = cart_store.CartStore(max_carts=10, ttl=60, journal_path=path)
+    assert journal_lines(path) == [create(1), set_item(1, 10, 4)]
+
+    # New changes are appended to the compacted journal
+    store.set_item(store.get(1), 11, 1, 50)
+    assert [(entry["op"], entry.get("potion_id")) for entry in journal_lines(path)] == \
+        [("create", None), ("set_item", 10), ("set_item", 11)]
+
+
+def test_least_recently_used_carts_are_evicted_over_max_carts(tmp_path):
+    path = str(tmp_path / "carts.journal")
+    store = cart_store.CartStore(max_carts=3, ttl=60, journal_path=path)
+    first, second, third = open_carts(store, 3)
+    store.get(first)
+    connection = SequenceConnection()
+    connection.next_id = 100
+    fourth, = open_carts(store, 1, connection)
+
+    assert list(store._carts) == [third, first, fourth]
+    assert store.get(second) is None
+    assert {"op": "remove", "cart_id": second} in journal_lines(path)
+
+
+def test_carts_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cart_store.time, "monotonic", lambda: now[0])
+    store = cart_store.CartStore(max_carts=10, ttl=60)
+    first, second = open_carts(store, 2)
+    now[0] += 30
+    store.get(second)
+    now[0] += 30
+
+    assert store.get(first) is None
+    assert store.get(second) is not None
+    now[0] += 60
+    assert store.get(second) is None
+
+
+def test_ids_are_reserved_a_block_at_a_time(monkeypatch):
+    monkeypatch.setattr(cart_store, "ID_BLOCK_SIZE", 4)
+    connection = SequenceConnection()
+    store = cart_store.CartStore(max_carts=10, ttl=60)
+    assert open_carts(store, 6, connection) == [1, 2, 3, 4, 5, 6]
+    assert connection.blocks == 2
+
+
+def test_clear_drops_open_carts_and_reserved_ids(monkeypatch, tmp_path):
+    monkeypatch.setattr(cart_store, "ID_BLOCK_SIZE", 4)
+    path = str(tmp_path / "carts.journal")
+    connection = SequenceConnection()
+    store = cart_store.CartStore(max_carts=10, ttl=60, journal_path=path)
+    open_carts(store, 2, connection)
+    store.clear()
+
+    assert not store._carts
+    assert cart_store.CartStore(10, 60, path)._carts == {}
+    # The next cart takes a fresh block instead of ids 3 and 4
+    assert open_carts(store, 1, connection) == [5]
+    assert connection.blocks == 2
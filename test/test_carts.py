@@ -0,0 +1,113 @@
+import base64
+import json
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from src import database as db
+from src.api.carts import (
+    decode_search_cursor,
+    encode_search_cursor,
+    search_filters,
+    search_sort_options,
+    search_sort_order,
+)
+
+Row = namedtuple("Row", "sort_key line_item_id")
+
+SORT_KEYS = {
+    search_sort_options.customer_name: "Scaramouche",
+    search_sort_options.item_sku: "oblivion",
+    search_sort_options.line_item_total: 150,
+    search_sort_options.timestamp: datetime(2024, 11, 3, 12, 30, 5, 123456, tzinfo=timezone.utc),
+}
+
+
+def token(cursor):
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+
+@pytest.mark.parametrize("sort_col", list(search_sort_options))
+@pytest.mark.parametrize("sort_order", list(search_sort_order))
+@pytest.mark.parametrize("direction", ["prev", "next"])
+def test_cursor_round_trip(sort_col, sort_order, direction):
+    search_page = encode_search_cursor(sort_col, sort_order, direction, Row(SORT_KEYS[sort_col], 42))
+    cursor = decode_search_cursor(search_page, sort_col, sort_order)
+    assert cursor == {
+        "col": sort_col.value,
+        "order": sort_order.value,
+        "direction": direction,
+        "value": SORT_KEYS[sort_col],
+        "id": 42,
+    }
+
+
+def test_no_search_page_is_the_first_page():
+    assert decode_search_cursor("", search_sort_options.timestamp, search_sort_order.desc) is None
+
+
+@pytest.mark.parametrize("sort_col, sort_order", [
+    (search_sort_options.customer_name, search_sort_order.desc),
+    (search_sort_options.timestamp, search_sort_order.asc),
+])
+def test_cursor_for_another_sort_is_ignored(sort_col, sort_order):
+    search_page = encode_search_cursor(search_sort_options.timestamp, search_sort_order.desc, "next",
+                                       Row(SORT_KEYS[search_sort_options.timestamp], 1))
+    assert decode_search_cursor(search_page, sort_col, sort_order) is None
+
+
+@pytest.mark.parametrize("search_page", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+    token([1, 2, 3]),
+    token("a string"),
+    token({"col": "timestamp", "order": "desc"}),
+    token({"col": "timestamp", "order": "desc", "direction": "sideways",
+           "value": "2024-11-03T12:30:05+00:00", "id": 1}),
+])
+def test_malformed_cursor_is_ignored(search_page):
+    assert decode_search_cursor(search_page, search_sort_options.timestamp, search_sort_order.desc) is None
+
+
+@pytest.mark.parametrize("sort_col, value", [
+    (search_sort_options.timestamp, "yesterday"),
+    (search_sort_options.timestamp, 1730636405),
+    (search_sort_options.line_item_total, "150"),
+    (search_sort_options.line_item_total, 1.5),
+    (search_sort_options.line_item_total, True),
+    (search_sort_options.line_item_total, None),
+    (search_sort_options.customer_name, 5),
+    (search_sort_options.item_sku, ["oblivion"]),
+    (search_sort_options.item_sku, None),
+])
+def test_cursor_value_of_the_wrong_type_is_ignored(sort_col, value):
+    search_page = token({"col": sort_col.value, "order": "desc", "direction": "next", "value": value, "id": 1})
+    assert decode_search_cursor(search_page, sort_col, search_sort_order.desc) is None
+
+
+@pytest.mark.parametrize("line_item_id", ["1", 1.0, None])
+def test_cursor_id_must_be_an_int(line_item_id):
+    search_page = token({"col": "customer_name", "order": "desc", "direction": "next",
+                         "value": "Scaramouche", "id": line_item_id})
+    assert decode_search_cursor(search_page, search_sort_options.customer_name, search_sort_order.desc) is None
+
+
+def compiled(selectable):
+    return str(selectable.compile(dialect=postgresql.dialect()))
+
+
+def test_search_filters_without_filters_join_the_whole_tables():
+    customers, potions = search_filters("", "")
+    assert customers is db.customers
+    assert potions is db.potions_inventory
+
+
+def test_search_filters_narrow_customers_and_potions():
+    customers, potions = search_filters("scara", "obliv")
+    assert "customers.customer_name ILIKE" in compiled(customers.element)
+    assert "potions_inventory.potion_name ILIKE" in compiled(potions.element)
+    assert customers.element.compile().params == {"customer_name_1": "%scara%"}
+    assert potions.element.compile().params == {"potion_name_1": "%obliv%"}
@@ -0,0 +1,100 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from src import ledgers
+from src import tenants
+
+
+def utc(year, month, day=1):
+    return datetime(year, month, day, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("ledger, partition, months", [
+    ("gold_ledger", "gold_ledger_2024_11", (utc(2024, 11), utc(2024, 12))),
+    ("gold_ledger", "gold_ledger_2024_12", (utc(2024, 12), utc(2025, 1))),
+    ("ml_ledger", "ml_ledger_2024_02", (utc(2024, 2), utc(2024, 3))),
+    ("ml_c_ledger", "ml_c_ledger_2025_01", (utc(2025, 1), utc(2025, 2))),
+    ("potion_ledger", "potion_ledger_default", None),
+    ("potion_ledger", "potion_ledger_2024_13", None),
+])
+def test_partition_range(ledger, partition, months):
+    assert ledgers.partition_range(ledger, partition) == months
+
+
+class Result:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def one(self):
+        return self.rows[0]
+
+    def scalars(self):
+        return self
+
+    def all(self):
+        return self.rows
+
+
+class Row:
+    def __init__(self, rows, bytes):
+        self.rows = rows
+        self.bytes = bytes
+
+
+class CatalogConnection:
+    """ Answers the pg_inherits query with partitions, and every size query with 8 KB and no rows. """
+
+    def __init__(self, partitions):
+        self.partitions = partitions
+        self.statements = 0
+
+    async def execute(self, statement, parameters):
+        self.statements += 1
+        if "pg_inherits" in str(statement):
+            return Result(self.partitions)
+        return Result([Row(0, 8192)])
+
+
+def test_old_partitions_end_on_or_before_the_cutoff():
+    connection = CatalogConnection([
+        ("gold_ledger", "gold_ledger_2024_10"),
+        ("gold_ledger", "gold_ledger_2024_11"),
+        ("gold_ledger", "gold_ledger_2024_12"),
+        ("gold_ledger", "gold_ledger_default"),
+        ("ml_c_ledger", "ml_c_ledger_2024_10"),
+    ])
+    partitions = asyncio.run(ledgers.old_partitions(connection, utc(2024, 12, 1)))
+    assert partitions == [
+        ("gold_ledger", "gold_ledger_2024_10", 0, 8192),
+        ("gold_ledger", "gold_ledger_2024_11", 0, 8192),
+        ("ml_c_ledger", "ml_c_ledger_2024_10", 0, 8192),
+    ]
+
+
+def test_upcoming_partitions_are_made_once_a_day_per_tenant(monkeypatch):
+    today = [utc(2024, 11, 30).date()]
+    monkeypatch.setattr(ledgers, "_today", lambda: today[0])
+    monkeypatch.setattr(ledgers, "_partitions_ensured_on", {})
+    connection = CatalogConnection([])
+
+    def tick(tenant):
+        token = tenants.current.set(tenant)
+        try:
+            if ledgers.upcoming_partitions_due():
+                asyncio.run(ledgers.ensure_upcoming_partitions(connection))
+        finally:
+            tenants.current.reset(token)
+
+    tick(None)
+    tick(None)
+    assert connection.statements == 1
+    tick("shop_a")
+    assert connection.statements == 2
+    today[0] = utc(2024, 12, 1).date()
+    tick(None)
+    assert connection.statements == 3
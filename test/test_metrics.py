@@ -0,0 +1,129 @@
+import asyncio
+from collections import namedtuple
+
+import pytest
+from sqlalchemy import create_engine
+
+from src import metrics
+
+Route = namedtuple("Route", "path")
+
+
+class Cursor:
+    def __init__(self, rowcount):
+        self.description = [("id",)] if rowcount else None
+        self.rowcount = rowcount
+
+
+@pytest.fixture(autouse=True)
+def empty_metrics(monkeypatch):
+    for family in metrics.families:
+        monkeypatch.setattr(family, "values", {})
+    monkeypatch.setattr(metrics, "_pools", {})
+
+
+def handle(monkeypatch, method, route, status, query_rows, seconds):
+    """ Run one request through MetricsMiddleware, taking seconds and running a query per entry of query_rows. """
+    clock = iter([0.0, seconds])
+    monkeypatch.setattr(metrics.time, "perf_counter", lambda: next(clock))
+
+    async def app(scope, receive, send):
+        for rows in query_rows:
+            metrics._after_cursor_execute(None, Cursor(rows), "SELECT 1", {}, None, False)
+        scope["route"] = Route(route) if route else None
+        await send({"type": "http.response.start", "status": status})
+
+    async def send(message):
+        pass
+
+    asyncio.run(metrics.MetricsMiddleware(app)({"type": "http", "method": method}, None, send))
+
+
+def section(rendered, name):
+    """ The lines of the metric family name, HELP and TYPE included. """
+    lines = rendered.splitlines()
+    start = next(i for i, line in enumerate(lines) if line.startswith(f"# HELP {name} "))
+    end = next((i for i in range(start + 1, len(lines)) if lines[i].startswith("# HELP")), len(lines))
+    return lines[start:end]
+
+
+def test_render_counts_requests_by_route_and_status(monkeypatch):
+    handle(monkeypatch, "GET", "/catalog/", 200, [], 0.003)
+    handle(monkeypatch, "GET", "/catalog/", 200, [], 0.003)
+    handle(monkeypatch, "POST", "/carts/{cart_id}/checkout", 404, [], 0.003)
+    handle(monkeypatch, "GET", None, 404, [], 0.003)
+
+    assert section(metrics.render(), "shop_http_requests_total") == [
+        "# HELP shop_http_requests_total Requests handled, by route template and status code.",
+        "# TYPE shop_http_requests_total counter",
+        'shop_http_requests_total{method="GET",route="/catalog/",status="200"} 2',
+        'shop_http_requests_total{method="POST",route="/carts/{cart_id}/checkout",status="404"} 1',
+        'shop_http_requests_total{method="GET",route="unmatched",status="404"} 1',
+    ]
+
+
+def test_render_histogram_buckets_sum_and_count(monkeypatch):
+    handle(monkeypatch, "GET", "/catalog/", 200, [3, 0], 0.02)
+    handle(monkeypatch, "GET", "/catalog/", 200, [1], 0.5)
+    handle(monkeypatch, "GET", "/catalog/", 200, [], 60.0)
+
+    assert section(metrics.render(), "shop_http_request_duration_seconds") == [
+        "# HELP shop_http_request_duration_seconds Time to handle a request, by route template.",
+        "# TYPE shop_http_request_duration_seconds histogram",
+        'shop_http_request_duration_seconds_bucket{method="GET",route="/catalog/",le="0.005"} 0',
+        'shop_http_request_duration_seconds_bucket{method="GET",route="/catalog/",le="0.01"} 0',
+        'shop_http_request_duration_seconds_bucket{method="GET",route="/catalog/",le="0.025"} 1',
+        'shop_http_request_duration_seconds_bucket{method="GET",route="/catalog/",le="0.05"} 1',
+        'shop_http_request_duration_seconds_bucket{method="GET",route="/catalog/",le="0.1"} 1',
+        'shop_http_request_duration_seconds_bucket{method="GET",route="/catalog/",le="0.25"} 1',
+        'shop_http_request_duration_seconds_bucket{method="GET",route="/catalog/",le="0.5"} 2',
+        'shop_http_request_duration_seconds_bucket{method="GET",route="/catalog/",le="1.0"} 2',
+        'shop_http_request_duration_seconds_bucket{method="GET",route="/catalog/",le="2.5"} 2',
+        'shop_http_request_duration_seconds_bucket{method="GET",route="/catalog/",le="5.0"} 2',
+        'shop_http_request_duration_seconds_bucket{method="GET",route="/catalog/",le="10.0"} 2',
+        'shop_http_request_duration_seconds_bucket{method="GET",route="/catalog/",le="+Inf"} 3',
+        'shop_http_request_duration_seconds_sum{method="GET",route="/catalog/"} 60.52',
+        'shop_http_request_duration_seconds_count{method="GET",route="/catalog/"} 3',
+    ]
+
+    rendered = metrics.render()
+    queries = section(rendered, "shop_db_queries_per_request")
+    assert queries[2:6] == [
+        'shop_db_queries_per_request_bucket{route="/catalog/",le="0"} 1',
+        'shop_db_queries_per_request_bucket{route="/catalog/",le="1"} 2',
+        'shop_db_queries_per_request_bucket{route="/catalog/",le="2"} 3',
+        'shop_db_queries_per_request_bucket{route="/catalog/",le="3"} 3',
+    ]
+    assert queries[-3:] == [
+        'shop_db_queries_per_request_bucket{route="/catalog/",le="+Inf"} 3',
+        'shop_db_queries_per_request_sum{route="/catalog/"} 3.0',
+        'shop_db_queries_per_request_count{route="/catalog/"} 3',
+    ]
+    # Statements without a result set add no rows
+    assert section(rendered, "shop_db_rows_per_request")[-2:] == [
+        'shop_db_rows_per_request_sum{route="/catalog/"} 4.0',
+        'shop_db_rows_per_request_count{route="/catalog/"} 3',
+    ]
+
+
+def test_format_labels_escapes_values():
+    assert metrics.format_labels({}) == ""
+    assert metrics.format_labels({"route": 'a\\b"c\nd', "status": 200}) == '{route="a\\\\b\\"c\\nd",status="200"}'
+
+
+def test_render_reports_the_pools():
+    engine = create_engine("sqlite://", poolclass=metrics.TimedQueuePool, pool_size=3, max_overflow=2)
+    metrics.instrument(engine, "sync")
+    connection = engine.connect()
+    rendered = metrics.render()
+    connection.close()
+
+    assert rendered.endswith("\n")
+    assert section(rendered, "shop_db_pool_checked_out") == [
+        "# HELP shop_db_pool_checked_out Connections currently checked out.",
+        "# TYPE shop_db_pool_checked_out gauge",
+        'shop_db_pool_checked_out{engine="sync"} 1',
+    ]
+    assert section(rendered, "shop_db_pool_overflow")[-1] == 'shop_db_pool_overflow{engine="sync"} -2'
+    assert section(rendered, "shop_db_pool_checkout_wait_seconds")[-1] == \
+        'shop_db_pool_checkout_wait_seconds_count{engine="sync"} 1'
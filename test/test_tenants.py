@@ -0,0 +1,168 @@
+import asyncio
+
+import pytest
+from sqlalchemy.util import greenlet_spawn
+
+from src import tenants
+
+
+@pytest.fixture
+def shops(monkeypatch):
+    monkeypatch.setattr(tenants, "by_api_key", {"key-a": "shop_a", "key-b": "shop_b"})
+    monkeypatch.setattr(tenants, "MAX_CONNECTIONS", 2)
+    monkeypatch.setattr(tenants, "_limits", {})
+
+
+def request(path, access_token=None):
+    headers = [] if access_token is None else [(b"access_token", access_token.encode())]
+    return {"type": "http", "path": path, "headers": headers}
+
+
+def run_middleware(scope):
+    """ (messages sent, tenant the app saw or None if it wasn't called) """
+    seen = []
+    sent = []
+
+    async def app(scope, receive, send):
+        seen.append(tenants.current.get())
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(tenants.TenantMiddleware(app)(scope, None, send))
+    return sent, seen[0] if seen else None
+
+
+@pytest.mark.parametrize("access_token", [None, "", "key-c", "shop_a"])
+def test_middleware_turns_away_unknown_keys(shops, access_token):
+    sent, tenant = run_middleware(request("/catalog/", access_token))
+    assert sent[0]["status"] == 401
+    assert tenant is None
+
+
+def test_middleware_sets_the_tenant_of_the_request(shops):
+    _, tenant = run_middleware(request("/catalog/", "key-b"))
+    assert tenant == "shop_b"
+    assert tenants.current.get() is None
+
+
+def test_middleware_lets_public_paths_through(shops):
+    sent, _ = run_middleware(request("/docs"))
+    assert sent == []
+
+
+def test_parse_tenants():
+    assert tenants.parse_tenants(" key-a = shop_a,key=b=shop_b,, ") == {"key-a": "shop_a", "key=b": "shop_b"}
+    with pytest.raises(ValueError):
+        tenants.parse_tenants('key="shop_a"')
+
+
+@pytest.mark.parametrize("schema", ['shop"; drop schema public; --', "Shop_A", "1shop", "", "a" * 64])
+def test_provision_rejects_invalid_schema_names(schema):
+    with pytest.raises(ValueError):
+        tenants.provision_statements(schema, "")
+
+
+def test_provision_statements_quote_the_schema_and_drop_public():
+    schema_sql = "create table public.carts (id bigint);\nselect format('%I_%s', 'gold_ledger', 1);"
+    assert tenants.provision_statements("shop_a", schema_sql) == [
+        'CREATE SCHEMA IF NOT EXISTS "shop_a"',
+        'SET LOCAL search_path TO "shop_a", public',
+        "create table carts (id bigint);\nselect format('%I_%s', 'gold_ledger', 1);",
+    ]
+
+
+class RecordingConnection:
+    def __init__(self, options=None):
+        self.options = options or {}
+        self.statements = []
+
+    def execution_options(self, **options):
+        connection = RecordingConnection({**self.options, **options})
+        connection.statements = self.statements
+        return connection
+
+    def exec_driver_sql(self, statement):
+        self.statements.append((statement, self.options))
+
+
+def test_provision_runs_the_statements_without_parameters():
+    connection = RecordingConnection()
+    tenants.provision(connection, "shop_a", "select format('%s', 1);")
+    assert [statement for statement, _ in connection.statements] == \
+        tenants.provision_statements("shop_a", "select format('%s', 1);")
+    # With no_parameters the driver leaves the % signs alone
+    assert all(options == {"no_parameters": True} for _, options in connection.statements)
+
+
+def test_begin_sets_the_search_path_of_the_tenant():
+    connection = RecordingConnection()
+    token = tenants.current.set("shop_a")
+    try:
+        tenants._on_begin(connection)
+    finally:
+        tenants.current.reset(token)
+    assert connection.statements == [('SET LOCAL search_path TO "shop_a", public', {})]
+
+
+def test_begin_outside_a_request_fails():
+    with pytest.raises(RuntimeError):
+        tenants._on_begin(RecordingConnection())
+
+
+class FakeDBAPIConnection:
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def in_pool(tenant, work):
+    """ Run work(pool) as SQLAlchemy's async engine would, for tenant. """
+    pool = tenants.TenantLimitedPool(FakeDBAPIConnection, pool_size=2, max_overflow=0)
+
+    async def main():
+        tenants.current.set(tenant)
+        await greenlet_spawn(work, pool)
+
+    asyncio.run(main())
+
+
+def test_pool_limits_each_tenant(shops):
+    def work(pool):
+        first, second = pool.connect(), pool.connect()
+        assert tenants._limits["shop_a"]._value == 0
+        first.close()
+        second.close()
+
+    in_pool("shop_a", work)
+    assert tenants._limits["shop_a"]._value == tenants.MAX_CONNECTIONS
+
+
+def test_pool_releases_invalidated_connections(shops):
+    def work(pool):
+        for _ in range(3):
+            connection = pool.connect()
+            # Like a failed pre-ping: the record is reconnected on its next checkout
+            connection.invalidate()
+            connection.close()
+            pool.connect().close()
+            # Checked before the next checkout, which would wait forever on a leaked permit
+            assert tenants._limits["shop_a"]._value == tenants.MAX_CONNECTIONS
+
+    in_pool("shop_a", work)
+
+
+def test_pool_releases_failed_connects(shops):
+    def failing_connect():
+        raise ConnectionError("database is down")
+
+    def work(pool):
+        pool._creator = failing_connect
+        for _ in range(3):
+            with pytest.raises(ConnectionError):
+                pool.connect()
+
+    in_pool("shop_a", work)
+    assert tenants._limits["shop_a"]._value == tenants.MAX_CONNECTIONS
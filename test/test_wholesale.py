@@ -0,0 +1,130 @@
+import itertools
+from collections import namedtuple
+
+import pytest
+
+from src import wholesale
+
+Barrel = namedtuple("Barrel", "sku ml_per_barrel potion_type price quantity")
+Balance = namedtuple("Balance", "gold red_ml green_ml blue_ml dark_ml")
+
+COLOR_TYPES = {
+    "RED": [1, 0, 0, 0],
+    "GREEN": [0, 1, 0, 0],
+    "BLUE": [0, 0, 1, 0],
+    "DARK": [0, 0, 0, 1],
+}
+
+
+def barrel(size, color, ml_per_barrel, price, quantity=2, suffix=""):
+    return Barrel(f"{size}_{color}_BARREL{suffix}", ml_per_barrel, COLOR_TYPES[color], price, quantity)
+
+
+SMALL_CATALOGS = [
+    [
+        barrel("SMALL", "RED", 500, 100),
+        barrel("MEDIUM", "RED", 2500, 250),
+        barrel("SMALL", "GREEN", 500, 100),
+        barrel("SMALL", "DARK", 500, 120, quantity=1),
+    ],
+    [
+        barrel("MINI", "RED", 200, 60, quantity=3),
+        barrel("SMALL", "RED", 500, 100),
+        barrel("SMALL", "BLUE", 500, 120),
+        barrel("MEDIUM", "BLUE", 2500, 300, quantity=1),
+    ],
+    [
+        barrel("SMALL", "GREEN", 500, 100),
+        barrel("SMALL", "GREEN", 500, 90, suffix="_SALE"),
+        barrel("MEDIUM", "DARK", 2500, 400, quantity=1),
+        barrel("MINI", "BLUE", 200, 50, quantity=3),
+        # Mixed barrels are never bought
+        Barrel("LARGE_MIXED_BARREL", 1000, [0, 1, 1, 0], 10, 5),
+    ],
+]
+
+BALANCES = [
+    Balance(gold=100, red_ml=0, green_ml=0, blue_ml=0, dark_ml=0),
+    Balance(gold=450, red_ml=300, green_ml=0, blue_ml=1000, dark_ml=0),
+    Balance(gold=900, red_ml=0, green_ml=0, blue_ml=0, dark_ml=0),
+    Balance(gold=1500, red_ml=12800, green_ml=0, blue_ml=0, dark_ml=9900),
+]
+
+
+def totals(wholesale_catalog, plan):
+    """ (gold spent, ml bought per color) of a plan. """
+    by_sku = {barrel.sku: barrel for barrel in wholesale_catalog}
+    gold = 0
+    ml = dict.fromkeys(wholesale.COLORS, 0)
+    for entry in plan:
+        bought = by_sku[entry["sku"]]
+        assert 0 < entry["quantity"] <= bought.quantity
+        gold += bought.price * entry["quantity"]
+        ml[wholesale.barrel_color(bought)] += bought.ml_per_barrel * entry["quantity"]
+    return gold, ml
+
+
+def targets(balance, ml_capacity):
+    """ The ml each color may be bought up to, as knapsack_plan hands them out. """
+    room = wholesale.ml_room(balance, ml_capacity)
+    color_targets = {}
+    for color, current_ml in wholesale.color_priority(balance):
+        color_targets[color] = max(0, min(wholesale.ML_LIMITS[color] - current_ml, room))
+        room -= color_targets[color]
+    return color_targets
+
+
+def value(balance, ml):
+    """ The ml bought, weighted by color priority, as knapsack_plan scores it. """
+    priority = wholesale.color_priority(balance)
+    return sum((len(priority) - rank) * ml[color] for rank, (color, _) in enumerate(priority))
+
+
+def brute_force_value(wholesale_catalog, balance, ml_capacity):
+    budget = int(wholesale.purchase_budget(balance.gold)[0])
+    color_targets = targets(balance, ml_capacity)
+    single_color = [barrel for barrel in wholesale_catalog if wholesale.barrel_color(barrel)]
+    best = 0
+    for quantities in itertools.product(*(range(barrel.quantity + 1) for barrel in single_color)):
+        plan = [{"sku": barrel.sku, "quantity": quantity}
+                for barrel, quantity in zip(single_color, quantities) if quantity]
+        gold, ml = totals(wholesale_catalog, plan)
+        if gold <= budget and all(ml[color] <= color_targets[color] for color in ml):
+            best = max(best, value(balance, ml))
+    return best
+
+
+@pytest.mark.parametrize("wholesale_catalog", SMALL_CATALOGS)
+@pytest.mark.parametrize("balance", BALANCES)
+@pytest.mark.parametrize("ml_capacity", [1000, 3000, 10000])
+def test_knapsack_matches_brute_force(wholesale_catalog, balance, ml_capacity):
+    plan = wholesale.knapsack_plan(wholesale_catalog, balance, ml_capacity)
+    _, ml = totals(wholesale_catalog, plan)
+    assert value(balance, ml) == brute_force_value(wholesale_catalog, balance, ml_capacity)
+
+
+@pytest.mark.parametrize("planner", [wholesale.heuristic_plan, wholesale.knapsack_plan])
+@pytest.mark.parametrize("wholesale_catalog", SMALL_CATALOGS)
+@pytest.mark.parametrize("balance", BALANCES)
+@pytest.mark.parametrize("ml_capacity", [0, 1000, 3000, 10000])
+def test_plans_stay_within_gold_and_ml_capacity(planner, wholesale_catalog, balance, ml_capacity):
+    plan = planner(wholesale_catalog, balance, ml_capacity)
+    gold, ml = totals(wholesale_catalog, plan)
+    assert gold <= balance.gold
+    assert sum(ml.values()) <= max(0, wholesale.ml_room(balance, ml_capacity))
+
+
+def test_index_catalog_groups_by_color_and_size_in_catalog_order():
+    wholesale_catalog = SMALL_CATALOGS[2] + [barrel("SMALL", "RED", 500, 0), barrel("SMALL", "RED", 500, 100, quantity=0)]
+    index = wholesale.index_catalog(wholesale_catalog)
+    assert set(index) == {("green", "SMALL"), ("dark", "MEDIUM"), ("blue", "MINI")}
+    assert [barrel.sku for barrel in index[("green", "SMALL")]] == ["SMALL_GREEN_BARREL", "SMALL_GREEN_BARREL_SALE"]
+
+
+def test_heuristic_buys_the_first_offer_listed():
+    # As before the catalog was indexed, the first affordable offer of a
+    # (color, size) is bought even if a later one is cheaper per ml
+    plan = wholesale.heuristic_plan(SMALL_CATALOGS[2], Balance(1500, 0, 0, 0, 0), 10000)
+    skus = [entry["sku"] for entry in plan]
+    assert "SMALL_GREEN_BARREL" in skus
+    assert "SMALL_GREEN_BARREL_SALE" not in skus